@@ -1,115 +1,151 @@
-import pandas as pd
-import geopandas as gpd
-import os
-
-# --- 1. CONFIGURATION ---
-results_path = r'C:\'
-
-print("--- LOADING COMPONENTS ---")
-
-# A. THE SPINE (Spatial Keys)
-keys_path = os.path.join(results_path, 'mexico_5km_grid_joined_mun_2010_2015_2020_2025.gpkg')
-# Use ignore_geometry=True for speed, we just need the IDs
-gdf_keys = gpd.read_file(keys_path, ignore_geometry=True)
-keys_df = gdf_keys[['grid_id', 'CVEGEO_2010', 'CVEGEO_2015', 'CVEGEO_2020', 'CVEGEO_2025']].copy()
-
-# CLEAN KEYS: Force 5-digit strings (01001)
-for col in ['CVEGEO_2010', 'CVEGEO_2015', 'CVEGEO_2020', 'CVEGEO_2025']:
-    keys_df[col] = keys_df[col].astype(str).str.split('.').str[0].str.zfill(5)
-
-# B. (Factory Counts)
-panel_path = os.path.join(results_path, 'FINAL_MEXICO_MANUFACTURING_PANEL.csv')
-panel_df = pd.read_csv(panel_path)
-
-# C.  (Economic Census)
-census_path = os.path.join(results_path, 'mexico_manufacturing_panel_analytical_panel.csv')
-census_raw = pd.read_csv(census_path)
-
-# --- PREPARE CENSUS DATA ---
-census_raw['sector_group'] = census_raw['rama'].astype(str).str.slice(0, 2)
-
-# Mapping: {Census Year : Target Analysis Year}
-year_map = {
-    2008: 2010, 
-    2013: 2015, 
-    2018: 2019, 
-    2023: 2025
-}
-census_raw['grid_year'] = census_raw['year'].map(year_map)
-census_raw = census_raw.dropna(subset=['grid_year'])
-
-# Clean Census Key
-census_raw['KEY_LINK'] = census_raw['cve_mun'].astype(str).str.split('.').str[0].str.zfill(5)
-
-# Aggregate & Pivot
-econ_vars = ['value_added', 'labor_total', 'wages_total', 'machinery', 'computers']
-census_agg = census_raw.groupby(['grid_year', 'KEY_LINK', 'sector_group'])[econ_vars].sum().reset_index()
-
-census_pivot = census_agg.pivot(index=['grid_year', 'KEY_LINK'], columns='sector_group', values=econ_vars)
-census_pivot.columns = [f'{col[0]}_{col[1]}' for col in census_pivot.columns]
-census_pivot = census_pivot.reset_index()
-
-# --- 3. THE MASTER MERGE ---
-print("\n--- STARTING MERGE ---")
-final_dfs = []
-sectors = ['31', '32', '33']
-
-# Map Analysis Year
-year_to_key_col = {
-    2010: 'CVEGEO_2010',
-    2015: 'CVEGEO_2015',
-    2019: 'CVEGEO_2020', # 2019 Data uses 2020 Map
-    2025: 'CVEGEO_2025'
-}
-
-for year, key_col in year_to_key_col.items():
-    print(f"Processing Year {year} (Using Map: {key_col})...")
-    
-    # Base: Grid Panel
-    cols_year = ['grid_id'] + [c for c in panel_df.columns if str(year) in c]
-    df_year = panel_df[cols_year].copy()
-    
-    # Attach Spatial ID
-    df_year = df_year.merge(keys_df[['grid_id', key_col]], on='grid_id', how='left')
-    
-    # Attach Census Data
-    census_year = census_pivot[census_pivot['grid_year'] == year].copy()
-    merged = df_year.merge(census_year, left_on=key_col, right_on='KEY_LINK', how='left')
-    
-    # Check success
-    matches = merged['value_added_31'].notna().sum()
-    print(f"  > Grid Cells with Economic Data attached: {matches}")
-    
-    # Dasymetric Distribution
-    for sector in sectors:
-        count_col = f'count_{sector}_{year}'
-        if count_col in merged.columns:
-            # 1. Muni Total
-            muni_total = merged.groupby(key_col)[count_col].transform('sum')
-            # 2. Weight
-            weights = merged[count_col] / muni_total
-            weights = weights.fillna(0)
-            # 3. Distribute
-            for var in econ_vars:
-                source = f'{var}_{sector}'
-                target = f'{var}_{sector}_{year}'
-                if source in merged.columns:
-                    merged[target] = merged[source] * weights
-                else:
-                    merged[target] = 0
-
-    # Clean up
-    cols_to_keep = ['grid_id'] + [c for c in merged.columns if str(year) in c and c not in ['KEY_LINK', key_col]]
-    final_dfs.append(merged[cols_to_keep])
-
-# --- 4. SAVE ---
-print("\n--- SAVING FINAL DATABASE ---")
-final_master = pd.DataFrame({'grid_id': panel_df['grid_id'].unique()})
-
-for df_year in final_dfs:
-    final_master = final_master.merge(df_year, on='grid_id', how='left')
-
-output_file = os.path.join(results_path, 'FINAL_FULL_SPATIAL_ECONOMIC_PANEL_READY_V2.csv')
-final_master.to_csv(output_file, index=False)
-
-print(f"DONE! File saved to: {output_file}")
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+import os
+from panel_array import GridLookup, GridPanel
+from dasymetric import AllocationOperator
+from census_stream import stream_census, mun_key
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+alloc_cache = os.path.join(results_path, 'allocation_cache')
+
+# 4-digit rama detail (count_{rama} = census establishments) for 09_Rama_Sweep;
+# [] = sectors only. Each variable adds one column per rama and year.
+RAMA_VARS = ['count', 'labor_total', 'machinery']
+
+print("--- LOADING COMPONENTS ---")
+
+# A. THE SPINE (Spatial Keys)
+keys_path = os.path.join(results_path, 'mexico_5km_grid_joined_mun_2010_2015_2020_2025.gpkg')
+# Use ignore_geometry=True for speed, we just need the IDs
+gdf_keys = gpd.read_file(keys_path, ignore_geometry=True)
+keys_df = gdf_keys[['grid_id', 'CVEGEO_2010', 'CVEGEO_2015', 'CVEGEO_2020', 'CVEGEO_2025']].copy()
+
+# CLEAN KEYS: Integer municipality keys (01001 -> 1001), no string work
+for col in ['CVEGEO_2010', 'CVEGEO_2015', 'CVEGEO_2020', 'CVEGEO_2025']:
+    keys_df[col] = mun_key(keys_df[col]).array
+
+# B. (Factory Counts)
+panel_path = os.path.join(results_path, 'FINAL_MEXICO_MANUFACTURING_PANEL.csv')
+panel_df = pd.read_csv(panel_path)
+
+# C.  (Economic Census)
+census_path = os.path.join(results_path, 'mexico_manufacturing_panel_analytical_panel.csv')
+
+# --- PREPARE CENSUS DATA ---
+# Mapping: {Census Year : Target Analysis Year}
+year_map = {
+    2008: 2010, 
+    2013: 2015, 
+    2018: 2019, 
+    2023: 2025
+}
+
+# Aggregate (streamed in chunks: only year x municipality x 2-digit sector
+# totals are ever held in memory) & Pivot
+econ_vars = ['value_added', 'labor_total', 'wages_total', 'machinery', 'computers']
+census_agg = stream_census(census_path, econ_vars, level=2, year_map=year_map)
+census_agg = census_agg.rename(columns={'year': 'grid_year', 'cve_mun': 'KEY_LINK', 'naics': 'sector_group'})
+
+census_pivot = census_agg.pivot(index=['grid_year', 'KEY_LINK'], columns='sector_group', values=econ_vars)
+census_pivot.columns = [f'{col[0]}_{col[1]}' for col in census_pivot.columns]
+census_pivot = census_pivot.reset_index()
+
+# Same at the 4-digit rama level, with the number of establishments as count
+if RAMA_VARS:
+    rama_agg = stream_census(census_path, [v for v in RAMA_VARS if v != 'count'], level=4,
+                             year_map=year_map, count='count')
+    rama_agg = rama_agg.rename(columns={'year': 'grid_year', 'cve_mun': 'KEY_LINK', 'naics': 'rama'})
+    rama_pivot = rama_agg.pivot(index=['grid_year', 'KEY_LINK'], columns='rama', values=RAMA_VARS)
+    rama_pivot.columns = [f'{col[0]}_{col[1]}' for col in rama_pivot.columns]
+    rama_pivot = rama_pivot.reset_index()
+    ramas = sorted(str(r) for r in rama_agg['rama'].unique())
+    print(f"Rama detail: {len(ramas)} ramas x {RAMA_VARS}")
+
+# --- 3. THE MASTER MERGE ---
+print("\n--- STARTING MERGE ---")
+sectors = ['31', '32', '33']
+
+# Map Analysis Year
+year_to_key_col = {
+    2010: 'CVEGEO_2010',
+    2015: 'CVEGEO_2015',
+    2019: 'CVEGEO_2020', # 2019 Data uses 2020 Map
+    2025: 'CVEGEO_2025'
+}
+
+# The panel is balanced: one row per grid cell, in panel_df order. Everything
+# below is attached by row position instead of merging on grid_id.
+grid = GridLookup(panel_df['grid_id'].to_numpy())
+key_rows = GridLookup(keys_df['grid_id'].to_numpy()).rows(grid.grid_ids)
+econ = GridPanel(grid, year_to_key_col.keys(),
+                 [f'{var}_{sector}' for sector in sectors for var in econ_vars], fill=np.nan)
+final_cols = {'grid_id': grid.grid_ids}
+
+for year, key_col in year_to_key_col.items():
+    print(f"Processing Year {year} (Using Map: {key_col})...")
+    
+    # Base: Grid Panel
+    cols_year = [c for c in panel_df.columns if str(year) in c]
+    for c in cols_year:
+        final_cols[c] = panel_df[c].to_numpy()
+    
+    # Attach Spatial ID (grid row -> municipality code)
+    cell_mun = keys_df[key_col].iloc[np.clip(key_rows, 0, None)].reset_index(drop=True).where(key_rows >= 0)
+    
+    # Census for this year, one row per municipality key
+    census_year = census_pivot[census_pivot['grid_year'] == year].set_index('KEY_LINK')
+    
+    # Dasymetric Distribution: one sparse municipality -> grid operator per
+    # year and sector (weights = establishment counts), applied to all census
+    # variables of that sector in a single product.
+    for sector in sectors:
+        count_col = f'count_{sector}_{year}'
+        if count_col in panel_df.columns:
+            alloc = AllocationOperator.cached(alloc_cache, cell_mun, panel_df[count_col].to_numpy())
+            sources = [f'{var}_{sector}' for var in econ_vars if f'{var}_{sector}' in census_year.columns]
+            census_mun = alloc.align(census_year, sources)
+            if sector == sectors[0]:
+                # Check success
+                matches = np.count_nonzero(~np.isnan(alloc.distribute(census_mun[:, 0])))
+                print(f"  > Grid Cells with Economic Data attached: {matches}")
+            distributed = alloc.distribute(census_mun)
+            
+            # Consistency: grid values must add back up to the census where the
+            # municipality has establishments
+            back = alloc.aggregate(distributed)
+            covered = np.asarray(alloc.matrix.sum(axis=1)).ravel() > 0
+            gap = np.nanmax(np.abs(back[covered] - census_mun[covered]), initial=0)
+            if gap > 1e-6 * max(np.nanmax(np.abs(census_mun), initial=0), 1):
+                print(f"  [!] Sector {sector}: allocation does not add up (max gap {gap:.3g})")
+            
+            for var in econ_vars:
+                source = f'{var}_{sector}'
+                target = f'{var}_{sector}'
+                if source in sources:
+                    econ[target, year] = distributed[:, sources.index(source)]
+                else:
+                    econ[target, year] = 0
+                final_cols[f'{target}_{year}'] = econ[target, year]
+
+            # Rama detail: the grid counts are by sector only, so each rama of
+            # the sector is spread with the sector's weights (same operator)
+            if RAMA_VARS:
+                # a municipality in the census without a given rama has none of it
+                rama_year = rama_pivot[rama_pivot['grid_year'] == year].set_index('KEY_LINK').fillna(0)
+                targets = [f'{var}_{rama}' for rama in ramas if rama.startswith(sector) for var in RAMA_VARS]
+                sources = [t for t in targets if t in rama_year.columns]
+                distributed = alloc.distribute(alloc.align(rama_year, sources))
+                for target in targets:
+                    final_cols[f'{target}_{year}'] = (distributed[:, sources.index(target)]
+                                                      if target in sources else np.zeros(len(grid.grid_ids)))
+
+# --- 4. SAVE ---
+print("\n--- SAVING FINAL DATABASE ---")
+final_master = pd.DataFrame(final_cols)
+
+output_file = os.path.join(results_path, 'FINAL_FULL_SPATIAL_ECONOMIC_PANEL_READY_V2.csv')
+final_master.to_csv(output_file, index=False)
+
+print(f"DONE! File saved to: {output_file}")
@@ -1,94 +1,114 @@
-import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point
-import os
-
-# --- 1. CONFIGURATION ---
-results_path = r'C:\03 Results'
-
-# We need the Grid GPKG to get the exact CRS (Projection)
-grid_path = os.path.join(results_path, 'mexico_5km_grid_master.gpkg')
-# We need the Panel CSV to add the columns to
-panel_path = os.path.join(results_path, 'MEXICO_SPATIAL_PANEL_LONG_WITH_COORDS.csv')
-
-print("Loading Data...")
-gdf_grid = gpd.read_file(grid_path)
-df_panel = pd.read_csv(panel_path)
-
-# --- 2. DEFINE EXOGENOUS ANCHORS (Lat/Lon) ---
-# We define these manually. 
-anchors_data = {
-    'name': [
-        'Border_Laredo', 'Border_Juarez', 'Border_Tijuana', 
-        'Market_CDMX', 
-        'Port_Manzanillo', 'Port_Veracruz'
-    ],
-    'type': [
-        'border', 'border', 'border', 
-        'market', 
-        'port', 'port'
-    ],
-    'lat': [
-        27.5038, 31.7333, 32.5149,  # Borders
-        19.4326,                    # CDMX
-        19.0522, 19.1738            # Ports
-    ],
-    'lon': [
-        -99.5073, -106.4825, -117.0382, 
-        -99.1332, 
-        -104.3159, -96.1342
-    ]
-}
-
-# Create a GeoDataFrame for anchors
-gdf_anchors = gpd.GeoDataFrame(
-    anchors_data,
-    geometry=gpd.points_from_xy(anchors_data['lon'], anchors_data['lat']),
-    crs="EPSG:4326" # Standard Lat/Lon
-)
-
-# --- 3. REPROJECT TO MATCH THE GRID ---
-# We convert the anchors to Meters (LCC) to match the grid.
-print(f"Projecting Anchors to match Grid CRS: {gdf_grid.crs}")
-gdf_anchors = gdf_anchors.to_crs(gdf_grid.crs)
-
-# --- 4. CALCULATE DISTANCES ---
-print("Calculating Exogenous Variables...")
-
-# We calculate distance from every Grid Centroid -> Nearest Anchor of that type
-# Get Grid Centroids
-centroids = gdf_grid.geometry.centroid
-
-# A. Distance to USA (Min distance to ANY border crossing)
-borders = gdf_anchors[gdf_anchors['type'] == 'border'].geometry.unary_union
-# Calculate distance (in meters), divide by 1000 for km
-gdf_grid['dist_usa_km'] = centroids.distance(borders) / 1000
-
-# B. Distance to CDMX (Distance to specific point)
-cdmx = gdf_anchors[gdf_anchors['name'] == 'Market_CDMX'].geometry.iloc[0]
-gdf_grid['dist_cdmx_km'] = centroids.distance(cdmx) / 1000
-
-# C. Distance to Port (Min distance to ANY port)
-ports = gdf_anchors[gdf_anchors['type'] == 'port'].geometry.unary_union
-gdf_grid['dist_port_km'] = centroids.distance(ports) / 1000
-
-# --- 5. MERGE BACK TO PANEL ---
-dist_features = gdf_grid[['grid_id', 'dist_usa_km', 'dist_cdmx_km', 'dist_port_km']]
-
-# Merge
-print("Merging with Panel Data...")
-df_final = df_panel.merge(dist_features, on='grid_id', how='left')
-
-# Save
-output_file = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
-df_final.to_csv(output_file, index=False)
-
-print("\n" + "="*50)
-print("SUCCESS! Variable Construction Complete.")
-print(f"Saved to: {output_file}")
-print("="*50)
-print("New Variables for Regression/Neural Network:")
-print("1. dist_usa_km  (Proxy for Nearshoring/USMCA)")
-print("2. dist_cdmx_km (Proxy for Domestic Market Potential)")
-print("3. dist_port_km (Proxy for International Logistics)")
-
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+import os
+from panel_array import GridLookup
+from grid_dbscan import point_coords
+from anchor_distance import load_anchors, distance_features
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\03 Results'
+
+# We need the Grid GPKG to get the exact CRS (Projection)
+grid_path = os.path.join(results_path, 'mexico_5km_grid_master.gpkg')
+# We need the Panel CSV to add the columns to
+panel_path = os.path.join(results_path, 'MEXICO_SPATIAL_PANEL_LONG_WITH_COORDS.csv')
+
+print("Loading Data...")
+gdf_grid = gpd.read_file(grid_path)
+df_panel = pd.read_csv(panel_path)
+
+# --- 2. DEFINE EXOGENOUS ANCHORS (Lat/Lon) ---
+# Anchors are read from a table (anchor_id, name, type, lat, lon, optional
+# weight), so border crossings, ports or metro areas can be added without
+# touching this script. If it does not exist yet, it is created from the
+# original six anchors below.
+anchors_path = os.path.join(results_path, 'exogenous_anchors.csv')
+
+default_anchors = {
+    'name': [
+        'Border_Laredo', 'Border_Juarez', 'Border_Tijuana', 
+        'Market_CDMX', 
+        'Port_Manzanillo', 'Port_Veracruz'
+    ],
+    'type': [
+        'border', 'border', 'border', 
+        'market', 
+        'port', 'port'
+    ],
+    'lat': [
+        27.5038, 31.7333, 32.5149,  # Borders
+        19.4326,                    # CDMX
+        19.0522, 19.1738            # Ports
+    ],
+    'lon': [
+        -99.5073, -106.4825, -117.0382, 
+        -99.1332, 
+        -104.3159, -96.1342
+    ]
+}
+if not os.path.exists(anchors_path):
+    pd.DataFrame(default_anchors).to_csv(anchors_path, index_label='anchor_id')
+    print(f"Anchor table created: {anchors_path}")
+
+# Feature -> anchors it is measured to (nearest anchor of the selection)
+DISTANCE_FEATURES = {
+    'usa': "type == 'border'",        # Min distance to ANY border crossing
+    'cdmx': "name == 'Market_CDMX'",  # Distance to a specific point
+    'port': "type == 'port'",         # Min distance to ANY port
+}
+# Optional extras: mean distance to the K nearest anchors of each feature, and
+# gravity market access {feature: distance decay} weighted by the 'weight' column
+K_NEAREST = None
+MARKET_ACCESS = None
+
+# --- 3. REPROJECT TO MATCH THE GRID ---
+# We convert the anchors to Meters (LCC) to match the grid.
+print(f"Projecting Anchors to match Grid CRS: {gdf_grid.crs}")
+anchors = load_anchors(anchors_path, gdf_grid.crs)
+print(f"  {len(anchors)} anchors: {anchors['type'].value_counts().to_dict()}")
+
+# --- 4. CALCULATE DISTANCES ---
+print("Calculating Exogenous Variables...")
+
+# Distance from every Grid Centroid -> Nearest Anchor of that feature (KD-tree, in km)
+centroids = point_coords(gdf_grid.geometry.centroid)
+features = distance_features(centroids, anchors, DISTANCE_FEATURES,
+                             k=K_NEAREST, gravity=MARKET_ACCESS)
+feature_cols = list(features.columns)
+for col in feature_cols:
+    gdf_grid[col] = features[col].to_numpy()
+
+# --- 5. MERGE BACK TO PANEL ---
+dist_features = gdf_grid[['grid_id'] + feature_cols]
+
+# Attach by grid row (the long panel repeats each grid_id once per year)
+print("Merging with Panel Data...")
+df_final = df_panel.copy()
+grid_rows = GridLookup(dist_features['grid_id'].to_numpy()).rows(df_final['grid_id'].to_numpy())
+for col in feature_cols:
+    col_values = dist_features[col].to_numpy()
+    # anchor ids stay integers (-1 = grid_id not in the grid file)
+    fill = -1 if col_values.dtype.kind in 'iu' else np.nan
+    values = np.full(len(df_final), fill, dtype=col_values.dtype)
+    values[grid_rows >= 0] = col_values[grid_rows[grid_rows >= 0]]
+    df_final[col] = values
+
+# Save
+output_file = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+df_final.to_csv(output_file, index=False)
+
+print("\n" + "="*50)
+print("SUCCESS! Variable Construction Complete.")
+print(f"Saved to: {output_file}")
+print("="*50)
+print("New Variables for Regression/Neural Network:")
+print("1. dist_usa_km  (Proxy for Nearshoring/USMCA)")
+print("2. dist_cdmx_km (Proxy for Domestic Market Potential)")
+print("3. dist_port_km (Proxy for International Logistics)")
+print("4. nearest_*_id (anchor_id of the nearest anchor, see exogenous_anchors.csv)")
+base_cols = {f'{p}_{f}_{s}' for f in DISTANCE_FEATURES for p, s in [('dist', 'km'), ('nearest', 'id')]}
+extra_cols = [c for c in feature_cols if c not in base_cols]
+if extra_cols:
+    print(f"Extra: {', '.join(extra_cols)}")
+
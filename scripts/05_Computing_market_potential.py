@@ -0,0 +1,83 @@
+import pandas as pd
+import numpy as np
+import os
+from panel_array import GridPanel
+from grid_index import GridIndex
+from market_potential import potential_lattice, check_potential, kernel_name
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\03 Results'
+
+# Panel written by 05_Computing_distance_based_variables.py; the market
+# potential columns are added to it in place
+panel_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+
+grid_size = 5000  # metres
+
+# Masses M_j (one potential per variable and year)
+MASS_VARS = ['count_total', 'count_31', 'count_32', 'count_33']
+
+# Decay kernels, distances in km: ('exp', tau) -> exp(-d/tau), ('pow', theta) -> d^-theta
+KERNELS = [('exp', 25), ('exp', 50), ('exp', 100), ('pow', 1)]
+
+# Kernel truncation (km); None = every other cell in the country, which makes
+# the FFTs twice the lattice in each direction (many GB on a 1 km grid)
+CUTOFF_KM = 300
+MEMORY_MB = 512   # budget for one chunk of FFT'd year x sector channels
+
+# Spot check against a dense sum: cells sampled, and the absolute tolerance
+# as a fraction of the largest total mass (FFT round-off scales with it)
+CHECK_SAMPLE = 200
+CHECK_TOL = 1e-10
+
+# --- 2. LOAD DATA ---
+print("Loading Data...")
+# Full precision: the result is written back over this file, so it must not
+# come from the compact (float32) panel cache
+df = pd.read_csv(panel_path)
+# Re-running replaces the previous market potential columns
+df = df[[c for c in df.columns if not c.startswith('mp_')]]
+
+panel = GridPanel.from_long(df, MASS_VARS + ['x_coord', 'y_coord'])
+n, T, K = len(panel.grid_ids), len(panel.years), len(MASS_VARS)
+# Centroids do not change over time
+x, y = panel['x_coord'][:, 0], panel['y_coord'][:, 0]
+
+# --- 3. MARKET POTENTIAL ---
+# MP_i = sum_{j != i} M_j * f(d_ij), for every year, sector and kernel in one pass
+print(f"Computing market potential for {n} cells x {T} years x {K} variables, "
+      f"kernels: {', '.join(kernel_name(*k) for k in KERNELS)}")
+masses = np.stack([panel[v] for v in MASS_VARS], axis=2).reshape(n, T * K)
+grid_index = GridIndex.from_centroids(panel.grid_ids, x, y, size=grid_size)
+mp = potential_lattice(grid_index, masses, KERNELS, cutoff_km=CUTOFF_KM, memory_mb=MEMORY_MB)
+
+# Dense brute-force sums for a sample of cells
+tol = CHECK_TOL * max(np.abs(masses).sum(axis=0).max(), 1.0)
+errors = check_potential(grid_index, masses, KERNELS, mp, cutoff_km=CUTOFF_KM, sample=CHECK_SAMPLE)
+print(f"  max |FFT - dense| on {CHECK_SAMPLE} cells: "
+      + ', '.join(f'{k} {e:.2e}' for k, e in errors.items()) + f" (tolerance {tol:.2e})")
+bad = {k: e for k, e in errors.items() if e > tol}
+if bad:
+    raise RuntimeError(f"FFT market potential differs from the dense sum: {bad}")
+
+new_cols = []
+for kname, values in mp.items():
+    values = values.reshape(n, T, K)
+    for k, var in enumerate(MASS_VARS):
+        col = f"mp_{var.replace('count_', '')}_{kname}"
+        panel[col] = values[:, :, k]
+        new_cols.append(col)
+
+# --- 4. MERGE BACK TO PANEL ---
+df_final = df.copy()
+for col in new_cols:
+    df_final[col] = panel.take(col, df_final['grid_id'].to_numpy(), df_final['year'].to_numpy())
+
+df_final.to_csv(panel_path, index=False)
+
+print("\n" + "="*50)
+print("SUCCESS! Market Potential Complete.")
+print(f"Saved to: {panel_path}")
+print("="*50)
+print(f"New Variables: mp_{{sector}}_{{kernel}} ({len(new_cols)} columns)")
+print(df_final[new_cols].describe().T[['mean', 'min', 'max']].round(2).to_string())
@@ -1,145 +1,206 @@
-import pandas as pd
-import numpy as np
-import os
-import statsmodels.formula.api as smf
-from libpysal.weights import KNN
-import libpysal
-
-# --- 1. CONFIGURATION ---
-results_path = r'C:\'
-output_folder = os.path.join(results_path, '00_Final_Paper_Figures')
-file_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
-
-print("Loading Data...")
-df = pd.read_csv(file_path)
-
-# --- 2. DATA PREP ---
-target_sector = '33'
-df['dist_usa_100km'] = df['dist_usa_km'] / 100
-df['dist_cdmx_100km'] = df['dist_cdmx_km'] / 100
-df['dist_port_100km'] = df['dist_port_km'] / 100
-df['trend'] = df['year'] - 2010
-
-df['X_USA_Trend'] = df['dist_usa_100km'] * df['trend']
-df['X_CDMX_Trend'] = df['dist_cdmx_100km'] * df['trend']
-df['X_Port_Trend'] = df['dist_port_100km'] * df['trend']
-df['X_Cluster'] = df.get(f'is_cluster_{target_sector}', df.get('is_cluster', 0))
-df['Y_Count'] = df[f'count_{target_sector}']
-
-# Spatial Lags
-print("Building Spatial Weights...")
-df_geo = df[['grid_id', 'x_coord', 'y_coord']].drop_duplicates()
-coords = list(zip(df_geo['x_coord'], df_geo['y_coord']))
-w = KNN.from_array(coords, k=8)
-lags = []
-for year in df['year'].unique():
-    sub = df[df['year'] == year].set_index('grid_id').reindex(df_geo['grid_id']).fillna(0)
-    lag_cluster = libpysal.weights.lag_spatial(w, sub['X_Cluster'])
-    s = pd.Series(lag_cluster, index=df_geo['grid_id'], name='W_X_Cluster').reset_index()
-    s['year'] = year
-    lags.append(s)
-df = df.merge(pd.concat(lags), on=['grid_id', 'year'], how='left')
-
-# CLEAN DATA (Strict match)
-vars_needed = ['Y_Count', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster', 'W_X_Cluster', 'year', 'grid_id']
-df_reg = df[vars_needed].dropna().copy()
-print(f"Sample Size: {len(df_reg)}")
-
-# --- 3. ESTIMATE MODELS ---
-formula = "X_USA_Trend + X_CDMX_Trend + X_Port_Trend + X_Cluster + C(year)"
-
-print("1. Estimating OLS...")
-mod_ols = smf.ols(f"Y_Count ~ {formula}", data=df_reg).fit(cov_type='cluster', cov_kwds={'groups': df_reg['grid_id']})
-
-print("2. Estimating Poisson (Robust)...")
-mod_ppml = smf.poisson(f"Y_Count ~ {formula}", data=df_reg).fit(disp=0, cov_type='cluster', cov_kwds={'groups': df_reg['grid_id']})
-
-print("3. Estimating Spatial Poisson...")
-mod_sp = smf.poisson(f"Y_Count ~ {formula} + W_X_Cluster", data=df_reg).fit(disp=0, cov_type='cluster', cov_kwds={'groups': df_reg['grid_id']})
-
-# --- 4. FORMATTING FUNCTION ---
-def get_stars(p):
-    if p < 0.01: return "***"
-    if p < 0.05: return "**"
-    if p < 0.1: return "*"
-    return ""
-
-def extract_column(res, model_type):
-    # 1. Coefficients & SEs
-    params = res.params
-    se = res.bse
-    pvals = res.pvalues
-    
-    # Format: "0.123*** (0.04)"
-    formatted_coeffs = []
-    for var in params.index:
-        val = f"{params[var]:.4f}{get_stars(pvals[var])}"
-        err = f"({se[var]:.4f})"
-        formatted_coeffs.append(val)
-        formatted_coeffs.append(err) # Add SE as a separate row below
-    
-    # Create Index with interleaved SE rows
-    idx = []
-    for var in params.index:
-        idx.append(var)
-        idx.append(f"{var}_SE")
-        
-    col_series = pd.Series(formatted_coeffs, index=idx)
-    
-    # 2. Diagnostics
-    n_obs = int(res.nobs)
-    llf = f"{res.llf:.1f}"
-    aic = f"{res.aic:.1f}"
-    
-    # R-squared Logic
-    if model_type == 'OLS':
-        r2 = f"{res.rsquared_adj:.3f}"
-        r2_label = "Adj. R-squared"
-    else:
-        # Pseudo R-squared (McFadden) = 1 - (LL_model / LL_null)
-        # Statsmodels usually calculates this as res.prsquared
-        r2 = f"{res.prsquared:.3f}"
-        r2_label = "Pseudo R-squared"
-
-    diagnostics = pd.Series([n_obs, r2, llf, aic], 
-                            index=['Observations', r2_label, 'Log Likelihood', 'AIC'])
-    
-    return pd.concat([col_series, diagnostics])
-
-# --- 5. BUILD TABLE ---
-col_1 = extract_column(mod_ols, 'OLS')
-col_2 = extract_column(mod_ppml, 'Poisson')
-col_3 = extract_column(mod_sp, 'Spatial')
-
-# Merge into one DataFrame
-# We align on index. Note: OLS might have different R2 label, so we align carefully
-final_table = pd.concat([col_1, col_2, col_3], axis=1, keys=['(1) OLS', '(2) Poisson', '(3) Spatial'])
-
-# Reorder Rows for Readability
-# We want structural vars at top, Year dummies at bottom, Diagnostics at very bottom
-structural_vars = ['X_Cluster', 'X_Cluster_SE', 
-                   'W_X_Cluster', 'W_X_Cluster_SE',
-                   'X_USA_Trend', 'X_USA_Trend_SE', 
-                   'X_CDMX_Trend', 'X_CDMX_Trend_SE', 
-                   'X_Port_Trend', 'X_Port_Trend_SE']
-
-# Filter explicitly to control order
-# We extract structural, then diagnostics
-final_view = final_table.loc[structural_vars]
-diagnostics_view = final_table.loc[['Observations', 'Adj. R-squared', 'Pseudo R-squared', 'Log Likelihood', 'AIC']]
-
-# Combine
-paper_ready_table = pd.concat([final_view, diagnostics_view])
-
-# --- 6. EXPORT ---
-csv_path = os.path.join(output_folder, 'Table_1_Regression_Results_Final.csv')
-paper_ready_table.to_csv(csv_path)
-
-print("\n" + "="*80)
-print("FINAL PAPER TABLE PREVIEW")
-print("="*80)
-print(paper_ready_table.fillna("-"))
-print("="*80)
-
-print(f"[-] Saved to: {csv_path}")
-
+import pandas as pd
+import numpy as np
+import os
+import matplotlib.pyplot as plt
+from panel_store import load_panel
+from panel_array import GridPanel
+from spatial_weights import knn_weights, lag_panel
+from ppml_hdfe import ppml_hdfe
+from estimation import EstimationSession
+from cluster_cov import wild_cluster_bootstrap
+from grid_index import GridIndex
+from spatial_diagnostics import residual_diagnostics, draw_lisa
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+output_folder = os.path.join(results_path, '00_Final_Paper_Figures')
+file_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+weights_cache = os.path.join(results_path, 'weights_cache')
+
+# Wild cluster bootstrap (restricted, H0: coefficient = 0) for the OLS column's stars
+N_BOOT = 9999                # 0 = analytic clustered p-values only
+BOOT_WEIGHTS = 'rademacher'  # or 'webb' (few clusters)
+BOOT_SEED = 42
+BOOT_WORKERS = None          # None = in process; N = process pool (run under a __main__ guard on Windows)
+
+# Residual spatial autocorrelation (Moran's I / LISA on the KNN weights)
+N_PERM = 999                 # 0 = no permutation inference
+PERM_MEMORY_MB = 256         # budget for one chunk of (cells x permutations)
+LISA_MODEL = '(3) Spatial'   # model whose LISA map is drawn
+
+print("Loading Data...")
+df = load_panel(file_path)
+
+# --- 2. DATA PREP ---
+target_sector = '33'
+df['dist_usa_100km'] = df['dist_usa_km'] / 100
+df['dist_cdmx_100km'] = df['dist_cdmx_km'] / 100
+df['dist_port_100km'] = df['dist_port_km'] / 100
+df['trend'] = df['year'] - 2010
+
+df['X_USA_Trend'] = df['dist_usa_100km'] * df['trend']
+df['X_CDMX_Trend'] = df['dist_cdmx_100km'] * df['trend']
+df['X_Port_Trend'] = df['dist_port_100km'] * df['trend']
+df['X_Cluster'] = df.get(f'is_cluster_{target_sector}', df.get('is_cluster', 0))
+df['Y_Count'] = df[f'count_{target_sector}']
+
+# Spatial Lags
+# W is cached on disk (keyed on the coordinates and k); all years and all
+# lagged variables go through one sparse product.
+print("Building Spatial Weights...")
+df_geo = df[['grid_id', 'x_coord', 'y_coord']].drop_duplicates('grid_id')
+w = knn_weights(df_geo[['x_coord', 'y_coord']].to_numpy(), k=8, cache_dir=weights_cache)
+lag_vars = ['X_Cluster']
+
+# Dense grid x year panel in the same cell order as the weights (missing cells = 0)
+panel = GridPanel.from_long(df, lag_vars, grid_ids=df_geo['grid_id'].to_numpy())
+lag_panel(w, panel, lag_vars, prefix='W_')
+for var in lag_vars:
+    df[f'W_{var}'] = panel.take(f'W_{var}', df['grid_id'].to_numpy(), df['year'].to_numpy())
+
+# CLEAN DATA (Strict match)
+vars_needed = ['Y_Count', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster', 'W_X_Cluster', 'year', 'grid_id']
+df_reg = df[vars_needed].dropna().copy()
+print(f"Sample Size: {len(df_reg)}")
+
+# --- 3. ESTIMATE MODELS ---
+formula = "X_USA_Trend + X_CDMX_Trend + X_Port_Trend + X_Cluster + C(year)"
+
+# The design matrix is built once; (3) appends W_X_Cluster to it and starts
+# from the Poisson estimates of (2).
+session = EstimationSession(df_reg, 'Y_Count', formula, groups='grid_id')
+
+print("1-3. Estimating OLS, Poisson (Robust) and Spatial Poisson...")
+table_models = session.fit_all([
+    ('(1) OLS', 'ols', [], None),
+    ('(2) Poisson', 'poisson', [], None),
+    ('(3) Spatial', 'poisson', ['W_X_Cluster'], '(2) Poisson'),
+])
+mod_ols, mod_ppml, mod_sp = table_models.values()
+
+if N_BOOT:
+    # same grid_id clusters as the analytic errors, sorted once in the session
+    print(f"   Wild cluster bootstrap for (1) OLS ({N_BOOT} draws, {BOOT_WEIGHTS})...")
+    boot_ols = wild_cluster_bootstrap(mod_ols, session.groups, reps=N_BOOT, weights=BOOT_WEIGHTS,
+                                      seed=BOOT_SEED, max_workers=BOOT_WORKERS)
+
+print("4. Estimating Spatial Poisson with Grid & Year FE (Robustness)...")
+# Grid and year effects are absorbed, not expanded into dummies; cells with zero
+# establishments in every year carry no information and are dropped.
+mod_fe = ppml_hdfe(df_reg, 'Y_Count', ['X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster', 'W_X_Cluster'],
+                   absorb=['grid_id', 'year'], cluster='grid_id')
+
+# --- 4. FORMATTING FUNCTION ---
+def get_stars(p):
+    if p < 0.01: return "***"
+    if p < 0.05: return "**"
+    if p < 0.1: return "*"
+    return ""
+
+def extract_column(res, model_type, pvals=None):
+    # 1. Coefficients & SEs (stars from `pvals` if given, e.g. bootstrap p-values)
+    params = res.params
+    se = res.bse
+    pvals = res.pvalues if pvals is None else pvals
+    
+    # Format: "0.123*** (0.04)"
+    formatted_coeffs = []
+    for var in params.index:
+        val = f"{params[var]:.4f}{get_stars(pvals[var])}"
+        err = f"({se[var]:.4f})"
+        formatted_coeffs.append(val)
+        formatted_coeffs.append(err) # Add SE as a separate row below
+    
+    # Create Index with interleaved SE rows
+    idx = []
+    for var in params.index:
+        idx.append(var)
+        idx.append(f"{var}_SE")
+        
+    col_series = pd.Series(formatted_coeffs, index=idx)
+    
+    # 2. Diagnostics
+    n_obs = int(res.nobs)
+    llf = f"{res.llf:.1f}"
+    aic = f"{res.aic:.1f}"
+    
+    # R-squared Logic
+    if model_type == 'OLS':
+        r2 = f"{res.rsquared_adj:.3f}"
+        r2_label = "Adj. R-squared"
+    else:
+        # Pseudo R-squared (McFadden) = 1 - (LL_model / LL_null)
+        # Statsmodels usually calculates this as res.prsquared
+        r2 = f"{res.prsquared:.3f}"
+        r2_label = "Pseudo R-squared"
+
+    diagnostics = pd.Series([n_obs, r2, llf, aic], 
+                            index=['Observations', r2_label, 'Log Likelihood', 'AIC'])
+    
+    return pd.concat([col_series, diagnostics])
+
+# --- 5. BUILD TABLE ---
+col_1 = extract_column(mod_ols, 'OLS', boot_ols['p_value'] if N_BOOT else None)
+col_2 = extract_column(mod_ppml, 'Poisson')
+col_3 = extract_column(mod_sp, 'Spatial')
+col_4 = extract_column(mod_fe, 'Poisson FE')
+
+# Merge into one DataFrame
+# We align on index. Note: OLS might have different R2 label, so we align carefully
+final_table = pd.concat([col_1, col_2, col_3, col_4], axis=1, keys=['(1) OLS', '(2) Poisson', '(3) Spatial', '(4) Grid FE'])
+
+# Reorder Rows for Readability
+# We want structural vars at top, Year dummies at bottom, Diagnostics at very bottom
+structural_vars = ['X_Cluster', 'X_Cluster_SE', 
+                   'W_X_Cluster', 'W_X_Cluster_SE',
+                   'X_USA_Trend', 'X_USA_Trend_SE', 
+                   'X_CDMX_Trend', 'X_CDMX_Trend_SE', 
+                   'X_Port_Trend', 'X_Port_Trend_SE']
+
+# Filter explicitly to control order
+# We extract structural, then diagnostics
+final_view = final_table.loc[structural_vars]
+diagnostics_view = final_table.loc[['Observations', 'Adj. R-squared', 'Pseudo R-squared', 'Log Likelihood', 'AIC']]
+
+# Combine
+paper_ready_table = pd.concat([final_view, diagnostics_view])
+
+# --- 6. EXPORT ---
+csv_path = os.path.join(output_folder, 'Table_1_Regression_Results_Final.csv')
+paper_ready_table.to_csv(csv_path)
+
+print("\n" + "="*80)
+print("FINAL PAPER TABLE PREVIEW")
+print("="*80)
+print(paper_ready_table.fillna("-"))
+print("="*80)
+
+print(f"[-] Saved to: {csv_path}")
+
+# --- 7. RESIDUAL DIAGNOSTICS (Moran's I & LISA) ---
+# Pearson residuals of every column, year by year, on the same KNN(k=8) W as
+# the spatial lag
+print("Testing residual spatial autocorrelation (Moran's I, LISA)...")
+moran_tables, lisa_tables = [], {}
+for name, res in {**table_models, '(4) Grid FE': mod_fe}.items():
+    moran_g, lisa_tables[name] = residual_diagnostics(res, df_reg, w=w, w_ids=df_geo['grid_id'].to_numpy(),
+                                                      permutations=N_PERM, seed=BOOT_SEED,
+                                                      memory_mb=PERM_MEMORY_MB)
+    moran_tables.append(moran_g.assign(model=name))
+moran_df = pd.concat(moran_tables)[['model', 'year', 'n', 'I', 'EI', 'EI_sim', 'z_sim', 'p_sim']]
+print(moran_df.to_string(index=False))
+moran_path = os.path.join(output_folder, 'Table_1c_Residual_Moran.csv')
+moran_df.to_csv(moran_path, index=False)
+print(f"[-] Moran's I table saved to: {moran_path}")
+
+# LISA cluster map, latest year
+lisa = lisa_tables[LISA_MODEL]
+lisa_year = lisa['year'].max()
+grid_index = GridIndex.from_centroids(df_geo['grid_id'], df_geo['x_coord'], df_geo['y_coord'], size=5000)
+fig, ax = plt.subplots(figsize=(12, 10))
+draw_lisa(ax, grid_index, lisa[lisa['year'] == lisa_year],
+          title=f"LISA of Pearson Residuals: {LISA_MODEL}, {lisa_year}")
+lisa_path = os.path.join(output_folder, 'Figure_LISA_Stage1.png')
+plt.savefig(lisa_path, dpi=300, bbox_inches='tight')
+print(f"[-] LISA map saved to: {lisa_path}")
+
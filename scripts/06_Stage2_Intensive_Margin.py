@@ -1,126 +1,253 @@
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import os
-import statsmodels.formula.api as smf
-
-# --- 1. CONFIGURATION ---
-results_path = r'C:\'
-output_folder = os.path.join(results_path, '00_Final_Paper_Figures')
-file_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
-
-print("Loading Data...")
-df = pd.read_csv(file_path)
-
-# --- 2. DATA PREP ---
-target_sector = '33'
-df['dist_usa_100km'] = df['dist_usa_km'] / 100
-df['dist_cdmx_100km'] = df['dist_cdmx_km'] / 100
-df['dist_port_100km'] = df['dist_port_km'] / 100
-df['trend'] = df['year'] - 2010
-
-# Interactions
-df['X_USA_Trend'] = df['dist_usa_100km'] * df['trend']
-df['X_CDMX_Trend'] = df['dist_cdmx_100km'] * df['trend']
-df['X_Port_Trend'] = df['dist_port_100km'] * df['trend']
-df['X_Cluster'] = df.get(f'is_cluster_{target_sector}', df.get('is_cluster', 0))
-
-# --- 3. FILTER ACTIVE CELLS ---
-df['Count_Raw'] = df[f'count_{target_sector}']
-df_active = df[df['Count_Raw'] > 0].copy()
-
-# Dependent Variable (Log K/L)
-labor = df_active[f'labor_total_{target_sector}']
-machinery = df_active[f'machinery_{target_sector}']
-df_active['K_L'] = machinery / labor.replace(0, np.nan)
-df_active['ln_K_L'] = np.log(df_active['K_L'] + 1)
-
-# Clean NAs
-vars_needed = ['ln_K_L', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster', 'year', 'grid_id']
-df_reg = df_active[vars_needed].dropna().copy()
-print(f"Phase 2 Sample Size: {len(df_reg)}")
-
-# --- 4. RUN REGRESSION (POOLED OLS) ---
-print("Estimating Phase 2 Model...")
-mod_pooled = smf.ols("ln_K_L ~ X_USA_Trend + X_CDMX_Trend + X_Port_Trend + X_Cluster + C(year)", 
-                     data=df_reg).fit(cov_type='cluster', cov_kwds={'groups': df_reg['grid_id']})
-
-# Export Table for Documentation
-# Extract coefficients and diagnostics
-params = mod_pooled.params
-bse = mod_pooled.bse
-pvals = mod_pooled.pvalues
-ci = mod_pooled.conf_int(alpha=0.05)
-
-table_df = pd.DataFrame({
-    'Coeff': params,
-    'SE': bse,
-    'P_Value': pvals,
-    'CI_Lower': ci[0],
-    'CI_Upper': ci[1]
-})
-
-# Add Diagnostics rows at the bottom
-diag_df = pd.DataFrame({
-    'Coeff': [mod_pooled.nobs, mod_pooled.rsquared_adj, mod_pooled.aic],
-    'SE': [np.nan, np.nan, np.nan] # Empty placeholders
-}, index=['Observations', 'Adj. R-Squared', 'AIC'])
-
-final_table = pd.concat([table_df, diag_df])
-csv_path = os.path.join(output_folder, 'Table_2_Capital_Intensity.csv')
-final_table.to_csv(csv_path)
-print(f"[-] Table 2 saved to: {csv_path}")
-
-# --- 5. ROBUST PLOTTING (SPLIT LAYERS) ---
-# Prepare Plot Data
-target_vars = ['X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster']
-plot_df = table_df.loc[table_df.index.isin(target_vars)].copy()
-# Reorder to match paper logic
-plot_df = plot_df.reindex(['X_Cluster', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend'][::-1])
-
-# Assign Y-positions
-plot_df['y'] = range(len(plot_df))
-
-# SPLIT INTO TWO DATAFRAMES
-sig_df = plot_df[plot_df['P_Value'] < 0.05]
-insig_df = plot_df[plot_df['P_Value'] >= 0.05]
-
-fig, ax = plt.subplots(figsize=(10, 6))
-
-# Layer 1: Significant Points (Red)
-if not sig_df.empty:
-    xerr = [sig_df['Coeff'] - sig_df['CI_Lower'], sig_df['CI_Upper'] - sig_df['Coeff']]
-    ax.errorbar(sig_df['Coeff'], sig_df['y'], xerr=xerr, fmt='o', color='#D32F2F', 
-                capsize=5, elinewidth=2.5, markeredgewidth=2, markersize=10, 
-                label='Significant (p < 0.05)', zorder=10)
-
-# Layer 2: Insignificant Points (Gray)
-if not insig_df.empty:
-    xerr = [insig_df['Coeff'] - insig_df['CI_Lower'], insig_df['CI_Upper'] - insig_df['Coeff']]
-    ax.errorbar(insig_df['Coeff'], insig_df['y'], xerr=xerr, fmt='o', color='#9E9E9E', 
-                capsize=5, elinewidth=2.5, markeredgewidth=2, markersize=10, 
-                label='Insignificant', zorder=10)
-
-# Formatting
-labels_map = {
-    'X_Cluster': 'Cluster Bonus (Local)',
-    'X_USA_Trend': 'Nearshoring (Dist USA)',
-    'X_CDMX_Trend': 'Domestic (Dist CDMX)',
-    'X_Port_Trend': 'Global (Dist Port)'
-}
-ax.set_yticks(plot_df['y'])
-ax.set_yticklabels([labels_map.get(i, i) for i in plot_df.index], fontsize=12, fontweight='bold')
-ax.axvline(x=0, color='black', linestyle='--', linewidth=1, alpha=0.8)
-
-ax.set_xlabel('Effect on Log Capital Intensity (K/L)', fontsize=12, fontweight='bold')
-ax.set_title('Figure 7: Phase 2 - The Sophistication Test\n(Drivers of Automation in Active Factories)', fontsize=14, weight='bold')
-ax.grid(axis='x', linestyle=':', alpha=0.5)
-ax.legend(loc='lower right')
-
-# Save
-plot_path = os.path.join(output_folder, 'Figure_7_Capital_Intensity.png')
-plt.savefig(plot_path, dpi=300, bbox_inches='tight')
-print(f"[-] Figure 7 saved to: {plot_path}")
-
-plt.show()
-
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+import os
+from panel_store import load_panel
+import statsmodels.formula.api as smf
+from cluster_cov import cluster, conley, wild_cluster_bootstrap
+from multi_ols import MultiOLS
+from grid_index import GridIndex
+from spatial_diagnostics import residual_diagnostics, draw_lisa
+from spatial_weights import year_block_weights
+from spatial_ml import LogDet, spatial_ml
+import patsy
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+output_folder = os.path.join(results_path, '00_Final_Paper_Figures')
+file_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+CONLEY_CUTOFF_KM = 50 # Spatial-HAC distance cutoff
+
+# Wild cluster bootstrap for Figure 7: restricted p-values (H0: coefficient = 0) and
+# symmetric percentile-t 95% CIs (unrestricted), which set both the bars and the colours
+N_BOOT = 9999                # 0 = analytic clustered p-values / CIs only
+BOOT_WEIGHTS = 'rademacher'  # or 'webb' (few clusters)
+BOOT_CLUSTER = 'grid_id'     # any panel column, e.g. a municipality key
+BOOT_SEED = 42
+BOOT_WORKERS = None          # None = in process; N = process pool (run under a __main__ guard on Windows)
+
+# Residual spatial autocorrelation (Moran's I / LISA, KNN among each year's active cells)
+N_PERM = 999                 # 0 = no permutation inference
+PERM_MEMORY_MB = 256         # budget for one chunk of (cells x permutations)
+
+# Spatial ML robustness: W = KNN(k=8) among each year's active cells (block-diagonal by year)
+SPATIAL_MODELS = ['error', 'lag']   # spatial error (SEM) and spatial lag (SAR)
+# log|I - rho W|: 'lu' (exact sparse LU per year), 'cheb' / 'mc' (trace approximations,
+# fastest on large samples), 'eigen' (dense eigenvalues; a few thousand cells at most)
+LOGDET_METHOD = 'cheb'
+
+print("Loading Data...")
+df = load_panel(file_path)
+
+# --- 2. DATA PREP ---
+target_sector = '33'
+df['dist_usa_100km'] = df['dist_usa_km'] / 100
+df['dist_cdmx_100km'] = df['dist_cdmx_km'] / 100
+df['dist_port_100km'] = df['dist_port_km'] / 100
+df['trend'] = df['year'] - 2010
+
+# Interactions
+df['X_USA_Trend'] = df['dist_usa_100km'] * df['trend']
+df['X_CDMX_Trend'] = df['dist_cdmx_100km'] * df['trend']
+df['X_Port_Trend'] = df['dist_port_100km'] * df['trend']
+df['X_Cluster'] = df.get(f'is_cluster_{target_sector}', df.get('is_cluster', 0))
+
+# --- 3. FILTER ACTIVE CELLS ---
+df['Count_Raw'] = df[f'count_{target_sector}']
+df_active = df[df['Count_Raw'] > 0].copy()
+
+# Dependent Variable (Log K/L)
+labor = df_active[f'labor_total_{target_sector}']
+machinery = df_active[f'machinery_{target_sector}']
+df_active['K_L'] = machinery / labor.replace(0, np.nan)
+df_active['ln_K_L'] = np.log(df_active['K_L'] + 1)
+
+# Clean NAs
+vars_needed = list(dict.fromkeys(['ln_K_L', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster', 'year', 'grid_id', 'x_coord', 'y_coord', BOOT_CLUSTER]))
+df_reg = df_active[vars_needed].dropna().copy()
+print(f"Phase 2 Sample Size: {len(df_reg)}")
+
+# --- 4. RUN REGRESSION (POOLED OLS) ---
+print("Estimating Phase 2 Model...")
+ols_fit = smf.ols("ln_K_L ~ X_USA_Trend + X_CDMX_Trend + X_Port_Trend + X_Cluster + C(year)", data=df_reg).fit()
+mod_pooled = cluster(ols_fit, df_reg['grid_id'])
+
+# Alternative error structures (robustness): grid x year two-way clustering and
+# Conley spatial-HAC with a Bartlett kernel, spatial correlation within year.
+mod_2way = cluster(ols_fit, df_reg['grid_id'], df_reg['year'])
+mod_conley = conley(ols_fit, df_reg[['x_coord', 'y_coord']].to_numpy(), CONLEY_CUTOFF_KM * 1000,
+                    time=df_reg['year'].to_numpy())
+
+# Wild cluster bootstrap p-values and CIs for the structural variables
+target_vars = ['X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster']
+if N_BOOT:
+    print(f"Wild cluster bootstrap ({N_BOOT} draws, {BOOT_WEIGHTS}, clusters: {BOOT_CLUSTER})...")
+    boot = wild_cluster_bootstrap(ols_fit, df_reg[BOOT_CLUSTER], params=target_vars, reps=N_BOOT,
+                                  weights=BOOT_WEIGHTS, seed=BOOT_SEED, max_workers=BOOT_WORKERS, alpha=0.05)
+
+# Export Table for Documentation
+# Extract coefficients and diagnostics
+params = mod_pooled.params
+bse = mod_pooled.bse
+pvals = mod_pooled.pvalues
+ci = mod_pooled.conf_int(alpha=0.05)
+
+table_df = pd.DataFrame({
+    'Coeff': params,
+    'SE': bse,
+    'P_Value': pvals,
+    'CI_Lower': ci[0],
+    'CI_Upper': ci[1],
+    'SE_TwoWay_Grid_Year': mod_2way.bse,
+    f'SE_Conley_{CONLEY_CUTOFF_KM}km': mod_conley.bse
+})
+if N_BOOT:
+    table_df['P_Value_WildBoot'] = boot['p_value']
+    table_df['CI_Lower_WildBoot'] = boot['ci_lower']
+    table_df['CI_Upper_WildBoot'] = boot['ci_upper']
+
+# Add Diagnostics rows at the bottom
+diag_df = pd.DataFrame({
+    'Coeff': [mod_pooled.nobs, mod_pooled.rsquared_adj, mod_pooled.aic],
+    'SE': [np.nan, np.nan, np.nan] # Empty placeholders
+}, index=['Observations', 'Adj. R-Squared', 'AIC'])
+
+final_table = pd.concat([table_df, diag_df])
+csv_path = os.path.join(output_folder, 'Table_2_Capital_Intensity.csv')
+final_table.to_csv(csv_path)
+print(f"[-] Table 2 saved to: {csv_path}")
+
+# --- 4a. RESIDUAL DIAGNOSTICS (Moran's I & LISA) ---
+print("Testing residual spatial autocorrelation (Moran's I, LISA)...")
+moran_df, lisa = residual_diagnostics(ols_fit, df_reg, k=8, permutations=N_PERM, seed=BOOT_SEED,
+                                      memory_mb=PERM_MEMORY_MB)
+print(moran_df.to_string(index=False))
+moran_path = os.path.join(output_folder, 'Table_2c_Residual_Moran.csv')
+moran_df.to_csv(moran_path, index=False)
+print(f"[-] Moran's I table saved to: {moran_path}")
+
+# LISA cluster map, latest year (grey = cells without active firms)
+lisa_year = lisa['year'].max()
+df_geo = df[df['year'] == df['year'].max()][['grid_id', 'x_coord', 'y_coord']]
+grid_index = GridIndex.from_centroids(df_geo['grid_id'], df_geo['x_coord'], df_geo['y_coord'], size=5000)
+fig, ax = plt.subplots(figsize=(12, 10))
+draw_lisa(ax, grid_index, lisa[lisa['year'] == lisa_year],
+          title=f"LISA of Phase 2 Residuals (ln K/L), {lisa_year}")
+lisa_path = os.path.join(output_folder, 'Figure_LISA_Stage2.png')
+plt.savefig(lisa_path, dpi=300, bbox_inches='tight')
+plt.close(fig)
+print(f"[-] LISA map saved to: {lisa_path}")
+
+# --- 4b. MULTI-OUTCOME TABLE (SAME RHS, ALL SECTORS) ---
+# One factorization of the shared regressors serves every outcome; each outcome
+# keeps its own active-cell sample (count > 0 in that sector).
+print("Estimating Multi-Outcome Models...")
+rhs = "X_USA_Trend + X_CDMX_Trend + X_Port_Trend + X_Cluster + C(year)"
+# Drop rows with missing regressors (as smf.ols would) so X, outcomes and samples share one index
+df_multi = df.dropna(subset=['X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster', 'year'])
+x_all = patsy.dmatrix(rhs, df_multi, NA_action='raise', return_type='dataframe')
+outcomes, samples = {}, {}
+for sector in ['31', '32', '33']:
+    labor_s = df_multi[f'labor_total_{sector}'].replace(0, np.nan)
+    for label, num_col in [('ln_K_L', 'machinery'), ('ln_VA_L', 'value_added'), ('ln_W_L', 'wages_total')]:
+        name = f'{label}_{sector}'
+        outcomes[name] = np.log(df_multi[f'{num_col}_{sector}'] / labor_s + 1)
+        samples[name] = df_multi[f'count_{sector}'] > 0
+multi = MultiOLS(x_all, groups=df_multi['grid_id'].to_numpy()).fit(pd.DataFrame(outcomes), pd.DataFrame(samples))
+
+multi_rows = []
+for name, res in multi.items():
+    ci_m = res.conf_int()
+    for var in ['X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster']:
+        multi_rows.append({'Outcome': name.rsplit('_', 1)[0], 'Sector': name.rsplit('_', 1)[1], 'Variable': var,
+                           'Coeff': res.params[var], 'SE': res.bse[var], 'P_Value': res.pvalues[var],
+                           'CI_Lower': ci_m.loc[var, 0], 'CI_Upper': ci_m.loc[var, 1], 'Observations': res.nobs})
+multi_path = os.path.join(output_folder, 'Table_2b_Multi_Outcome.csv')
+pd.DataFrame(multi_rows).to_csv(multi_path, index=False)
+print(f"[-] Multi-outcome table saved to: {multi_path}")
+
+# --- 4c. SPATIAL ERROR / SPATIAL LAG (ML) ---
+# Neighbouring cells share dasymetrically allocated census values, so the
+# pooled OLS errors are not independent across space.
+spatial_models = {}
+if SPATIAL_MODELS:
+    print(f"Estimating Spatial ML Models (log-determinant: {LOGDET_METHOD})...")
+    w_years, year_blocks = year_block_weights(df_reg['year'].to_numpy(), df_reg[['x_coord', 'y_coord']].to_numpy(), k=8)
+    logdet = LogDet(w_years, LOGDET_METHOD, blocks=year_blocks)
+    spatial_rhs = "ln_K_L ~ X_USA_Trend + X_CDMX_Trend + X_Port_Trend + X_Cluster + C(year)"
+    for kind in SPATIAL_MODELS:
+        spatial_models[kind] = spatial_ml(spatial_rhs, df_reg, w_years, kind=kind, logdet=logdet)
+
+    spatial_cols = {}
+    for kind, res in spatial_models.items():
+        label = 'SEM' if kind == 'error' else 'SAR'
+        spatial_cols[f'Coeff_{label}'] = res.params
+        spatial_cols[f'SE_{label}'] = res.bse
+        spatial_cols[f'P_Value_{label}'] = res.pvalues
+    spatial_rows = list(dict.fromkeys(v for r in spatial_models.values() for v in r.params.index))
+    spatial_df = pd.DataFrame(spatial_cols).reindex(spatial_rows)
+    spatial_diag = pd.DataFrame({f'Coeff_{"SEM" if k == "error" else "SAR"}': [r.nobs, r.llf, r.aic]
+                                 for k, r in spatial_models.items()}, index=['Observations', 'Log Likelihood', 'AIC'])
+    spatial_path = os.path.join(output_folder, 'Table_2d_Spatial_ML.csv')
+    pd.concat([spatial_df, spatial_diag]).to_csv(spatial_path)
+    print(spatial_df.loc[[v for v in target_vars + ['lambda', 'rho'] if v in spatial_df.index]].to_string())
+    print(f"[-] Spatial ML table saved to: {spatial_path}")
+
+# --- 5. ROBUST PLOTTING (SPLIT LAYERS) ---
+# Prepare Plot Data
+plot_df = table_df.loc[table_df.index.isin(target_vars)].copy()
+# Reorder to match paper logic
+plot_df = plot_df.reindex(['X_Cluster', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend'][::-1])
+
+# Assign Y-positions
+plot_df['y'] = range(len(plot_df))
+
+# Bootstrap CIs when available; a point is significant when its own bar excludes zero
+if N_BOOT:
+    plot_df['CI_Lower'] = plot_df['CI_Lower_WildBoot']
+    plot_df['CI_Upper'] = plot_df['CI_Upper_WildBoot']
+
+# SPLIT INTO TWO DATAFRAMES
+excludes_zero = (plot_df['CI_Lower'] > 0) | (plot_df['CI_Upper'] < 0)
+sig_df = plot_df[excludes_zero]
+insig_df = plot_df[~excludes_zero]
+
+fig, ax = plt.subplots(figsize=(10, 6))
+
+# Layer 1: Significant Points (Red)
+if not sig_df.empty:
+    xerr = [sig_df['Coeff'] - sig_df['CI_Lower'], sig_df['CI_Upper'] - sig_df['Coeff']]
+    ax.errorbar(sig_df['Coeff'], sig_df['y'], xerr=xerr, fmt='o', color='#D32F2F', 
+                capsize=5, elinewidth=2.5, markeredgewidth=2, markersize=10, 
+                label='Significant (95% CI excludes 0)', zorder=10)
+
+# Layer 2: Insignificant Points (Gray)
+if not insig_df.empty:
+    xerr = [insig_df['Coeff'] - insig_df['CI_Lower'], insig_df['CI_Upper'] - insig_df['Coeff']]
+    ax.errorbar(insig_df['Coeff'], insig_df['y'], xerr=xerr, fmt='o', color='#9E9E9E', 
+                capsize=5, elinewidth=2.5, markeredgewidth=2, markersize=10, 
+                label='Insignificant', zorder=10)
+
+# Formatting
+labels_map = {
+    'X_Cluster': 'Cluster Bonus (Local)',
+    'X_USA_Trend': 'Nearshoring (Dist USA)',
+    'X_CDMX_Trend': 'Domestic (Dist CDMX)',
+    'X_Port_Trend': 'Global (Dist Port)'
+}
+ax.set_yticks(plot_df['y'])
+ax.set_yticklabels([labels_map.get(i, i) for i in plot_df.index], fontsize=12, fontweight='bold')
+ax.axvline(x=0, color='black', linestyle='--', linewidth=1, alpha=0.8)
+
+ax.set_xlabel('Effect on Log Capital Intensity (K/L)', fontsize=12, fontweight='bold')
+ax.set_title('Figure 7: Phase 2 - The Sophistication Test\n(Drivers of Automation in Active Factories)', fontsize=14, weight='bold')
+ax.grid(axis='x', linestyle=':', alpha=0.5)
+ax.legend(loc='lower right')
+
+# Save
+plot_path = os.path.join(output_folder, 'Figure_7_Capital_Intensity.png')
+plt.savefig(plot_path, dpi=300, bbox_inches='tight')
+print(f"[-] Figure 7 saved to: {plot_path}")
+
+plt.show()
+
@@ -1,97 +1,127 @@
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import geopandas as gpd
-from shapely.geometry import Point
-import os
-
-# --- 1. CONFIGURATION ---
-results_path = r'C:\'
-input_file = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
-maps_folder = os.path.join(results_path, '01_Maps')
-
-if not os.path.exists(maps_folder):
-    os.makedirs(maps_folder)
-
-df = pd.read_csv(input_file)
-target_sector = '33'
-end_year = int(df['year'].max())
-
-# --- 2. PREP DATA ---
-print(f"Generating Map 4: Bivariate for year {end_year}...")
-df_biv = df[df['year'] == end_year].copy()
-
-# Notation matches Methodology & Tables:
-# n = Establishment Density (Count)
-# k = Capital Intensity (Machinery/Labor)
-df_biv['n'] = df_biv[f'count_{target_sector}']
-k_val = df_biv[f'machinery_{target_sector}']
-l_val = df_biv[f'labor_total_{target_sector}'].replace(0, np.nan)
-df_biv['k'] = np.log((k_val/l_val) + 1)
-
-# Drop NaNs and zeros (must have active firms to be plotted)
-df_biv = df_biv[['grid_id', 'x_coord', 'y_coord', 'n', 'k']].dropna()
-df_biv = df_biv[df_biv['n'] > 0] 
-
-if df_biv.empty:
-    print("   [!] Error: No valid data points found.")
-else:
-    # 3x3 Binning
-    df_biv['bin_n'] = pd.qcut(df_biv['n'].rank(method='first'), 3, labels=[0, 1, 2])
-    df_biv['bin_k'] = pd.qcut(df_biv['k'].rank(method='first'), 3, labels=[0, 1, 2])
-
-    # Bivariate Palette (Pink-Blue-Purple)
-    bivar_colors = ["#e8e8e8", "#b0d5df", "#64acbe", 
-                    "#e4acac", "#ad9ea5", "#627f8c", 
-                    "#c85a5a", "#985356", "#574249"]
-
-    df_biv['color'] = df_biv.apply(lambda row: bivar_colors[int(row['bin_n'])*3 + int(row['bin_k'])], axis=1)
-
-    # --- PLOTTING ---
-    fig, ax = plt.subplots(figsize=(12, 10))
-    
-    # Base Map (Light Gray Context)
-    df_geo_all = df[df['year'] == end_year][['x_coord', 'y_coord']].drop_duplicates()
-    ax.scatter(df_geo_all['x_coord'], df_geo_all['y_coord'], color='#E0E0E0', s=1, alpha=0.4)
-
-    # Data Points
-    ax.scatter(df_biv['x_coord'], df_biv['y_coord'], color=df_biv['color'], s=15, zorder=2)
-
-    # Title with Context
-
-    ax.axis('off')
-
-    # --- LEGEND WITH PRECISE METHODOLOGY NOTATION ---
-    ax_leg = fig.add_axes([0.15, 0.15, 0.15, 0.15]) 
-    
-    for d in range(3):
-        for q in range(3):
-            rect = plt.Rectangle((d, q), 1, 1, facecolor=bivar_colors[d * 3 + q], edgecolor='white', lw=0.5)
-            ax_leg.add_patch(rect)
-            
-    ax_leg.set_xlim(0, 3)
-    ax_leg.set_ylim(0, 3)
-    
-    # X-Axis Label: "Est. Density (n)" matches Methods
-    ax_leg.set_xlabel(r'Est. Density ($n$) $\rightarrow$', fontsize=10, fontweight='bold')
-    
-    # Y-Axis Label: "Cap. Intensity (k)" matches Table 4
-    ax_leg.set_ylabel(r'Cap. Intensity ($k$) $\rightarrow$', fontsize=10, fontweight='bold')
-    
-    # Ticks
-    ax_leg.set_xticks([0.5, 1.5, 2.5])
-    ax_leg.set_xticklabels(['Low', 'Mid', 'High'], fontsize=8)
-    
-    ax_leg.set_yticks([0.5, 1.5, 2.5])
-    ax_leg.set_yticklabels(['Low', 'Mid', 'High'], fontsize=8, rotation=90, va='center')
-    
-    for spine in ax_leg.spines.values():
-        spine.set_visible(False)
-    ax_leg.tick_params(length=0)
-
-    # Save
-    save_path = os.path.join(maps_folder, 'Map_4_Bivariate_Final.png')
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
-    print(f"[-] Final Map 4 saved to: {save_path}")
-
-    plt.show()
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import to_rgba
+import os
+from panel_store import load_panel
+from grid_index import GridIndex
+from bivariate import BIVAR_COLORS as bivar_colors, bivariate_classes
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+input_file = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+maps_folder = os.path.join(results_path, '01_Maps')
+
+# 'raster': one image on the 5 km lattice (fast, small files, full resolution)
+# 'scatter': one marker per grid cell (original rendering)
+RENDER_MODE = 'raster'
+grid_size = 5000
+
+if not os.path.exists(maps_folder):
+    os.makedirs(maps_folder)
+
+df = load_panel(input_file)
+target_sector = '33'
+end_year = int(df['year'].max())
+years = sorted(int(y) for y in df['year'].unique())
+
+# --- 2. PREP DATA ---
+print(f"Generating Map 4: Bivariate for year {end_year}...")
+df_biv = df[['grid_id', 'year', 'x_coord', 'y_coord']].copy()
+
+# Bivariate class 0-8 (n tercile * 3 + k tercile within each year);
+# only cells with active firms are plotted
+df_biv['code'] = bivariate_classes(df, target_sector)
+df_biv = df_biv[df_biv['code'] >= 0]
+
+# Lattice of all grid cells (the light grey base map)
+df_geo_all = df[df['year'] == end_year][['grid_id', 'x_coord', 'y_coord']].reset_index(drop=True)
+grid_index = GridIndex.from_centroids(df_geo_all['grid_id'], df_geo_all['x_coord'],
+                                      df_geo_all['y_coord'], size=grid_size)
+grid_pos = pd.Series(np.arange(len(df_geo_all)), index=df_geo_all['grid_id'].to_numpy())
+
+# Colour lookup table: 0-8 bivariate classes, 9 = grid cell without data, 10 = outside the grid
+BASE, OUTSIDE = 9, 10
+lut = np.array([to_rgba(c) for c in bivar_colors] + [to_rgba('#E0E0E0', 0.4), (0, 0, 0, 0)])
+
+
+def class_raster(year):
+    """Bivariate class of every lattice cell for one year."""
+    codes = np.full(len(grid_index), BASE)
+    d = df_biv[df_biv['year'] == year]
+    codes[grid_pos.reindex(d['grid_id'].to_numpy()).to_numpy(dtype=int)] = d['code'].to_numpy()
+    return grid_index.raster(codes, fill=OUTSIDE)
+
+
+def draw_map(ax, year):
+    if RENDER_MODE == 'raster':
+        ax.imshow(lut[class_raster(year)], origin='lower', extent=grid_index.extent,
+                  interpolation='nearest')
+    else:
+        d = df_biv[df_biv['year'] == year]
+        # Base Map (Light Gray Context)
+        ax.scatter(df_geo_all['x_coord'], df_geo_all['y_coord'], color='#E0E0E0', s=1, alpha=0.4)
+        # Data Points
+        ax.scatter(d['x_coord'], d['y_coord'], color=np.array(bivar_colors)[d['code'].to_numpy()],
+                   s=15, zorder=2)
+    ax.axis('off')
+
+
+def draw_legend(fig, rect, fontsize=10):
+    # --- LEGEND WITH PRECISE METHODOLOGY NOTATION ---
+    ax_leg = fig.add_axes(rect) 
+    
+    for d in range(3):
+        for q in range(3):
+            rect = plt.Rectangle((d, q), 1, 1, facecolor=bivar_colors[d * 3 + q], edgecolor='white', lw=0.5)
+            ax_leg.add_patch(rect)
+            
+    ax_leg.set_xlim(0, 3)
+    ax_leg.set_ylim(0, 3)
+    
+    # X-Axis Label: "Est. Density (n)" matches Methods
+    ax_leg.set_xlabel(r'Est. Density ($n$) $\rightarrow$', fontsize=fontsize, fontweight='bold')
+    
+    # Y-Axis Label: "Cap. Intensity (k)" matches Table 4
+    ax_leg.set_ylabel(r'Cap. Intensity ($k$) $\rightarrow$', fontsize=fontsize, fontweight='bold')
+    
+    # Ticks
+    ax_leg.set_xticks([0.5, 1.5, 2.5])
+    ax_leg.set_xticklabels(['Low', 'Mid', 'High'], fontsize=fontsize - 2)
+    
+    ax_leg.set_yticks([0.5, 1.5, 2.5])
+    ax_leg.set_yticklabels(['Low', 'Mid', 'High'], fontsize=fontsize - 2, rotation=90, va='center')
+    
+    for spine in ax_leg.spines.values():
+        spine.set_visible(False)
+    ax_leg.tick_params(length=0)
+
+
+if df_biv[df_biv['year'] == end_year].empty:
+    print("   [!] Error: No valid data points found.")
+else:
+    # --- PLOTTING ---
+    fig, ax = plt.subplots(figsize=(12, 10))
+    draw_map(ax, end_year)
+    draw_legend(fig, [0.15, 0.15, 0.15, 0.15])
+
+    # Save
+    save_path = os.path.join(maps_folder, 'Map_4_Bivariate_Final.png')
+    plt.savefig(save_path, dpi=300, bbox_inches='tight')
+    print(f"[-] Final Map 4 saved to: {save_path}")
+
+    plt.show()
+
+# --- 3. SMALL MULTIPLES: ALL YEARS ---
+print(f"Generating Map 4b: Bivariate for {', '.join(map(str, years))}...")
+fig, axes = plt.subplots(1, len(years), figsize=(6 * len(years), 5.5), squeeze=False)
+for ax, year in zip(axes[0], years):
+    draw_map(ax, year)
+    ax.set_title(str(year), fontsize=16, fontweight='bold')
+draw_legend(fig, [0.02, 0.08, 0.06, 0.22], fontsize=8)
+
+save_path = os.path.join(maps_folder, 'Map_4b_Bivariate_Years.png')
+plt.savefig(save_path, dpi=300, bbox_inches='tight')
+print(f"[-] Map 4b saved to: {save_path}")
+
+plt.show()
@@ -1,95 +1,131 @@
-import pandas as pd
-import numpy as np
-import statsmodels.api as sm
-import statsmodels.formula.api as smf
-import os
-
-# --- 1. CONFIGURATION ---
-results_path = r'C:\'
-file_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
-output_folder = os.path.join(results_path, '00_Final_Paper_Figures')
-
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
-
-print("Loading Data...")
-df = pd.read_csv(file_path)
-
-# --- 2. DATA PREP (Standardization) ---
-print("Preparing Variables (Standardizing to 100km units)...")
-
-# 1. Create Trend
-df['trend'] = df['year'] - df['year'].min()
-
-# 2. Standardize Distances (km -> 100km)
-# This is crucial for coefficient consistency with Table 2
-df['dist_usa_100km'] = df['dist_usa_km'] / 100
-df['dist_cdmx_100km'] = df['dist_cdmx_km'] / 100
-df['dist_port_100km'] = df['dist_port_km'] / 100
-
-# 3. Generate Interactions
-df['X_USA_Trend'] = df['dist_usa_100km'] * df['trend']
-df['X_CDMX_Trend'] = df['dist_cdmx_100km'] * df['trend']
-df['X_Port_Trend'] = df['dist_port_100km'] * df['trend']
-
-# --- 3. MODELING (Robustness Check) ---
-# We compare strictly Export-Oriented (33) vs Domestic-Oriented (31)
-# Sector 32 (Chem/Textile) is excluded as it is an intermediate input for 33
-sectors = {
-    '33': 'Machinery (Target)',
-    '31': 'Food (Placebo)'
-}
-
-results = []
-
-print("\n" + "="*80)
-print(f"{'SECTOR':<25} | {'COEFF (per 100km)':<20} | {'P-VALUE':<10} | {'INTERPRETATION'}")
-print("="*80)
-
-for sec_code, sec_name in sectors.items():
-    dep_var = f'count_{sec_code}'
-    cluster_var = 'is_cluster' # Generic cluster flag
-    
-    # Formula using Standardized Interactions
-    formula = f"{dep_var} ~ {cluster_var} + X_USA_Trend + X_CDMX_Trend + X_Port_Trend + C(year)"
-    
-    try:
-        # Run Poisson GLM with Clustered SE
-        model = smf.glm(formula=formula, data=df, family=sm.families.Poisson()).fit(cov_type='cluster', cov_kwds={'groups': df['grid_id']})
-        
-        target = 'X_USA_Trend'
-        beta = model.params[target]
-        pval = model.pvalues[target]
-        conf_int = model.conf_int().loc[target]
-        
-        # Determine Interpretation
-        direction = "Moving NORTH (Nearshoring)" if beta < 0 else "Moving SOUTH (Population)"
-        sig_stars = "***" if pval < 0.01 else ("**" if pval < 0.05 else "")
-        
-        # Print to Console
-        print(f"{sec_name:<25} | {beta:.6f}{sig_stars:<4}       | {pval:.1e}  | {direction}")
-        
-        results.append({
-            'Sector_Code': sec_code,
-            'Sector_Name': sec_name,
-            'Coeff_Dist_USA': beta,
-            'Standard_Error': model.bse[target],
-            'P_Value': pval,
-            'Lower_CI': conf_int[0],
-            'Upper_CI': conf_int[1],
-            'Interpretation': direction
-        })
-        
-    except Exception as e:
-        print(f"Error modeling Sector {sec_code}: {e}")
-
-print("="*80 + "\n")
-
-# --- 4. EXPORT RESULTS ---
-# Save the coefficients to CSV for reproducibility
-if results:
-    res_df = pd.DataFrame(results)
-    csv_path = os.path.join(output_folder, 'Robustness_Check_Coefficients.csv')
-    res_df.to_csv(csv_path, index=False)
-
-    print(f"[-] Robustness coefficients saved to: {csv_path}")
+import pandas as pd
+import numpy as np
+import statsmodels.api as sm
+import statsmodels.formula.api as smf
+import os
+from panel_store import load_panel
+from ppml_hdfe import ppml_hdfe
+from cluster_cov import GroupOffsets, cluster, wild_cluster_bootstrap
+from spatial_diagnostics import residual_diagnostics
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+file_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+output_folder = os.path.join(results_path, '00_Final_Paper_Figures')
+
+# Wild score bootstrap (restricted, H0: coefficient = 0) for the Dist USA p-value
+N_BOOT = 9999                # 0 = analytic clustered p-values only
+BOOT_WEIGHTS = 'rademacher'  # or 'webb' (few clusters)
+BOOT_SEED = 42
+
+# Moran's I of the Pearson residuals (KNN k=8 among each year's cells)
+N_PERM = 999                 # 0 = no permutation inference
+
+if not os.path.exists(output_folder):
+    os.makedirs(output_folder)
+
+print("Loading Data...")
+df = load_panel(file_path)
+
+# --- 2. DATA PREP (Standardization) ---
+print("Preparing Variables (Standardizing to 100km units)...")
+
+# 1. Create Trend
+df['trend'] = df['year'] - df['year'].min()
+
+# 2. Standardize Distances (km -> 100km)
+# This is crucial for coefficient consistency with Table 2
+df['dist_usa_100km'] = df['dist_usa_km'] / 100
+df['dist_cdmx_100km'] = df['dist_cdmx_km'] / 100
+df['dist_port_100km'] = df['dist_port_km'] / 100
+
+# 3. Generate Interactions
+df['X_USA_Trend'] = df['dist_usa_100km'] * df['trend']
+df['X_CDMX_Trend'] = df['dist_cdmx_100km'] * df['trend']
+df['X_Port_Trend'] = df['dist_port_100km'] * df['trend']
+
+# --- 3. MODELING (Robustness Check) ---
+# We compare strictly Export-Oriented (33) vs Domestic-Oriented (31)
+# Sector 32 (Chem/Textile) is excluded as it is an intermediate input for 33
+sectors = {
+    '33': 'Machinery (Target)',
+    '31': 'Food (Placebo)'
+}
+
+results = []
+moran_tables = []
+grid_groups = GroupOffsets(df['grid_id'].to_numpy()) # sorted once, shared by all sectors
+
+print("\n" + "="*80)
+print(f"{'SECTOR':<25} | {'COEFF (per 100km)':<20} | {'P-VALUE':<10} | {'INTERPRETATION'}")
+print("="*80)
+
+for sec_code, sec_name in sectors.items():
+    dep_var = f'count_{sec_code}'
+    cluster_var = 'is_cluster' # Generic cluster flag
+    
+    # Formula using Standardized Interactions
+    formula = f"{dep_var} ~ {cluster_var} + X_USA_Trend + X_CDMX_Trend + X_Port_Trend + C(year)"
+    
+    try:
+        # Run Poisson GLM with Clustered SE
+        model = cluster(smf.glm(formula=formula, data=df, family=sm.families.Poisson()).fit(), grid_groups)
+        
+        target = 'X_USA_Trend'
+        beta = model.params[target]
+        pval = model.pvalues[target]
+        conf_int = model.conf_int().loc[target]
+        pval_boot = np.nan
+        if N_BOOT:
+            pval_boot = wild_cluster_bootstrap(model, grid_groups, params=[target], reps=N_BOOT,
+                                               weights=BOOT_WEIGHTS, seed=BOOT_SEED).loc[target, 'p_value']
+        
+        # Same model with grid-cell and year fixed effects absorbed (PPML-HDFE)
+        model_fe = ppml_hdfe(df, dep_var, [cluster_var, 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend'],
+                             absorb=['grid_id', 'year'], cluster='grid_id')
+        
+        # Residual spatial autocorrelation, year by year
+        moran_g, _ = residual_diagnostics(model, df, k=8, permutations=N_PERM, seed=BOOT_SEED)
+        moran_tables.append(moran_g.assign(Sector_Code=sec_code))
+        
+        # Determine Interpretation
+        direction = "Moving NORTH (Nearshoring)" if beta < 0 else "Moving SOUTH (Population)"
+        sig_stars = "***" if pval < 0.01 else ("**" if pval < 0.05 else "")
+        
+        # Print to Console
+        print(f"{sec_name:<25} | {beta:.6f}{sig_stars:<4}       | {pval:.1e}  | {direction}")
+        
+        results.append({
+            'Sector_Code': sec_code,
+            'Sector_Name': sec_name,
+            'Coeff_Dist_USA': beta,
+            'Standard_Error': model.bse[target],
+            'P_Value': pval,
+            'Lower_CI': conf_int[0],
+            'Upper_CI': conf_int[1],
+            'P_Value_WildBoot': pval_boot,
+            'Coeff_Dist_USA_GridFE': model_fe.params[target],
+            'Standard_Error_GridFE': model_fe.bse[target],
+            'P_Value_GridFE': model_fe.pvalues[target],
+            'Interpretation': direction
+        })
+        
+    except Exception as e:
+        print(f"Error modeling Sector {sec_code}: {e}")
+
+print("="*80 + "\n")
+
+# --- 4. EXPORT RESULTS ---
+# Save the coefficients to CSV for reproducibility
+if results:
+    res_df = pd.DataFrame(results)
+    csv_path = os.path.join(output_folder, 'Robustness_Check_Coefficients.csv')
+    res_df.to_csv(csv_path, index=False)
+
+    print(f"[-] Robustness coefficients saved to: {csv_path}")
+
+if moran_tables:
+    moran_df = pd.concat(moran_tables)[['Sector_Code', 'year', 'n', 'I', 'EI', 'EI_sim', 'z_sim', 'p_sim']]
+    moran_path = os.path.join(output_folder, 'Robustness_Residual_Moran.csv')
+    moran_df.to_csv(moran_path, index=False)
+    print(f"[-] Residual Moran's I saved to: {moran_path}")
@@ -0,0 +1,41 @@
+import os
+from panel_store import load_panel
+from rama_sweep import run_sweep, sector_codes
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+file_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+output_folder = os.path.join(results_path, '00_Final_Paper_Figures')
+
+# None = all cores
+MAX_WORKERS = None
+
+# The guard is required: on Windows the pool starts workers by re-importing
+# this file.
+if __name__ == '__main__':
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    print("Loading Data...")
+    df = load_panel(file_path)
+
+    codes = sector_codes(df.columns)
+    ramas = [c for c in codes if len(c) == 4]
+    if not ramas:
+        # rama columns come from 01_Data_Prep_Dasymetric (RAMA_VARS)
+        print("[!] The panel has no 4-digit count_{rama} columns (rebuild it with RAMA_VARS set "
+              "in 01_Data_Prep_Dasymetric); sweeping the 2-digit sectors only.")
+    print(f"Sweeping {len(codes)} sectors/ramas: {', '.join(codes)}")
+
+    # --- 2. RUN SWEEP (Stage 1 Poisson + Stage 2 ln K/L per code) ---
+    res_df = run_sweep(df, codes, max_workers=MAX_WORKERS)
+
+    failed = res_df[res_df['Status'] != 'ok']
+    if not failed.empty:
+        print("\n[!] Failed fits:")
+        print(failed[['Sector_Code', 'Stage', 'Status']].to_string(index=False))
+
+    # --- 3. EXPORT ---
+    csv_path = os.path.join(output_folder, 'Robustness_Sweep_Coefficients.csv')
+    res_df.to_csv(csv_path, index=False)
+    print(f"[-] Sweep coefficients saved to: {csv_path}")
@@ -0,0 +1,64 @@
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+import os
+from grid_dbscan import RadiusGraph
+from grid_index import GridIndex
+from point_io import prefetch, read_points
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+grid_path = os.path.join(results_path, 'mexico_5km_grid_master.gpkg')
+
+years = [2010, 2015, 2019, 2025]
+
+# Parameter grid (the main specification in 02_DBSCAN.py is 1500 m / 10)
+EPS_GRID = [1000, 1500, 2000, 2500]   # metres
+MIN_SAMPLES_GRID = [5, 10, 15, 20]
+
+param_sets = [(eps, ms) for eps in EPS_GRID for ms in MIN_SAMPLES_GRID]
+
+# --- 2. LOAD GRID ---
+print("Loading Grid...")
+master_grid = gpd.read_file(grid_path)
+grid_ids = master_grid['grid_id'].to_numpy()
+grid_index = GridIndex.from_grid(master_grid)
+
+# One panel per parameter set, same layout as mexico_dbscan_clusters.csv
+panels = {p: pd.DataFrame({'grid_id': grid_ids}) for p in param_sets}
+
+# --- 3. SWEEP LOOP ---
+def load_year(year):
+    return read_points(os.path.join(results_path, f'denue_{year}_manufacturing.gpkg'))
+
+# The next year's points load while the current year is swept
+for year, coords in prefetch(years, load_year):
+    print(f"--- DBSCAN sweep for {year} ---")
+
+    # Neighbour search once, at the largest radius
+    graph = RadiusGraph(coords, max(EPS_GRID))
+    print(f"  {len(coords)} points, {len(graph)} neighbour pairs within {max(EPS_GRID)} m")
+
+    # Point -> grid cell, once for all parameter sets (same assignment as
+    # 02_DBSCAN.py, so a point on a cell edge counts in both cells)
+    point_idx, cell_rows = grid_index.assign(coords[:, 0], coords[:, 1])
+
+    for eps, ms in param_sets:
+        labels = graph.labels(eps, ms)
+        in_cluster = labels[point_idx] != -1
+        cluster_n = np.bincount(cell_rows[in_cluster], minlength=len(grid_ids))
+        panels[(eps, ms)][f'cluster_n_{year}'] = cluster_n
+        panels[(eps, ms)][f'is_cluster_{year}'] = (cluster_n > 0).astype(int)
+        print(f"  eps={eps:>5} min_samples={ms:>3}: {labels.max() + 1:>5} clusters, "
+              f"{(labels != -1).sum()} clustered points")
+
+# --- 4. SAVE SWEEP DATASET ---
+# Stacked panels tagged by parameter set
+out = pd.concat([panel.assign(param_set=f'eps{eps}_min{ms}', eps=eps, min_samples=ms)
+                 for (eps, ms), panel in panels.items()], ignore_index=True)
+lead = ['param_set', 'eps', 'min_samples', 'grid_id']
+out = out[lead + [c for c in out.columns if c not in lead]]
+
+out_csv = os.path.join(results_path, 'mexico_dbscan_clusters_sweep.csv')
+out.to_csv(out_csv, index=False)
+print(f"SUCCESS: {len(param_sets)} parameter sets saved to {out_csv}")
@@ -0,0 +1,37 @@
+import os
+from atlas import render_atlas, municipality_key
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+input_file = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+mun_shape_path = r'C:\00mun_REPROJECTED.gpkg'
+atlas_folder = os.path.join(results_path, '01_Maps', 'Atlas')
+
+target_sector = '33'
+DPI = 300
+
+# None = every municipality in the layer; or a list of (CVE_ENT, CVE_MUN)
+MUNICIPALITIES = None
+# e.g. MUNICIPALITIES = [('08', '037'), ('02', '004'), ('19', '039')]
+
+# None = all cores
+MAX_WORKERS = None
+
+# The guard is required: on Windows the pool starts workers by re-importing
+# this file.
+if __name__ == '__main__':
+    keys = None if MUNICIPALITIES is None else [municipality_key(e, m) for e, m in MUNICIPALITIES]
+
+    # --- 2. RENDER ---
+    # Sheets whose inputs did not change since the last run are skipped
+    print(f"Rendering atlas for sector {target_sector} into {atlas_folder}...")
+    status = render_atlas(mun_shape_path, input_file, atlas_folder, keys=keys,
+                          target_sector=target_sector, dpi=DPI, max_workers=MAX_WORKERS)
+
+    # --- 3. SUMMARY ---
+    print(status['status'].str.split(':').str[0].value_counts().to_string())
+    failed = status[status['status'].str.startswith('error')]
+    if not failed.empty:
+        print("\n[!] Failed sheets:")
+        print(failed.to_string(index=False))
+    print(f"[-] Atlas saved to: {atlas_folder}")
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pandas as pd
+from panel_store import load_panel
+from grid_index import GridIndex
+from bivariate import BIVAR_COLORS, bivariate_classes
+from tile_pyramid import continuous_layer, categorical_layer, export_pyramid
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+input_file = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+tiles_folder = os.path.join(results_path, '01_Maps', 'Tiles')
+
+SECTORS = ['31', '32', '33']
+grid_size = 5000
+# Shown in the viewer's coordinate readout only
+GRID_CRS = None
+
+# Open <tiles_folder>/index.html in a browser; no server or internet needed.
+
+df = load_panel(input_file)
+years = sorted(int(y) for y in df['year'].unique())
+
+# --- 2. GRID LATTICE ---
+cells = df[df['year'] == years[-1]][['grid_id', 'x_coord', 'y_coord']].reset_index(drop=True)
+grid_index = GridIndex.from_centroids(cells['grid_id'], cells['x_coord'], cells['y_coord'], size=grid_size)
+grid_pos = pd.Series(np.arange(len(cells)), index=cells['grid_id'].to_numpy())
+print(f"Lattice: {len(cells)} cells, {grid_index.shape[0]} x {grid_index.shape[1]}")
+
+def by_year(values, fill):
+    """{year: values aligned with the lattice positions} for one panel column."""
+    out = {}
+    for year in years:
+        mask = (df['year'] == year).to_numpy()
+        arr = np.full(len(cells), fill, dtype=float)
+        arr[grid_pos.reindex(df.loc[mask, 'grid_id'].to_numpy()).to_numpy(dtype=int)] = values[mask]
+        out[year] = arr
+    return out
+
+# --- 3. LAYERS ---
+bivar_labels = [f"n {dn} / k {dk}" for dn in ('Low', 'Mid', 'High') for dk in ('Low', 'Mid', 'High')]
+layers = {}
+for sector in SECTORS:
+    count = df[f'count_{sector}'].to_numpy(dtype=float)
+    labor = df[f'labor_total_{sector}'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_k = np.where(labor > 0, np.log1p(df[f'machinery_{sector}'].to_numpy(dtype=float) / labor), np.nan)
+
+    # cells without establishments are drawn as base cells
+    layers[f'count_{sector}'] = (
+        continuous_layer(f"Sector {sector}: establishments", cmap='Reds', vmin=0,
+                         label="log(1 + establishments)"),
+        by_year(np.where(count > 0, np.log1p(count), np.nan), np.nan))
+    layers[f'logk_{sector}'] = (
+        continuous_layer(f"Sector {sector}: capital intensity", cmap='plasma',
+                         label="Log capital per worker ln(k)"),
+        by_year(log_k, np.nan))
+    layers[f'bivariate_{sector}'] = (
+        categorical_layer(f"Sector {sector}: bivariate n x k", BIVAR_COLORS, bivar_labels),
+        by_year(bivariate_classes(df, sector).to_numpy(dtype=float), -1))
+
+if 'is_cluster' in df.columns:
+    layers['is_cluster'] = (
+        categorical_layer("DBSCAN cluster", ['#B0BEC5', '#D32F2F'], ['Not clustered', 'Clustered']),
+        by_year(df['is_cluster'].to_numpy(dtype=float), -1))
+
+# --- 4. EXPORT ---
+# Tiles whose pixels did not change since the last export are not rewritten
+print(f"Exporting {len(layers)} layers x {len(years)} years to {tiles_folder}...")
+status = pd.DataFrame(export_pyramid(grid_index, layers, tiles_folder, crs=GRID_CRS))
+print(status.groupby('layer')[['written', 'unchanged']].sum().to_string())
+print(f"[-] Viewer saved to: {os.path.join(tiles_folder, 'index.html')}")
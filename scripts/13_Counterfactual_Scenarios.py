@@ -0,0 +1,156 @@
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+import os
+import statsmodels.formula.api as smf
+from panel_store import load_panel
+from panel_array import GridLookup, GridPanel
+from spatial_weights import knn_weights, lag_panel
+from estimation import EstimationSession
+from cluster_cov import cluster
+from census_stream import mun_key
+from anchor_distance import load_anchors
+from scenarios import ScenarioEngine
+
+# --- 1. CONFIGURATION ---
+results_path = r'C:\'
+output_folder = os.path.join(results_path, '00_Final_Paper_Figures')
+file_path = os.path.join(results_path, 'MEXICO_PANEL_WITH_EXOGENOUS_VARS.csv')
+weights_cache = os.path.join(results_path, 'weights_cache')
+grid_path = os.path.join(results_path, 'mexico_5km_grid_master.gpkg')
+keys_path = os.path.join(results_path, 'mexico_5km_grid_joined_mun_2010_2015_2020_2025.gpkg')
+
+target_sector = '33'
+
+# Intervals: 'delta' (delta method) or 'sim' (coefficient draws; slower)
+INTERVAL = 'delta'
+N_DRAWS = 1000
+ALPHA = 0.05
+SEED = 42
+MEMORY_MB = 512              # budget for one chunk of (scenarios x cells x coefficients/draws)
+
+# Candidate new ports (lat/lon); each one is a scenario
+NEW_PORTS = {
+    'Lazaro_Cardenas': (17.9390, -102.1790),
+    'Altamira': (22.4830, -97.8660),
+    'Guaymas': (27.9180, -110.8980),
+    'Ensenada': (31.8500, -116.6250),
+    'Progreso': (21.2830, -89.6630),
+}
+# Border effect sweep: dist_usa term scaled by each factor (2.0 = "border effect doubles")
+BORDER_SCALES = np.round(np.arange(0.5, 3.0001, 0.05), 2)
+
+# Map used by each year's municipality keys (2019 data uses the 2020 map)
+year_to_key_col = {
+    2010: 'CVEGEO_2010',
+    2015: 'CVEGEO_2015',
+    2019: 'CVEGEO_2020',
+    2025: 'CVEGEO_2025'
+}
+
+print("Loading Data...")
+df = load_panel(file_path).copy()
+
+# --- 2. DATA PREP (as in 06_Stage1 / 06_Stage2) ---
+df['dist_usa_100km'] = df['dist_usa_km'] / 100
+df['dist_cdmx_100km'] = df['dist_cdmx_km'] / 100
+df['dist_port_100km'] = df['dist_port_km'] / 100
+df['trend'] = df['year'] - 2010
+
+df['X_USA_Trend'] = df['dist_usa_100km'] * df['trend']
+df['X_CDMX_Trend'] = df['dist_cdmx_100km'] * df['trend']
+df['X_Port_Trend'] = df['dist_port_100km'] * df['trend']
+df['X_Cluster'] = df.get(f'is_cluster_{target_sector}', df.get('is_cluster', 0))
+df['Y_Count'] = df[f'count_{target_sector}']
+
+df_geo = df[['grid_id', 'x_coord', 'y_coord']].drop_duplicates('grid_id')
+w = knn_weights(df_geo[['x_coord', 'y_coord']].to_numpy(), k=8, cache_dir=weights_cache)
+panel = GridPanel.from_long(df, ['X_Cluster'], grid_ids=df_geo['grid_id'].to_numpy())
+lag_panel(w, panel, ['X_Cluster'], prefix='W_')
+df['W_X_Cluster'] = panel.take('W_X_Cluster', df['grid_id'].to_numpy(), df['year'].to_numpy())
+df['w_row'] = GridLookup(df_geo['grid_id'].to_numpy()).rows(df['grid_id'].to_numpy())
+
+# Area keys of every row: municipality of the year's map, state = first two digits
+gdf_keys = gpd.read_file(keys_path, ignore_geometry=True)
+key_rows = GridLookup(gdf_keys['grid_id'].to_numpy()).rows(df['grid_id'].to_numpy())
+df['cve_mun'] = pd.array([pd.NA] * len(df), dtype='Int64')
+for year, key_col in year_to_key_col.items():
+    sel = ((df['year'] == year) & (key_rows >= 0)).to_numpy()
+    df.loc[sel, 'cve_mun'] = mun_key(gdf_keys[key_col]).to_numpy()[key_rows[sel]]
+df['cve_ent'] = df['cve_mun'] // 1000
+
+# --- 3. FIT STAGE 1 (SPATIAL POISSON) AND STAGE 2 (POOLED OLS) ONCE ---
+print("Estimating Stage 1 (Spatial Poisson)...")
+stage1_vars = ['Y_Count', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster', 'W_X_Cluster', 'year', 'grid_id']
+df_s1 = df[stage1_vars + ['dist_usa_100km', 'dist_cdmx_100km', 'dist_port_100km', 'trend',
+                          'w_row', 'cve_mun', 'cve_ent']].dropna(subset=stage1_vars).copy()
+session = EstimationSession(df_s1, 'Y_Count', "X_USA_Trend + X_CDMX_Trend + X_Port_Trend + X_Cluster + C(year)",
+                            groups='grid_id')
+stage1 = session.fit_all([
+    ('(2) Poisson', 'poisson', [], None),
+    ('(3) Spatial', 'poisson', ['W_X_Cluster'], '(2) Poisson'),
+])['(3) Spatial']
+
+print("Estimating Stage 2 (ln K/L, active cells)...")
+df_active = df[df[f'count_{target_sector}'] > 0].copy()
+labor = df_active[f'labor_total_{target_sector}']
+df_active['ln_K_L'] = np.log(df_active[f'machinery_{target_sector}'] / labor.replace(0, np.nan) + 1)
+stage2_vars = ['ln_K_L', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'X_Cluster', 'year', 'grid_id']
+df_s2 = df_active[stage2_vars + ['dist_usa_100km', 'dist_cdmx_100km', 'dist_port_100km', 'trend',
+                                 'cve_mun', 'cve_ent']].dropna(subset=stage2_vars).copy()
+ols_fit = smf.ols("ln_K_L ~ X_USA_Trend + X_CDMX_Trend + X_Port_Trend + X_Cluster + C(year)", data=df_s2).fit()
+stage2 = cluster(ols_fit, df_s2['grid_id'])
+
+# Design columns as products of the inputs scenarios perturb
+terms = {
+    'X_USA_Trend': ('dist_usa_100km', 'trend'),
+    'X_CDMX_Trend': ('dist_cdmx_100km', 'trend'),
+    'X_Port_Trend': ('dist_port_100km', 'trend'),
+    'X_Cluster': ('X_Cluster',),
+}
+# Stage 1: expected counts; W_X_Cluster follows changes of the cluster flag.
+engine_s1 = ScenarioEngine.from_fit(stage1, df_s1, terms, lags={'W_X_Cluster': 'X_Cluster'},
+                                    w=w, w_rows=df_s1['w_row'].to_numpy())
+# Stage 2: K/L = max(smear * exp(x'b) - 1, 0) (Duan smearing of the log(K/L + 1) model)
+engine_s2 = ScenarioEngine.from_fit(stage2, df_s2, terms, smear=np.exp(ols_fit.resid).mean(), shift=-1)
+
+# --- 4. SCENARIOS ---
+# {name: {input: {op: value}}}, ops scale / shift / min / set (see scenarios.py).
+# Per-row values are Series on df's index, so they align with either stage's rows.
+grid_crs = gpd.read_file(grid_path, rows=1).crs
+ports = load_anchors(pd.DataFrame({'name': list(NEW_PORTS), 'type': 'port',
+                                   'lat': [p[0] for p in NEW_PORTS.values()],
+                                   'lon': [p[1] for p in NEW_PORTS.values()]}), grid_crs)
+scenarios = {'Baseline': {}}
+for s in BORDER_SCALES:
+    scenarios[f'Border effect x{s:.2f}'] = {'dist_usa_100km': {'scale': s}}
+for _, port in ports.iterrows():
+    d_new = np.hypot(df['x_coord'] - port['x'], df['y_coord'] - port['y']) / 1000 / 100
+    scenarios[f"New port: {port['name']}"] = {'dist_port_100km': {'min': d_new}}
+scenarios['No clusters'] = {'X_Cluster': {'set': 0}}
+scenarios['Clusters within 100 km of the border'] = {
+    'X_Cluster': {'set': pd.Series(np.where(df['dist_usa_100km'] <= 1, 1.0, np.nan), index=df.index)}}
+scenarios['Horizon +5 years'] = {'trend': {'shift': 5}}
+scenarios['Horizon +10 years'] = {'trend': {'shift': 10}}
+scenarios['Border x2 and new port at Lazaro Cardenas'] = {
+    **scenarios['Border effect x2.00'], **scenarios['New port: Lazaro_Cardenas']}
+print(f"{len(scenarios)} scenarios")
+
+# --- 5. PREDICT & AGGREGATE ---
+for label, engine, data, how in [('Stage1_Count', engine_s1, df_s1, 'sum'),
+                                 ('Stage2_KL', engine_s2, df_s2, 'mean')]:
+    print(f"Predicting {label} ({engine.n} cell-years x {len(scenarios)} scenarios, {INTERVAL})...")
+    rows = data.loc[engine.row_labels]
+    out = engine.predict(scenarios, by={'national': 'Mexico', 'state': rows['cve_ent'].to_numpy(),
+                                        'municipality': rows['cve_mun'].to_numpy()},
+                         how=how, interval=INTERVAL, draws=N_DRAWS, alpha=ALPHA, seed=SEED,
+                         memory_mb=MEMORY_MB)
+    for level, table in out.items():
+        out_path = os.path.join(output_folder, f'Table_Scenarios_{label}_{level.capitalize()}.csv')
+        table.to_csv(out_path, index=False)
+        print(f"[-] {level}: {len(table)} rows saved to: {out_path}")
+
+    latest = out['national'][out['national']['year'] == out['national']['year'].max()]
+    headline = [n for n in scenarios if not n.startswith('Border effect x') or n == 'Border effect x2.00']
+    print(latest.set_index('scenario').loc[headline, ['value', 'lo', 'hi', 'change', 'change_lo', 'change_hi']]
+          .to_string(float_format=lambda v: f'{v:,.3f}'))
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy.spatial import cKDTree
+
+# Distance-based exogenous variables from anchor sets of any size.
+#
+# Anchors (border crossings, ports, metro areas, ...) are read from a table
+# with columns anchor_id, name, type, lat, lon and an optional weight (e.g.
+# population). Each feature is a pandas query selecting a subset of anchors;
+# nearest-anchor distance and id come from a KD-tree over that subset, so the
+# cost grows with log(#anchors) instead of with the size of a shapely union.
+
+ANCHOR_COLUMNS = ['anchor_id', 'name', 'type', 'lat', 'lon']
+
+
+def load_anchors(anchors, crs):
+    """
+    Anchor table (path or DataFrame) with projected x/y (metres in `crs`).
+    anchor_id defaults to the row number.
+    """
+    df = pd.read_csv(anchors) if isinstance(anchors, str) else anchors.copy()
+    if 'anchor_id' not in df.columns:
+        df.insert(0, 'anchor_id', np.arange(len(df)))
+    missing = [c for c in ANCHOR_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Anchor table is missing columns {missing}")
+    pts = gpd.GeoSeries(gpd.points_from_xy(df['lon'], df['lat']), crs="EPSG:4326").to_crs(crs)
+    df['x'], df['y'] = pts.x.to_numpy(), pts.y.to_numpy()
+    return df.reset_index(drop=True)
+
+
+def nearest(points, anchor_xy, k=1):
+    """Distances (n x k, metres) and anchor rows (n x k) of the k nearest anchors."""
+    anchor_xy = np.asarray(anchor_xy, dtype=float)
+    if len(anchor_xy) < k:
+        raise ValueError(f"k={k} but only {len(anchor_xy)} anchors")
+    dist, idx = cKDTree(anchor_xy).query(np.asarray(points, dtype=float), k=k)
+    return dist.reshape(len(points), k), idx.reshape(len(points), k)
+
+
+def market_access(points, anchor_xy, weights, decay=1.0, min_dist=2500.0, chunk=20_000):
+    """
+    Gravity-weighted access sum_j w_j / d_ij^decay (d in km), with distances
+    floored at min_dist metres so that an anchor inside a cell does not explode.
+    """
+    points = np.asarray(points, dtype=float)
+    anchor_xy = np.asarray(anchor_xy, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    out = np.empty(len(points))
+    for s in range(0, len(points), chunk):
+        d = np.hypot(points[s:s + chunk, None, 0] - anchor_xy[None, :, 0],
+                     points[s:s + chunk, None, 1] - anchor_xy[None, :, 1])
+        out[s:s + chunk] = (weights / (np.maximum(d, min_dist) / 1000) ** decay).sum(axis=1)
+    return out
+
+
+def distance_features(points, anchors, features, k=None, gravity=None):
+    """
+    points:   (n x 2) projected coordinates (e.g. grid centroids).
+    anchors:  table from load_anchors().
+    features: {feature: query}, e.g. {'usa': "type == 'border'"}.
+    k:        also add the mean distance to the k nearest anchors (features
+              with fewer than k anchors are skipped).
+    gravity:  {feature: decay} market-access sums weighted by anchors['weight'].
+
+    Returns a DataFrame with dist_{feature}_km, nearest_{feature}_id and, if
+    requested, dist_{feature}_k{k}_km and ma_{feature}.
+    """
+    points = np.asarray(points, dtype=float)
+    out = {}
+    for feature, query in features.items():
+        sub = anchors.query(query)
+        if sub.empty:
+            raise ValueError(f"No anchors match '{query}' for feature '{feature}'")
+        xy = sub[['x', 'y']].to_numpy()
+        dist, idx = nearest(points, xy, k=1)
+        out[f'dist_{feature}_km'] = dist[:, 0] / 1000
+        out[f'nearest_{feature}_id'] = sub['anchor_id'].to_numpy()[idx[:, 0]]
+        if k is not None and len(sub) >= k:
+            out[f'dist_{feature}_k{k}_km'] = nearest(points, xy, k=k)[0].mean(axis=1) / 1000
+        if gravity and feature in gravity:
+            if 'weight' not in sub.columns:
+                raise ValueError("Market access needs a 'weight' column in the anchor table")
+            out[f'ma_{feature}'] = market_access(points, xy, sub['weight'].to_numpy(),
+                                                 decay=gravity[feature])
+    return pd.DataFrame(out)
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from matplotlib_scalebar.scalebar import ScaleBar
+
+from panel_store import load_panel
+from grid_index import GridIndex
+
+# Three-panel municipality sheet (administrative context, establishment
+# density, log capital intensity) and the batch renderer behind the atlas.
+#
+# Workers use the Agg backend and load the municipality layer, the latest
+# year of the panel and the grid index once, in the pool initializer. Each
+# sheet's inputs (polygon, cell values, sector, dpi, ATLAS_VERSION) are hashed;
+# a sheet whose hash matches the manifest of the last run is not re-rendered.
+
+# Bump when the figure layout changes, to re-render every sheet
+ATLAS_VERSION = 1
+
+GRID_SIZE = 5000
+
+
+def municipality_key(cve_ent, cve_mun):
+    """CVEGEO-style key, e.g. ('08', '037') -> '08037'."""
+    return f'{int(cve_ent):02d}{int(cve_mun):03d}'
+
+
+def municipality_cells(grid_index, data, poly, crs=None):
+    """Grid cells (with their data rows) that intersect the municipality polygon."""
+    pos = grid_index.intersecting(poly)
+    return grid_index.layer(pos, data.iloc[pos].reset_index(drop=True), crs=crs)
+
+
+def draw_municipality(mun_poly, cells, target_sector, label, usa_context=False):
+    """
+    The three-panel figure for one municipality.
+    mun_poly:    one-row GeoDataFrame with the municipality.
+    cells:       grid cells from municipality_cells().
+    usa_context: shade the US side and mark the border (Juarez figure).
+    """
+    count_col = f'count_{target_sector}'
+    labor_col = f'labor_total_{target_sector}'      # L
+    capital_col = f'machinery_{target_sector}'      # K
+    cells = cells.copy()
+    mun_area_km2 = mun_poly.geometry.area.iloc[0] / 1e6
+
+    fig, axes = plt.subplots(1, 3, figsize=(26, 12), facecolor='white')
+    bounds = mun_poly.total_bounds
+    top = bounds[3]
+
+    for i, ax in enumerate(axes):
+        if usa_context:
+            # a. USA BACKGROUND SHADE
+            ax.fill_between([bounds[0]-10000, bounds[2]+10000], top, top + 20000,
+                            color='#ECEFF1', alpha=0.6, zorder=0)
+            # b. BORDER LINE
+            ax.axhline(y=top, color='black', linestyle='--', linewidth=2, zorder=5)
+            # c. LABELS
+            ax.text(bounds[0]+2000, top+3000,
+                    "UNITED STATES", fontsize=14, fontweight='bold', color='#455A64')
+
+        # d. PLOT MUNICIPALITY BASE
+        mun_poly.plot(ax=ax, color='white', edgecolor='black', linewidth=1, alpha=0.2, zorder=1)
+
+        # PANEL A: ADMINISTRATIVE CONTEXT
+        if i == 0:
+            ax.set_title("A. Administrative Context\n(Study Area & Resolution)", fontsize=22, fontweight='bold', pad=30)
+            mun_poly.plot(ax=ax, color='#CFD8DC', edgecolor='#455A64', linewidth=2, zorder=2)
+            # Stats Label
+            ax.text(0.5, 0.05, f"Municipality: {label}\nTotal Area: {mun_area_km2:.1f} km²",
+                    transform=ax.transAxes, ha='center', fontsize=14,
+                    bbox=dict(facecolor='white', alpha=0.8, edgecolor='gray'))
+            if usa_context:
+                # Distance Arrow
+                ax.annotate('', xy=(bounds[2]-5000, top), xytext=(bounds[2]-5000, top-10000),
+                            arrowprops=dict(arrowstyle='<->', color='#1E88E5', lw=3))
+                ax.text(bounds[2]-4000, top-5000,
+                        "Direct Border\nProximity", color='#1E88E5', fontweight='bold', fontsize=12)
+
+            # Scale Bar & North Arrow
+            ax.add_artist(ScaleBar(1, location='lower left', font_properties={'size': 14}))
+            ax.annotate('N', xy=(0.05, 0.95), xytext=(0.05, 0.88),
+                        arrowprops=dict(facecolor='black', width=4, headwidth=12),
+                        ha='center', va='center', fontsize=20, xycoords='axes fraction')
+
+        # PANEL B: ESTABLISHMENT DENSITY (Model 1 Dependent Variable)
+        if i == 1:
+            ax.set_title("B. Spatial Proxy Weights\n(Establishment Density $n_{i,t}$)", fontsize=22, fontweight='bold', pad=30)
+            active_cells = cells[cells[count_col] > 0]
+            if len(active_cells):
+                active_cells.plot(column=count_col, ax=ax, cmap='Reds',
+                                  edgecolor='black', linewidth=0.4, legend=True,
+                                  legend_kwds={'shrink': 0.5}, zorder=3)
+                # the colorbar is the axes just added
+                cax2 = fig.get_axes()[-1]
+                cax2.set_ylabel("Establishments (Count)", fontsize=16, fontweight='bold', labelpad=15)
+                cax2.tick_params(labelsize=12)
+            else:
+                ax.text(0.5, 0.5, "No establishments", transform=ax.transAxes, ha='center', fontsize=16)
+
+        # PANEL C: CAPITAL INTENSITY (Model 2 Dependent Variable)
+        if i == 2:
+            # --- CALCULATE LOG CAPITAL INTENSITY (k = K/L) ---
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cells['log_k_ratio'] = np.where(
+                    cells[labor_col] > 0,
+                    np.log1p(cells[capital_col] / cells[labor_col]),
+                    0
+                )
+
+            # TITLE UPDATE: Using TeX notation to match the paper
+            ax.set_title(r"C. Variable of Interest" + "\n" + r"(Log Capital Intensity $\ln(k_{i,t})$)",
+                         fontsize=22, fontweight='bold', pad=30)
+
+            # Filter only active cells for clearer plotting
+            plot_data = cells[cells['log_k_ratio'] > 0]
+            if len(plot_data):
+                plot_data.plot(column='log_k_ratio', ax=ax, cmap='plasma',
+                               edgecolor='black', linewidth=0.4, legend=True,
+                               legend_kwds={'shrink': 0.5}, zorder=3)
+                cax3 = fig.get_axes()[-1]
+                cax3.set_ylabel(r"Log Capital per Worker ($\ln(k)$)", fontsize=16, fontweight='bold', labelpad=15)
+                cax3.tick_params(labelsize=12)
+            else:
+                ax.text(0.5, 0.5, "No capital data", transform=ax.transAxes, ha='center', fontsize=16)
+
+        # Zoom to the municipality (with room for the US side if shown)
+        ax.set_xlim([bounds[0]-2000, bounds[2]+2000])
+        ax.set_ylim([bounds[1]-5000, top+10000])
+        ax.axis('off')
+
+    plt.subplots_adjust(top=0.85, wspace=0.15)
+    return fig
+
+
+def input_hash(mun_poly, cells, target_sector, dpi):
+    """Digest of everything a sheet is drawn from."""
+    h = hashlib.sha256(f'{ATLAS_VERSION}|{target_sector}|{dpi}'.encode())
+    h.update(shapely.to_wkb(mun_poly.geometry.iloc[0]))
+    cols = ['grid_id'] + [f'{v}_{target_sector}' for v in ('count', 'labor_total', 'machinery')]
+    h.update(np.ascontiguousarray(cells[cols].to_numpy(dtype=float)).tobytes())
+    return h.hexdigest()
+
+
+# --- batch rendering ---
+
+_worker = {}
+
+
+def _attach(mun_path, panel_path, target_sector, out_dir, dpi, manifest, name_col):
+    matplotlib.use('Agg')
+    muns = gpd.read_file(mun_path)
+    muns['mun_key'] = [municipality_key(e, m) for e, m in zip(muns['CVE_ENT'], muns['CVE_MUN'])]
+    df = load_panel(panel_path)
+    data = df[df['year'] == df['year'].max()].reset_index(drop=True)
+    index = GridIndex.from_centroids(data['grid_id'], data['x_coord'], data['y_coord'], size=GRID_SIZE)
+    _worker.update(muns=muns.set_index('mun_key'), data=data, index=index,
+                   target_sector=target_sector, out_dir=out_dir, dpi=dpi,
+                   manifest=manifest, name_col=name_col)
+
+
+def sheet_path(out_dir, key, target_sector):
+    return os.path.join(out_dir, f'Atlas_{key}_sector{target_sector}.png')
+
+
+def render_one(key):
+    """Render one sheet unless its inputs are unchanged; returns (key, digest, status)."""
+    w = _worker
+    mun_poly = w['muns'].loc[[key]]
+    cells = municipality_cells(w['index'], w['data'], mun_poly.geometry.iloc[0])
+    digest = input_hash(mun_poly, cells, w['target_sector'], w['dpi'])
+    path = sheet_path(w['out_dir'], key, w['target_sector'])
+    if w['manifest'].get(key) == digest and os.path.exists(path):
+        return key, digest, 'unchanged'
+    label = mun_poly[w['name_col']].iloc[0] if w['name_col'] in mun_poly.columns else key
+    fig = draw_municipality(mun_poly, cells, w['target_sector'], label)
+    fig.savefig(path, dpi=w['dpi'], bbox_inches='tight')
+    plt.close(fig)
+    return key, digest, 'rendered'
+
+
+def render_atlas(mun_path, panel_path, out_dir, keys=None, target_sector='33', dpi=300,
+                 max_workers=None, name_col='NOMGEO'):
+    """
+    Render one sheet per municipality key (default: every municipality in the
+    layer) into out_dir. Returns a DataFrame of key / status.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, f'atlas_manifest_sector{target_sector}.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    if keys is None:
+        muns = gpd.read_file(mun_path, columns=['CVE_ENT', 'CVE_MUN'], ignore_geometry=True)
+        keys = [municipality_key(e, m) for e, m in zip(muns['CVE_ENT'], muns['CVE_MUN'])]
+    keys = list(dict.fromkeys(keys))
+    # build the panel cache here, not concurrently in every worker
+    load_panel(panel_path, columns=['grid_id'])
+
+    rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_attach,
+                                 initargs=(mun_path, panel_path, target_sector, out_dir, dpi,
+                                           manifest, name_col)) as pool:
+            futures = {pool.submit(render_one, key): key for key in keys}
+            for n, fut in enumerate(as_completed(futures), 1):
+                key = futures[fut]
+                try:
+                    key, digest, status = fut.result()
+                    manifest[key] = digest
+                except Exception:
+                    status = 'error: ' + traceback.format_exc(limit=1).strip().splitlines()[-1]
+                rows.append({'mun_key': key, 'status': status})
+                if n % 50 == 0 or n == len(keys):
+                    print(f"  [{n}/{len(keys)}] sheets done")
+    finally:
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=0, sort_keys=True)
+    return pd.DataFrame(rows).sort_values('mun_key').reset_index(drop=True)
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+# 3 x 3 bivariate classes of establishment density and capital intensity.
+# Notation matches Methodology & Tables:
+#   n = Establishment Density (Count)
+#   k = Capital Intensity (log(Machinery / Labor + 1))
+# Class = density tercile * 3 + intensity tercile, terciles taken within each
+# year over the cells with active firms.
+
+# Bivariate Palette (Pink-Blue-Purple), indexed by class
+BIVAR_COLORS = ["#e8e8e8", "#b0d5df", "#64acbe",
+                "#e4acac", "#ad9ea5", "#627f8c",
+                "#c85a5a", "#985356", "#574249"]
+
+
+def tercile(s):
+    return pd.qcut(s.rank(method='first'), 3, labels=False)
+
+
+def bivariate_classes(df, target_sector, year_col='year'):
+    """Class 0-8 of every row of the panel; -1 where n or k is missing or n == 0."""
+    n = df[f'count_{target_sector}']
+    l_val = df[f'labor_total_{target_sector}'].replace(0, np.nan)
+    k = np.log((df[f'machinery_{target_sector}'] / l_val) + 1)
+    ok = n.notna() & k.notna() & (n > 0)
+
+    codes = pd.Series(-1, index=df.index, dtype=int)
+    if ok.any():
+        sub = pd.DataFrame({'year': df.loc[ok, year_col], 'n': n[ok], 'k': k[ok]})
+        bin_n = sub.groupby('year')['n'].transform(tercile).astype(int)
+        bin_k = sub.groupby('year')['k'].transform(tercile).astype(int)
+        codes[ok] = bin_n * 3 + bin_k
+    return codes
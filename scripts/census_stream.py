@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# Streaming aggregation of the Economic Census establishment files.
+#
+# The census is read in chunks with only the needed columns. Municipality keys
+# are kept as integers (cve_mun = state * 1000 + municipality, so 1001 is the
+# '01001' of the maps) and NAICS codes are cut with integer division instead
+# of string slicing. Rows of unmapped years are dropped before grouping, and
+# the per-chunk sums are folded into one running total, so peak memory is one
+# chunk plus the aggregated output.
+
+
+def naics_prefix(codes, digits):
+    """First `digits` digits of integer NAICS codes (e.g. 3361 -> 33)."""
+    codes = np.asarray(codes, dtype=np.int64)
+    n_digits = np.floor(np.log10(np.maximum(codes, 1))).astype(np.int64) + 1
+    return codes // 10 ** np.maximum(n_digits - digits, 0)
+
+
+def mun_key(values):
+    """Integer municipality key from cve_mun / CVEGEO values ('01001', 1001.0, ...)."""
+    return pd.to_numeric(pd.Series(values), errors='coerce').astype('Int64')
+
+
+def stream_census(path, values, level=2, year_map=None, prefix=None, count=None, chunksize=500_000,
+                  year_col='year', mun_col='cve_mun', rama_col='rama'):
+    """
+    Sum `values` by year x municipality x NAICS code of `level` digits.
+
+    year_map: optional {census year: analysis year}; other years are dropped
+              and the result's year column holds the analysis year.
+    prefix:   optional NAICS prefix filter (e.g. 33 keeps only sector 33).
+    count:    optional name of an extra column holding the number of rows
+              (establishments) of each group.
+    Returns a DataFrame with columns [year, cve_mun, naics] + values (+ count),
+    where cve_mun and naics are integers.
+    """
+    values = list(values)
+    sums = values + ([count] if count else [])
+    usecols = [year_col, mun_col, rama_col] + values
+    total = None
+    reader = pd.read_csv(path, usecols=usecols, chunksize=chunksize,
+                         dtype={v: 'float64' for v in values})
+    for chunk in reader:
+        year = chunk[year_col]
+        if year_map is not None:
+            year = year.map(year_map)
+        keep = year.notna() & chunk[mun_col].notna() & chunk[rama_col].notna()
+        if not keep.any():
+            continue
+        chunk = chunk[keep]
+        rama = pd.to_numeric(chunk[rama_col], errors='coerce').to_numpy()
+        ok = ~np.isnan(rama)
+        naics = naics_prefix(rama[ok], level)
+        part = pd.DataFrame({
+            'year': year[keep].to_numpy()[ok].astype(np.int64),
+            'cve_mun': pd.to_numeric(chunk[mun_col], errors='coerce').to_numpy()[ok],
+            'naics': naics,
+        })
+        for v in values:
+            part[v] = chunk[v].to_numpy()[ok]
+        if count:
+            part[count] = 1.0
+        if prefix is not None:
+            part = part[naics_prefix(part['naics'].to_numpy(), len(str(prefix))) == int(prefix)]
+        part = part.dropna(subset=['cve_mun'])
+        part['cve_mun'] = part['cve_mun'].astype(np.int64)
+        part = part.groupby(['year', 'cve_mun', 'naics'])[sums].sum()
+        total = part if total is None else total.add(part, fill_value=0)
+
+    if total is None:
+        return pd.DataFrame(columns=['year', 'cve_mun', 'naics'] + sums)
+    return total.reset_index()
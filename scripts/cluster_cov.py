@@ -0,0 +1,289 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+from scipy.spatial import cKDTree
+from statsmodels.genmod.generalized_linear_model import GLM
+from statsmodels.regression.linear_model import RegressionModel
+
+# Sandwich covariances for OLS / Poisson / GLM fits.
+#
+# Everything works from the per-observation score matrix S (n x k) and the
+# bread B = H^-1:  V = B (sum_g s_g s_g') B.  Cluster sums s_g are segmented
+# reductions over observations pre-sorted by group, so no group dummies are
+# ever built. Conley spatial-HAC only visits pairs closer than the cutoff.
+#
+# The wild cluster bootstrap works from the same cluster score sums: with the
+# restricted (H0: beta_j = 0) fit, every bootstrap t-statistic is a function
+# of V @ (G x k) for the (B x G) matrix V of cluster weights, so B draws cost
+# a few matrix products and no refit.
+
+
+class GroupOffsets:
+    """Sort order and segment starts for one grouping; build once, reuse for every model."""
+
+    def __init__(self, groups):
+        codes, uniques = pd.factorize(pd.Series(np.asarray(groups)), sort=False)
+        if (codes < 0).any():
+            raise ValueError("Cluster variable has missing values")
+        self.codes = codes
+        self.n_groups = len(uniques)
+        self.order = np.argsort(codes, kind='stable')
+        self.starts = np.flatnonzero(np.r_[True, np.diff(codes[self.order]) != 0])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def sum(self, scores):
+        """(n_groups x k) score sums, one row per cluster."""
+        return np.add.reduceat(scores[self.order], self.starts, axis=0)
+
+
+def _as_offsets(groups):
+    return groups if isinstance(groups, GroupOffsets) else GroupOffsets(groups)
+
+
+def scores_and_bread(res):
+    """Per-observation scores and inverse Hessian of a (non-robust) statsmodels fit."""
+    model = res.model
+    x = np.asarray(model.exog, dtype=float)
+    if isinstance(model, RegressionModel):
+        w = getattr(model, 'weights', 1.0)
+        scores = x * (np.asarray(res.resid) * w)[:, None]
+        bread = np.linalg.inv((x.T * w) @ x)
+    else:
+        params = np.asarray(res.params)
+        scores = np.asarray(model.score_obs(params))
+        bread = np.linalg.inv(-np.asarray(model.hessian(params)))
+    return scores, bread
+
+
+def _meat(g_scores):
+    return g_scores.T @ g_scores
+
+
+def cluster_cov(scores, bread, groups, correction=True, k=None):
+    """
+    One-way cluster-robust covariance (statsmodels' small-sample correction).
+    k: parameters in the (n - 1) / (n - k) factor; default the columns of scores.
+    """
+    off = _as_offsets(groups)
+    n = scores.shape[0]
+    k = scores.shape[1] if k is None else k
+    cov = bread @ _meat(off.sum(scores)) @ bread
+    if correction:
+        g = off.n_groups
+        cov *= g / (g - 1) * (n - 1) / (n - k)
+    return cov
+
+
+def twoway_cluster_cov(scores, bread, groups1, groups2, correction=True):
+    """
+    Two-way clustering (Cameron, Gelbach & Miller 2011): V1 + V2 - V12, where
+    V12 clusters on the intersection. Negative eigenvalues are clipped to 0.
+    """
+    g1 = _as_offsets(groups1)
+    g2 = _as_offsets(groups2)
+    both = GroupOffsets(g1.codes.astype(np.int64) * g2.n_groups + g2.codes)
+    cov = (cluster_cov(scores, bread, g1, correction) + cluster_cov(scores, bread, g2, correction)
+           - cluster_cov(scores, bread, both, correction))
+    vals, vecs = np.linalg.eigh((cov + cov.T) / 2)
+    if vals.min() < 0:
+        cov = (vecs * np.clip(vals, 0, None)) @ vecs.T
+    return cov
+
+
+def conley_cov(scores, bread, coords, cutoff, time=None, kernel='bartlett'):
+    """
+    Conley (1999) spatial-HAC covariance.
+
+    coords: (n x 2) projected coordinates (same units as cutoff).
+    time:   optional period of each observation; if given, only pairs in the
+            same period are correlated.
+    kernel: 'bartlett' (1 - d/cutoff) or 'uniform'.
+    Memory is O(n * neighbours within cutoff), never O(n^2).
+    """
+    coords = np.asarray(coords, dtype=float)
+    periods = [np.arange(len(coords))] if time is None else \
+        [np.flatnonzero(time == t) for t in pd.unique(np.asarray(time))]
+    meat = np.zeros((scores.shape[1],) * 2)
+    for idx in periods:
+        tree = cKDTree(coords[idx])
+        dist = tree.sparse_distance_matrix(tree, cutoff, output_type='coo_matrix')
+        if kernel == 'bartlett':
+            wts = 1 - dist.data / cutoff
+        elif kernel == 'uniform':
+            wts = np.ones_like(dist.data)
+        else:
+            raise ValueError(f"Unknown kernel '{kernel}'")
+        n = len(idx)
+        # pairs at distance 0 (incl. each point with itself) are kept as explicit zeros
+        k_mat = sparse.csr_matrix((wts, (dist.row, dist.col)), shape=(n, n))
+        s = scores[idx]
+        meat += s.T @ (k_mat @ s)
+    return bread @ meat @ bread
+
+
+class RobustResults:
+    """
+    A statsmodels result with its covariance replaced. Inference is normal
+    (as with statsmodels' cluster option); everything else is delegated.
+    """
+
+    def __init__(self, res, cov, cov_type):
+        self._res = res
+        names = res.params.index if isinstance(res.params, pd.Series) else None
+        self.params = res.params
+        self.cov_type = cov_type
+        self._cov = pd.DataFrame(cov, index=names, columns=names)
+        self.bse = pd.Series(np.sqrt(np.diag(cov)), index=names)
+        self.tvalues = self.params / self.bse
+        self.pvalues = pd.Series(2 * stats.norm.sf(np.abs(self.tvalues)), index=names)
+
+    def __getattr__(self, name):
+        return getattr(self._res, name)
+
+    def cov_params(self):
+        return self._cov
+
+    def conf_int(self, alpha=0.05):
+        q = stats.norm.ppf(1 - alpha / 2)
+        return pd.DataFrame({0: self.params - q * self.bse, 1: self.params + q * self.bse})
+
+
+def cluster(res, groups, groups2=None):
+    """Re-express a fitted model with one- or two-way clustered errors."""
+    scores, bread = scores_and_bread(res)
+    if groups2 is None:
+        return RobustResults(res, cluster_cov(scores, bread, groups), 'cluster')
+    return RobustResults(res, twoway_cluster_cov(scores, bread, groups, groups2), 'cluster-2way')
+
+
+def conley(res, coords, cutoff, time=None, kernel='bartlett'):
+    """Re-express a fitted model with Conley spatial-HAC errors."""
+    scores, bread = scores_and_bread(res)
+    return RobustResults(res, conley_cov(scores, bread, coords, cutoff, time, kernel), 'conley')
+
+
+# --- wild cluster bootstrap ---
+
+def wild_weights(kind, size, rng):
+    """Cluster weights: 'rademacher' (+-1) or 'webb' (six points, +-sqrt(1/2, 1, 3/2))."""
+    if kind == 'rademacher':
+        return rng.integers(0, 2, size=size) * 2.0 - 1.0
+    if kind == 'webb':
+        vals = np.sqrt([0.5, 1.0, 1.5])
+        return np.r_[-vals, vals][rng.integers(0, 6, size=size)]
+    raise ValueError(f"Unknown wild weights '{kind}' (use 'rademacher' or 'webb')")
+
+
+def _wild_t(a, S, C, c, reps, seed, kind):
+    """
+    Bootstrap t-statistics of one block of replications.
+    Coefficient: v @ a. Cluster scores: v * a - (v @ S) @ C' (the second
+    term re-projects the bootstrap residuals; None for score bootstraps).
+    """
+    v = wild_weights(kind, (reps, len(a)), np.random.default_rng(seed))
+    s = v * a
+    if C is not None:
+        s -= (v @ S) @ C.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (v @ a) / np.sqrt(c * (s * s).sum(axis=1))
+
+
+def _restricted_fit(model, keep):
+    """Same model without the tested column (one refit per coefficient, not per draw)."""
+    exog = np.asarray(model.exog, dtype=float)[:, keep]
+    offset = getattr(model, 'offset', None)
+    if isinstance(model, GLM):
+        return GLM(model.endog, exog, family=model.family, offset=offset).fit()
+    return model.__class__(model.endog, exog, offset=offset).fit(disp=0)
+
+
+def _wild_terms(res, off, j, restricted=True):
+    """
+    (a, S, C, small-sample factor, observed t, se) for coefficient j, around
+    the restricted fit (H0: beta_j = 0) or, with restricted=False, around the
+    full fit, where the bootstrap t's are (beta*_j - beta_j) / se* (for CIs).
+    """
+    model = res.model
+    x = np.asarray(model.exog, dtype=float)
+    n, k = x.shape
+    keep = np.arange(k) != j
+    g = off.n_groups
+    c = g / (g - 1) * (n - 1) / (n - k)
+
+    if isinstance(model, RegressionModel):
+        # WCR bootstrap (Cameron, Gelbach & Miller 2008); WLS as OLS on sqrt(w)-scaled data
+        sw = np.sqrt(np.broadcast_to(np.asarray(getattr(model, 'weights', 1.0), dtype=float), (n,)))
+        x, y = x * sw[:, None], np.asarray(model.endog, dtype=float) * sw
+        P = np.linalg.inv(x.T @ x)
+        beta = P @ (x.T @ y)
+        se = np.sqrt(cluster_cov(x * (y - x @ beta)[:, None], P, off)[j, j])
+        if restricted:
+            u = y - x[:, keep] @ np.linalg.lstsq(x[:, keep], y, rcond=None)[0]
+        else:
+            u = y - x @ beta
+        S = off.sum(x * u[:, None])
+        C = off.sum(x * (x @ P[:, j])[:, None]) @ P
+        return S @ P[:, j], S, C, c, beta[j] / se, se
+
+    # score bootstrap (Kline & Santos 2012) around the restricted estimates
+    if restricted:
+        theta = np.zeros(k)
+        theta[keep] = np.asarray(_restricted_fit(model, keep).params)
+    else:
+        theta = np.asarray(res.params, dtype=float)
+    S = off.sum(np.asarray(model.score_obs(theta)))
+    P = np.linalg.inv(-np.asarray(model.hessian(theta)))
+    a = S @ P[:, j]
+    se = np.sqrt(c * (a * a).sum())
+    return a, None, None, c, (a.sum() if restricted else theta[j]) / se, se
+
+
+def wild_cluster_bootstrap(res, groups, params=None, reps=9999, weights='rademacher', seed=0,
+                           max_workers=None, block=None, alpha=None):
+    """
+    Restricted wild cluster bootstrap p-values (H0: coefficient = 0).
+
+    res:         statsmodels fit (or a RobustResults around one). OLS/WLS use
+                 the wild restricted residual bootstrap; other likelihood
+                 models (Poisson, GLM) the score bootstrap.
+    params:      names of the coefficients to test (default: all).
+    weights:     'rademacher' or 'webb' (better with few clusters).
+    max_workers: None = in this process; otherwise blocks of replications
+                 are spread over a process pool (needs a __main__ guard on
+                 Windows). Results depend only on seed and block.
+    alpha:       also return symmetric percentile-t (1 - alpha) intervals
+                 ci_lower / ci_upper from the unrestricted bootstrap.
+    Returns a DataFrame (index = params) with t_stat and p_value (and the CIs).
+    """
+    off = _as_offsets(groups)
+    names = list(res.model.exog_names)
+    params = names if params is None else list(params)
+    block = block or max(16, min(reps, 2 ** 22 // off.n_groups))
+    sizes = [min(block, reps - s) for s in range(0, reps, block)]
+
+    rows = {}
+    pool = ProcessPoolExecutor(max_workers=max_workers) if max_workers else None
+    try:
+        def draw(a, S, C, c):
+            seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+            args = [(a, S, C, c, r, sd, weights) for r, sd in zip(sizes, seeds)]
+            blocks = pool.map(_wild_t, *zip(*args)) if pool else [_wild_t(*arg) for arg in args]
+            t_boot = np.concatenate(list(blocks))
+            return t_boot[np.isfinite(t_boot)]
+
+        for name in params:
+            j = names.index(name)
+            a, S, C, c, t, _ = _wild_terms(res, off, j)
+            rows[name] = {'t_stat': t, 'p_value': np.mean(np.abs(draw(a, S, C, c)) >= abs(t))}
+            if alpha is not None:
+                a, S, C, c, t, se = _wild_terms(res, off, j, restricted=False)
+                half = np.quantile(np.abs(draw(a, S, C, c)), 1 - alpha) * se
+                rows[name].update(ci_lower=t * se - half, ci_upper=t * se + half)
+    finally:
+        if pool:
+            pool.shutdown()
+    return pd.DataFrame.from_dict(rows, orient='index')
@@ -0,0 +1,108 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Municipality -> grid allocation as a sparse operator.
+#
+# A (n_mun x n_grid) holds the dasymetric weights: A[m, g] = n_g / sum_{h in m} n_h
+# for every cell g in municipality m, where n is the establishment count.
+# Census values (n_mun x n_vars) are distributed to the grid with one product
+# A.T @ V; A's pattern summed over cells gives the grid -> municipality
+# aggregation used for consistency checks.
+
+
+class AllocationOperator:
+
+    def __init__(self, matrix, mun_keys, grid_mun):
+        self.matrix = matrix.tocsr()          # (n_mun, n_grid)
+        self.mun_keys = np.asarray(mun_keys)  # municipality key of each row
+        self.grid_mun = np.asarray(grid_mun)  # row of each grid cell, -1 = no municipality
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def T(self):
+        """Distribution form (n_grid x n_mun)."""
+        return self.matrix.T.tocsr()
+
+    @classmethod
+    def build(cls, mun_key, counts):
+        """
+        mun_key: municipality key of each grid cell (missing = NaN/None).
+        counts:  establishment count of each grid cell (the weights).
+        Cells of municipalities with no establishments get weight 0.
+        """
+        codes, keys = pd.factorize(pd.Series(mun_key))
+        counts = np.nan_to_num(np.asarray(counts, dtype=float))
+        has = codes >= 0
+        total = np.bincount(codes[has], weights=counts[has], minlength=len(keys))
+        w = np.zeros(len(codes))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w[has] = np.where(total[codes[has]] > 0, counts[has] / total[codes[has]], 0.0)
+        cells = np.flatnonzero(has & (w > 0))
+        matrix = sparse.csr_matrix((w[cells], (codes[cells], cells)), shape=(len(keys), len(codes)))
+        return cls(matrix, keys.to_numpy(), codes)
+
+    @classmethod
+    def cached(cls, cache_dir, mun_key, counts):
+        """build(), persisted under cache_dir keyed on the keys and counts."""
+        if cache_dir is None:
+            return cls.build(mun_key, counts)
+        h = hashlib.sha256(pd.Series(mun_key).astype(str).str.cat(sep='|').encode())
+        h.update(np.ascontiguousarray(np.nan_to_num(np.asarray(counts, dtype=float))).tobytes())
+        path = os.path.join(cache_dir, f'alloc_{h.hexdigest()[:20]}.npz')
+        if os.path.exists(path):
+            return cls.load(path)
+        op = cls.build(mun_key, counts)
+        os.makedirs(cache_dir, exist_ok=True)
+        op.save(path)
+        return op
+
+    def save(self, path):
+        m = self.matrix
+        keys = self.mun_keys
+        keys = keys.astype(np.int64) if pd.api.types.is_integer_dtype(pd.Series(keys).infer_objects()) else keys.astype(str)
+        np.savez(path, data=m.data, indices=m.indices, indptr=m.indptr, shape=m.shape,
+                 mun_keys=keys, grid_mun=self.grid_mun)
+
+    @classmethod
+    def load(cls, path):
+        z = np.load(path, allow_pickle=False)
+        matrix = sparse.csr_matrix((z['data'], z['indices'], z['indptr']), shape=tuple(z['shape']))
+        keys = z['mun_keys']
+        return cls(matrix, keys if keys.dtype.kind in 'iu' else keys.astype(object), z['grid_mun'])
+
+    def align(self, table, columns):
+        """Rows of `table` (indexed by municipality key) in operator order; NaN where absent."""
+        rows = table.index.get_indexer(self.mun_keys)
+        vals = table[columns].to_numpy(dtype=float)[np.clip(rows, 0, None)]
+        vals[rows < 0] = np.nan
+        return vals
+
+    def distribute(self, values):
+        """
+        (n_mun x k) municipality values -> (n_grid x k) grid values.
+        Cells without a municipality, or whose municipality value is NaN, get NaN.
+        """
+        values = np.asarray(values, dtype=float)
+        squeeze = values.ndim == 1
+        values = values.reshape(len(self.mun_keys), -1)
+        out = np.asarray(self.matrix.T @ np.nan_to_num(values))
+        missing = np.ones(out.shape, dtype=bool)
+        has = self.grid_mun >= 0
+        missing[has] = np.isnan(values[self.grid_mun[has]])
+        out[missing] = np.nan
+        return out[:, 0] if squeeze else out
+
+    def aggregate(self, grid_values):
+        """(n_grid x k) grid values summed to (n_mun x k), over each municipality's cells."""
+        grid_values = np.nan_to_num(np.asarray(grid_values, dtype=float))
+        has = self.grid_mun >= 0
+        member = sparse.csr_matrix((np.ones(has.sum()), (self.grid_mun[has], np.flatnonzero(has))),
+                                   shape=self.matrix.shape)
+        return np.asarray(member @ grid_values)
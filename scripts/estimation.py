@@ -0,0 +1,73 @@
+import pandas as pd
+import patsy
+import statsmodels.api as sm
+
+from cluster_cov import GroupOffsets, cluster
+
+# One design matrix, many nested models.
+#
+# The patsy formula is parsed once. Nested specifications are built by
+# appending raw columns to that design, and every Poisson fit can start from
+# the coefficients of the model it extends (missing coefficients start at 0).
+
+
+class EstimationSession:
+
+    def __init__(self, data, depvar, rhs, groups='grid_id'):
+        y, x = patsy.dmatrices(f"{depvar} ~ {rhs}", data, return_type='dataframe')
+        self.data = data
+        self.y = y.iloc[:, 0]
+        self.x = x
+        self.groups = GroupOffsets(data.loc[x.index, groups].to_numpy()) if groups else None
+        self.results = {}
+        self._designs = {}
+
+    def design(self, extra=()):
+        """Base design with the given data columns appended (cached per column set)."""
+        extra = tuple(extra)
+        if extra not in self._designs:
+            if extra:
+                added = self.data.loc[self.x.index, list(extra)].astype(float)
+                self._designs[extra] = pd.concat([self.x, added], axis=1)
+            else:
+                self._designs[extra] = self.x
+        return self._designs[extra]
+
+    def _robust(self, res):
+        return res if self.groups is None else cluster(res, self.groups)
+
+    def fit_ols(self, name, extra=()):
+        x = self.design(extra)
+        res = self._robust(sm.OLS(self.y, x).fit())
+        self.results[name] = res
+        return res
+
+    def fit_poisson(self, name, extra=(), parent=None, **fit_kwds):
+        """
+        Poisson fit of the base design plus `extra` columns. If `parent` names
+        an earlier fit, its coefficients are used as starting values.
+        """
+        x = self.design(extra)
+        start = None
+        if parent is not None:
+            start = self.results[parent].params.reindex(x.columns).fillna(0.0).to_numpy()
+        res = self._robust(sm.Poisson(self.y, x).fit(start_params=start, disp=0, **fit_kwds))
+        self.results[name] = res
+        return res
+
+    def fit_all(self, specs):
+        """
+        Fit a batch of specifications in order and return {name: result}.
+
+        specs: iterable of (name, kind, extra_columns, parent) with kind in
+        {'ols', 'poisson'}; parent may be None.
+        """
+        out = {}
+        for name, kind, extra, parent in specs:
+            if kind == 'ols':
+                out[name] = self.fit_ols(name, extra)
+            elif kind == 'poisson':
+                out[name] = self.fit_poisson(name, extra, parent)
+            else:
+                raise ValueError(f"Unknown model kind '{kind}'")
+        return out
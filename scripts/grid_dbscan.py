@@ -0,0 +1,207 @@
+import numpy as np
+from scipy import sparse
+
+# DBSCAN for planar point sets (DENUE establishments in metres).
+#
+# Points are sorted into eps x eps buckets, so every eps-neighbour of a point
+# lies in the 3 x 3 block of buckets around it; each unordered pair is tested
+# once by scanning half of that block. Bucket counts give an upper bound on a
+# point's neighbourhood size, so pairs between two points that cannot be core
+# are never distance-tested. Core points are joined with a vectorised
+# union-find and border points take the lowest-numbered adjacent cluster, which
+# makes the labels identical to sklearn.cluster.DBSCAN(eps, min_samples).
+
+
+def point_coords(geoms):
+    """(n x 2) array of x/y from a GeoSeries of points, without a Python loop."""
+    return np.column_stack([geoms.x.to_numpy(dtype=float), geoms.y.to_numpy(dtype=float)])
+
+
+class _Buckets:
+
+    def __init__(self, coords, size):
+        cell = np.floor((coords - coords.min(axis=0)) / size).astype(np.int64)
+        # +1 margin so that the -1/+1 neighbour offsets never wrap to another column
+        ny = int(cell[:, 1].max()) + 3
+        key = (cell[:, 0] + 1) * ny + (cell[:, 1] + 1)
+        self.order = np.argsort(key, kind='stable')     # sorted position -> point
+        self.key = key[self.order]                      # bucket key by sorted position
+        self.ukeys, self.ustart, self.ucount = np.unique(self.key, return_index=True,
+                                                         return_counts=True)
+        self.bucket = np.repeat(np.arange(len(self.ukeys)), self.ucount)
+        self.full = [dx * ny + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+        # the other half of the 3 x 3 block is covered from the neighbour's side
+        self.half = [1, ny - 1, ny, ny + 1]
+
+    def block(self, pos, offset):
+        """Start position and size of the bucket at `offset` from each position's bucket."""
+        k = self.key[pos] + offset
+        b = np.minimum(np.searchsorted(self.ukeys, k), len(self.ukeys) - 1)
+        hit = self.ukeys[b] == k
+        return np.where(hit, self.ustart[b], 0), np.where(hit, self.ucount[b], 0)
+
+    def block_count(self):
+        """Number of points in the 3 x 3 block around each sorted position."""
+        pos = self.ustart
+        per_bucket = sum(self.block(pos, off)[1] for off in self.full)
+        return per_bucket[self.bucket]
+
+
+def _ranges(start, count):
+    """Concatenation of arange(s, s + c) for every (s, c), vectorised."""
+    total = int(count.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.cumsum(count)
+    return np.arange(total) - np.repeat(ends - count, count) + np.repeat(start, count)
+
+
+def neighbour_pairs(coords, eps, min_samples=None, max_pairs=4_000_000, return_distance=False):
+    """
+    All unordered pairs (i, j), i != j, with |p_i - p_j| <= eps, as int32
+    arrays (plus squared distances if return_distance). With min_samples,
+    pairs of two points that cannot be core are skipped. Candidate pairs are
+    tested in chunks of ~max_pairs.
+    """
+    coords = np.asarray(coords, dtype=float)
+    n = len(coords)
+    b = _Buckets(coords, eps)
+    x, y = coords[b.order, 0], coords[b.order, 1]
+    order = b.order.astype(np.int32)
+    maybe_core = np.ones(n, dtype=bool) if min_samples is None else b.block_count() >= min_samples
+
+    # same-bucket partners after p, then the four forward buckets
+    end = (b.ustart + b.ucount)[b.bucket]
+    cand = end - np.arange(n) - 1
+    blocks = [b.block(np.arange(n), off) for off in b.half]
+    for _, c in blocks:
+        cand = cand + c
+    bounds = np.r_[0, np.searchsorted(np.cumsum(cand), np.arange(max_pairs, cand.sum(), max_pairs)), n]
+
+    eps2 = eps * eps
+    out_i, out_j, out_d2 = [], [], []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if hi <= lo:
+            continue
+        pos = np.arange(lo, hi)
+        filtered = not maybe_core[lo:hi].all()
+        parts = [(pos + 1, end[lo:hi] - pos - 1)] + [(s[lo:hi], c[lo:hi]) for s, c in blocks]
+        for start, count in parts:
+            p = np.repeat(pos, count)
+            q = _ranges(start, count)
+            if filtered:
+                keep = maybe_core[p] | maybe_core[q]
+                p, q = p[keep], q[keep]
+            dx, dy = x[p] - x[q], y[p] - y[q]
+            d2 = dx * dx + dy * dy
+            keep = d2 <= eps2
+            out_i.append(order[p[keep]])
+            out_j.append(order[q[keep]])
+            if return_distance:
+                out_d2.append(d2[keep])
+    if not out_i:
+        out_i = out_j = [np.empty(0, np.int32)]
+        out_d2 = [np.empty(0)]
+    pairs = np.concatenate(out_i), np.concatenate(out_j)
+    return pairs + (np.concatenate(out_d2),) if return_distance else pairs
+
+
+# --- union-find (roots are always the smallest index of their component) ---
+
+def _compress(parent):
+    """Pointer jumping until every entry points at its root."""
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent[:] = grand
+
+
+def _union(parent, a, b, block=1 << 20):
+    for s in range(0, len(a), block):
+        # with parent compressed, edges inside one component cost one lookup
+        _compress(parent)
+        ra, rb = parent[a[s:s + block]], parent[b[s:s + block]]
+        while True:
+            diff = ra != rb
+            if not diff.any():
+                break
+            lo, hi = np.minimum(ra, rb)[diff], np.maximum(ra, rb)[diff]
+            np.minimum.at(parent, hi, lo)
+            _compress(parent)
+            ra, rb = parent[lo], parent[hi]
+
+
+def labels_from_pairs(n, i, j, min_samples):
+    """DBSCAN labels from the unordered eps-neighbour pairs (i, j) of n points."""
+    counts = 1 + np.bincount(i, minlength=n) + np.bincount(j, minlength=n)
+    core = counts >= min_samples
+    ci, cj = core[i], core[j]
+
+    # 1. connect core points
+    root = np.arange(n)
+    both = ci & cj
+    _union(root, i[both], j[both])
+    _compress(root)
+
+    # 2. border points join the lowest adjacent cluster
+    border = np.full(n, n, dtype=np.int64)
+    one = ci != cj
+    i, j, ci = i[one], j[one], ci[one]
+    c, nc = np.where(ci, i, j), np.where(ci, j, i)
+    np.minimum.at(border, nc, root[c])
+
+    roots = np.where(core, root, np.where(border < n, border, -1))
+    labels = np.full(n, -1, dtype=np.int64)
+    has = roots >= 0
+    # clusters are numbered in order of their lowest core index, as in sklearn
+    labels[has] = np.unique(roots[has], return_inverse=True)[1]
+    return labels
+
+
+def dbscan(coords, eps, min_samples, max_pairs=4_000_000):
+    """DBSCAN labels (-1 = noise) for an (n x 2) coordinate array."""
+    coords = np.asarray(coords, dtype=float)
+    if len(coords) == 0:
+        return np.empty(0, dtype=np.int64)
+    i, j = neighbour_pairs(coords, eps, min_samples, max_pairs)
+    return labels_from_pairs(len(coords), i, j, min_samples)
+
+
+class RadiusGraph:
+    """
+    eps-neighbour pairs of a point set at a maximum radius, sorted by distance,
+    so that the pairs within any eps <= max_eps are a prefix. Labels for a grid
+    of (eps, min_samples) values then come from one neighbour search.
+    """
+
+    def __init__(self, coords, max_eps, max_pairs=4_000_000):
+        coords = np.asarray(coords, dtype=float)
+        self.n = len(coords)
+        self.max_eps = max_eps
+        if self.n == 0:
+            self.i = self.j = np.empty(0, np.int32)
+            self.d2 = np.empty(0)
+            return
+        i, j, d2 = neighbour_pairs(coords, max_eps, max_pairs=max_pairs, return_distance=True)
+        order = np.argsort(d2, kind='stable')
+        self.i, self.j, self.d2 = i[order], j[order], d2[order]
+
+    def __len__(self):
+        return len(self.d2)
+
+    def pairs(self, eps):
+        if eps > self.max_eps:
+            raise ValueError(f"eps={eps} is above the graph radius {self.max_eps}")
+        k = np.searchsorted(self.d2, eps * eps, side='right')
+        return self.i[:k], self.j[:k]
+
+    def labels(self, eps, min_samples):
+        """Same labels as dbscan(coords, eps, min_samples)."""
+        return labels_from_pairs(self.n, *self.pairs(eps), min_samples)
+
+    def tocsr(self, eps=None):
+        """Symmetric (n x n) distance matrix of the pairs within eps (default: all)."""
+        i, j = self.pairs(self.max_eps if eps is None else eps)
+        d = np.sqrt(self.d2[:len(i)])
+        return sparse.csr_matrix((np.r_[d, d], (np.r_[i, j], np.r_[j, i])), shape=(self.n, self.n))
@@ -0,0 +1,193 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+# Point -> cell assignment on the regular 5 km grid by arithmetic.
+#
+# The grid is a square lattice: cell (row, col) covers
+#   [x0 + col * size, x0 + (col + 1) * size] x [y0 + row * size, y0 + (row + 1) * size].
+# A point's cell is found with floor division and a (rows x cols) lookup table
+# of grid positions, in O(n) without a spatial index. Only points within `tol`
+# of a lattice line (which touch two or four cells) and points in cells whose
+# geometry is not the full square (e.g. clipped at the coast) get an exact
+# shapely test, so the result equals gpd.sjoin(..., predicate='intersects').
+
+
+class GridIndex:
+
+    def __init__(self, grid_ids, col, row, x0, y0, size, geometry=None, exact=None, centroids=None):
+        """
+        grid_ids:  grid_id of each cell (position = index into this array).
+        col, row:  integer lattice position of each cell.
+        geometry:  optional cell polygons (shapely array) used for exact tests;
+                   defaults to squares built on demand.
+        exact:     cells whose geometry differs from the lattice square.
+        centroids: optional (x, y) arrays the squares are centred on (instead
+                   of the lattice positions).
+        """
+        self.grid_ids = np.asarray(grid_ids)
+        self.x0, self.y0, self.size = float(x0), float(y0), float(size)
+        col, row = np.asarray(col, dtype=np.int64), np.asarray(row, dtype=np.int64)
+        self.shape = (int(row.max()) + 1, int(col.max()) + 1)
+        self.table = np.full(self.shape, -1, dtype=np.int64)
+        if len(np.unique(row * self.shape[1] + col)) != len(col):
+            raise ValueError("two cells map to the same lattice position")
+        self.table[row, col] = np.arange(len(col))
+        self.col, self.row = col, row
+        self._geometry = None if geometry is None else np.asarray(geometry)
+        self._bounds = None if geometry is None else shapely.bounds(self._geometry)
+        self.centroids = None if centroids is None else tuple(np.asarray(c, dtype=float) for c in centroids)
+        self.exact = np.zeros(len(col), dtype=bool) if exact is None else np.asarray(exact, dtype=bool)
+        self.tol = 1e-6 * self.size
+
+    def __len__(self):
+        return len(self.grid_ids)
+
+    @classmethod
+    def from_centroids(cls, grid_ids, x, y, size=5000):
+        """Lattice from cell centroids (e.g. the panel's x_coord / y_coord)."""
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        fx = (x - x.min()) / size
+        fy = (y - y.min()) / size
+        col, row = np.rint(fx).astype(np.int64), np.rint(fy).astype(np.int64)
+        off = max(np.abs(fx - col).max(), np.abs(fy - row).max()) * size
+        if off > 1e-3 * size:
+            raise ValueError(f"centroids are up to {off:.1f} m off a {size} m lattice")
+        half = size / 2
+        return cls(grid_ids, col, row, x.min() - half, y.min() - half, size, centroids=(x, y))
+
+    @classmethod
+    def from_grid(cls, grid, id_col='grid_id', size=None):
+        """Lattice from the grid GeoDataFrame; clipped cells are flagged for exact tests."""
+        geoms = grid.geometry.to_numpy()
+        b = shapely.bounds(geoms)
+        w, h = b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]
+        size = float(np.median(w)) if size is None else float(size)
+        full = (np.abs(w - size) < 1e-6 * size) & (np.abs(h - size) < 1e-6 * size) \
+            & (np.abs(shapely.area(geoms) - size * size) < 1e-6 * size * size)
+        if not full.any():
+            raise ValueError("no full-size cells to anchor the lattice")
+        ref = np.flatnonzero(full)[0]
+        # a point inside each cell places it on the lattice, clipped or not
+        inner = shapely.get_coordinates(shapely.point_on_surface(geoms))
+        col = np.floor((inner[:, 0] - b[ref, 0]) / size).astype(np.int64)
+        row = np.floor((inner[:, 1] - b[ref, 1]) / size).astype(np.int64)
+        x0, y0 = b[ref, 0] + col.min() * size, b[ref, 1] + row.min() * size
+        return cls(grid[id_col].to_numpy(), col - col.min(), row - row.min(), x0, y0, size,
+                   geometry=geoms, exact=~full)
+
+    # --- cell polygons ---
+    def bounds(self, pos=None):
+        """(k x 4) minx, miny, maxx, maxy of the cells at `pos`, from arrays only."""
+        pos = np.arange(len(self)) if pos is None else np.asarray(pos)
+        if self._bounds is not None:
+            return self._bounds[pos]
+        half = self.size / 2
+        if self.centroids is not None:
+            x, y = self.centroids[0][pos], self.centroids[1][pos]
+        else:
+            x = self.x0 + (self.col[pos] + 0.5) * self.size
+            y = self.y0 + (self.row[pos] + 0.5) * self.size
+        return np.column_stack([x - half, y - half, x + half, y + half])
+
+    def cells(self, pos=None):
+        """Polygons of the cells at `pos` (default: all); squares are built only for `pos`."""
+        pos = np.arange(len(self)) if pos is None else np.asarray(pos)
+        if self._geometry is not None:
+            return self._geometry[pos]
+        b = self.bounds(pos)
+        return shapely.box(b[:, 0], b[:, 1], b[:, 2], b[:, 3])
+
+    @property
+    def geometry(self):
+        """The whole polygon layer, built once (vectorised) and kept."""
+        if self._geometry is None:
+            self._geometry = self.cells()
+            self._bounds = shapely.bounds(self._geometry)
+        return self._geometry
+
+    # --- rasters ---
+    @property
+    def extent(self):
+        """(left, right, bottom, top) of the lattice, for imshow(origin='lower')."""
+        H, W = self.shape
+        return (self.x0, self.x0 + W * self.size, self.y0, self.y0 + H * self.size)
+
+    def raster(self, values, fill=0):
+        """(rows x cols) array with each cell's value at its lattice position."""
+        values = np.asarray(values)
+        out = np.full(self.shape + values.shape[1:], fill, dtype=values.dtype)
+        out[self.row, self.col] = values
+        return out
+
+    def layer(self, pos=None, data=None, crs=None):
+        """GeoDataFrame of the cells at `pos`, optionally with their data rows."""
+        pos = np.arange(len(self)) if pos is None else np.asarray(pos)
+        data = {'grid_id': self.grid_ids[pos]} if data is None else data
+        return gpd.GeoDataFrame(data, geometry=self.cells(pos), crs=crs)
+
+    def _cell(self, col, row):
+        ok = (col >= 0) & (col < self.shape[1]) & (row >= 0) & (row < self.shape[0])
+        pos = np.full(len(col), -1, dtype=np.int64)
+        pos[ok] = self.table[row[ok], col[ok]]
+        return pos
+
+    def assign(self, x, y):
+        """
+        (point, cell position) pairs for every cell each point intersects,
+        sorted by point. A point on a cell edge is paired with every cell it
+        touches, as with gpd.sjoin(predicate='intersects').
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        fx, fy = (x - self.x0) / self.size, (y - self.y0) / self.size
+        col, row = np.floor(fx).astype(np.int64), np.floor(fy).astype(np.int64)
+        pos = self._cell(col, row)
+        # distance to the nearest lattice line, in metres
+        edge = np.minimum(np.abs(fx - np.rint(fx)), np.abs(fy - np.rint(fy))) * self.size
+        slow = (edge <= self.tol) | ((pos >= 0) & self.exact[np.maximum(pos, 0)])
+
+        fast = np.flatnonzero(~slow & (pos >= 0))
+        pt, cell = [fast], [pos[fast]]
+        idx = np.flatnonzero(slow)
+        if len(idx):
+            # exact test against the 3 x 3 block of cells around each point
+            cand = np.stack([self._cell(col[idx] + dc, row[idx] + dr)
+                             for dc in (-1, 0, 1) for dr in (-1, 0, 1)], axis=1)
+            p = np.repeat(idx, 9)
+            c = cand.ravel()
+            p, c = p[c >= 0], c[c >= 0]
+            hit = shapely.intersects(self.cells(c), shapely.points(x[p], y[p]))
+            p, c = p[hit], c[hit]
+            order = np.lexsort((c, p))
+            pt.append(p[order])
+            cell.append(c[order])
+        pt, cell = np.concatenate(pt), np.concatenate(cell)
+        if len(idx):
+            order = np.argsort(pt, kind='stable')
+            pt, cell = pt[order], cell[order]
+        return pt, cell
+
+    def locate(self, x, y):
+        """Position of one cell containing each point (lowest position on ties; -1 = none)."""
+        pt, cell = self.assign(x, y)
+        pos = np.full(len(np.asarray(x)), -1, dtype=np.int64)
+        first = np.r_[True, pt[1:] != pt[:-1]] if len(pt) else np.zeros(0, dtype=bool)
+        pos[pt[first]] = cell[first]
+        return pos
+
+    def intersecting(self, geom):
+        """
+        Positions of the cells that intersect a polygon. Candidates come from
+        the lattice window under the polygon's bounds and an array bounding-box
+        test; only those get polygons and an exact intersection test, so the
+        cost scales with the polygon's cells, not with the whole grid.
+        """
+        minx, miny, maxx, maxy = shapely.bounds(geom)
+        c0, c1 = int(np.floor((minx - self.x0) / self.size)) - 1, int(np.floor((maxx - self.x0) / self.size)) + 1
+        r0, r1 = int(np.floor((miny - self.y0) / self.size)) - 1, int(np.floor((maxy - self.y0) / self.size)) + 1
+        block = self.table[max(r0, 0):max(r1 + 1, 0), max(c0, 0):max(c1 + 1, 0)].ravel()
+        cand = np.sort(block[block >= 0])
+        b = self.bounds(cand)
+        cand = cand[(b[:, 0] <= maxx) & (b[:, 2] >= minx) & (b[:, 1] <= maxy) & (b[:, 3] >= miny)]
+        shapely.prepare(geom)
+        return cand[shapely.intersects(geom, self.cells(cand))]
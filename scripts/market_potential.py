@@ -0,0 +1,138 @@
+import numpy as np
+from scipy import fft, sparse
+from scipy.spatial import cKDTree
+
+from grid_index import GridIndex
+
+# Market potential MP_i = sum_{j != i} M_j * f(d_ij) over all grid cells.
+#
+# Kernels are (kind, parameter) pairs with distances in km:
+#   ('exp', tau)   f(d) = exp(-d / tau)
+#   ('pow', theta) f(d) = d ** -theta
+# truncated at a cutoff distance (300 km by default).
+#
+# On the regular lattice f(d_ij) only depends on the cell offset, so MP is a
+# 2-D convolution of the mass raster with one kernel image: the masses are
+# FFT'd once and every kernel costs one product and one inverse transform.
+# The FFT canvas only extends the lattice by the kernel's reach, so a finite
+# cutoff also bounds memory; channels are transformed in chunks.
+# The N x N distance matrix is never built. For point sets that are not on
+# a lattice, potential_blocked() sums over KD-tree pairs within the cutoff,
+# one block of rows at a time.
+
+
+def kernel_name(kind, param):
+    """Column suffix of a kernel, e.g. ('exp', 50) -> 'exp50', ('pow', 1.5) -> 'pow1.5'."""
+    return f'{kind}{param:g}'
+
+
+def kernel_weights(d_km, kind, param, cutoff_km=None):
+    """f(d) for an array of distances; 0 at d = 0 (own cell) and beyond the cutoff."""
+    d_km = np.asarray(d_km, dtype=float)
+    w = np.zeros(d_km.shape)
+    ok = d_km > 0
+    if cutoff_km is not None:
+        ok &= d_km <= cutoff_km
+    if kind == 'exp':
+        w[ok] = np.exp(-d_km[ok] / param)
+    elif kind == 'pow':
+        w[ok] = d_km[ok] ** -float(param)
+    else:
+        raise ValueError(f"Unknown kernel '{kind}' (use 'exp' or 'pow')")
+    return w
+
+
+def potential_lattice(index, masses, kernels, cutoff_km=300, memory_mb=512):
+    """
+    index:   GridIndex of the cells (positions = rows of `masses`).
+    masses:  (n x m) masses per cell, e.g. counts for several years/sectors.
+    kernels: list of (kind, parameter).
+    cutoff_km: kernel truncation; None = the whole lattice (the FFTs then
+             cover twice its extent in each direction).
+    Channels (columns of `masses`) are transformed in chunks of at most
+    memory_mb. Returns {kernel_name: (n x m)}.
+    """
+    masses = np.asarray(masses, dtype=float)
+    squeeze = masses.ndim == 1
+    masses = masses.reshape(len(index), -1)
+    H, W = index.shape
+    size_km = index.size / 1000
+
+    # kernel image over cell offsets (truncated at the cutoff, if any)
+    rh, rw = H - 1, W - 1
+    if cutoff_km is not None:
+        reach = int(np.ceil(cutoff_km / size_km))
+        rh, rw = min(rh, reach), min(rw, reach)
+    dy, dx = np.meshgrid(np.arange(-rh, rh + 1), np.arange(-rw, rw + 1), indexing='ij')
+    d_km = np.hypot(dx, dy) * size_km
+
+    # Circular convolution on an (H + rh) x (W + rw) canvas: offsets beyond the
+    # kernel's reach wrap to offsets that are still beyond it, so the cells of
+    # the lattice never pick up wrapped mass. The kernel sits with offset 0 at
+    # the origin and negative offsets wrapped to the far edge.
+    shape = (fft.next_fast_len(H + rh, real=True), fft.next_fast_len(W + rw, real=True))
+    f_kernels = {}
+    for kind, param in kernels:
+        image = np.zeros(shape)
+        image[:2 * rh + 1, :2 * rw + 1] = kernel_weights(d_km, kind, param, cutoff_km)
+        f_kernels[kernel_name(kind, param)] = fft.rfft2(np.roll(image, (-rh, -rw), axis=(0, 1)))
+
+    # per channel: the canvas, its transform and one product / inverse at a time
+    per_channel = shape[0] * shape[1] * 8 * 4
+    chunk = int(max(1, min(masses.shape[1], memory_mb * 2 ** 20 // per_channel)))
+    out = {name: np.empty(masses.shape) for name in f_kernels}
+    for s in range(0, masses.shape[1], chunk):
+        block = masses[:, s:s + chunk]
+        canvas = np.zeros((block.shape[1],) + shape)
+        canvas[:, index.row, index.col] = block.T
+        f_mass = fft.rfft2(canvas)
+        del canvas
+        for name, f_kernel in f_kernels.items():
+            conv = fft.irfft2(f_mass * f_kernel, s=shape)
+            # masses and kernels are non-negative; round-off leaves tiny negatives
+            out[name][:, s:s + chunk] = np.maximum(conv[:, index.row, index.col].T, 0)
+    return {name: mp[:, 0] if squeeze else mp for name, mp in out.items()}
+
+
+def check_potential(index, masses, kernels, mp, cutoff_km=300, sample=200, seed=0):
+    """
+    Largest absolute difference, per kernel, between `mp` and a dense sum over
+    all cells for a random sample of `sample` cells.
+    """
+    masses = np.asarray(masses, dtype=float).reshape(len(index), -1)
+    rows = np.random.default_rng(seed).choice(len(index), min(sample, len(index)), replace=False)
+    d_km = np.hypot(index.col[rows, None] - index.col[None, :],
+                    index.row[rows, None] - index.row[None, :]) * index.size / 1000
+    err = {}
+    for kind, param in kernels:
+        name = kernel_name(kind, param)
+        dense = kernel_weights(d_km, kind, param, cutoff_km) @ masses
+        err[name] = float(np.abs(dense - np.asarray(mp[name]).reshape(len(index), -1)[rows]).max())
+    return err
+
+
+def potential_blocked(xy, masses, kernels, cutoff_km, block=4096):
+    """
+    Same sums for arbitrary points (xy in metres), over pairs within cutoff_km
+    found with a KD-tree, `block` rows at a time.
+    """
+    xy = np.asarray(xy, dtype=float)
+    masses = np.asarray(masses, dtype=float)
+    squeeze = masses.ndim == 1
+    masses = masses.reshape(len(xy), -1)
+    tree = cKDTree(xy)
+    out = {kernel_name(k, p): np.zeros(masses.shape) for k, p in kernels}
+    for s in range(0, len(xy), block):
+        pairs = cKDTree(xy[s:s + block]).sparse_distance_matrix(tree, cutoff_km * 1000,
+                                                                 output_type='coo_matrix')
+        for kind, param in kernels:
+            w = kernel_weights(pairs.data / 1000, kind, param, cutoff_km)
+            wm = sparse.csr_matrix((w, (pairs.row, pairs.col)), shape=(pairs.shape[0], len(xy)))
+            out[kernel_name(kind, param)][s:s + block] = wm @ masses
+    return {k: v[:, 0] if squeeze else v for k, v in out.items()}
+
+
+def market_potential(grid_ids, x, y, masses, kernels, size=5000, cutoff_km=300, memory_mb=512):
+    """Lattice (FFT) market potential for cells given by their centroids x/y in metres."""
+    index = GridIndex.from_centroids(grid_ids, x, y, size=size)
+    return potential_lattice(index, masses, kernels, cutoff_km, memory_mb)
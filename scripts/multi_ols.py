@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from scipy import linalg, stats
+
+from cluster_cov import GroupOffsets
+
+# OLS for many outcomes that share one right-hand side.
+#
+# X'X is formed once for the full sample. An outcome whose sample excludes
+# some rows gets its Gram matrix by subtracting the excluded rows' X'X (a
+# downdate) instead of rebuilding it; outcomes with the same sample share one
+# Cholesky factor and are solved together. Clustered covariances for all
+# outcomes come from one segmented reduction of the (n x k x m) score array.
+
+
+class _OutcomeResult:
+    """Per-outcome view with the attributes the table code reads."""
+
+    def __init__(self, name, params, cov, nobs, rsquared, rsquared_adj):
+        self.name = name
+        self.params = params
+        self._cov = pd.DataFrame(cov, index=params.index, columns=params.index)
+        self.bse = pd.Series(np.sqrt(np.diag(cov)), index=params.index)
+        self.tvalues = params / self.bse
+        self.pvalues = pd.Series(2 * stats.norm.sf(np.abs(self.tvalues)), index=params.index)
+        self.nobs = nobs
+        self.rsquared = rsquared
+        self.rsquared_adj = rsquared_adj
+
+    def cov_params(self):
+        return self._cov
+
+    def conf_int(self, alpha=0.05):
+        q = stats.norm.ppf(1 - alpha / 2)
+        return pd.DataFrame({0: self.params - q * self.bse, 1: self.params + q * self.bse})
+
+
+class MultiOLS:
+
+    def __init__(self, x, groups=None):
+        """x: (n x k) design DataFrame; groups: cluster ids (or GroupOffsets) per row."""
+        self.columns = list(x.columns)
+        self.x = np.asarray(x, dtype=float)
+        self.gram = self.x.T @ self.x
+        self.groups = None if groups is None else \
+            (groups if isinstance(groups, GroupOffsets) else GroupOffsets(groups))
+
+    def _gram(self, mask):
+        excluded = ~mask
+        if excluded.sum() <= mask.sum():
+            xe = self.x[excluded]
+            return self.gram - xe.T @ xe
+        xm = self.x[mask]
+        return xm.T @ xm
+
+    def fit(self, y, mask=None):
+        """
+        y:    (n x m) DataFrame of outcomes.
+        mask: optional (n x m) boolean sample per outcome; rows with missing
+              y are always excluded.
+        Returns {outcome: result} with clustered (or HC0) covariances.
+        """
+        names = list(y.columns)
+        yv = np.asarray(y, dtype=float)
+        m = ~np.isnan(yv) if mask is None else (np.asarray(mask, dtype=bool) & ~np.isnan(yv))
+        yv = np.where(m, yv, 0.0)
+        n, k = self.x.shape
+
+        beta = np.zeros((k, len(names)))
+        bread = np.zeros((len(names), k, k))
+        # Outcomes with identical samples share one factorization
+        patterns, which = np.unique(m.T, axis=0, return_inverse=True)
+        for p, pattern in enumerate(patterns):
+            cols = np.flatnonzero(which.ravel() == p)
+            try:
+                factor = linalg.cho_factor(self._gram(pattern))
+            except linalg.LinAlgError:
+                # e.g. a year with no active cells for this outcome
+                print(f"  MultiOLS: singular design for {[names[c] for c in cols]}, skipped")
+                beta[:, cols] = np.nan
+                bread[cols] = np.nan
+                continue
+            beta[:, cols] = linalg.cho_solve(factor, self.x.T @ yv[:, cols])
+            bread[cols] = linalg.cho_solve(factor, np.eye(k))
+
+        resid = np.where(m, yv - self.x @ np.nan_to_num(beta), 0.0)
+        scores = self.x[:, :, None] * resid[:, None, :]               # (n, k, m)
+        if self.groups is not None:
+            g_scores = self.groups.sum(scores)                         # (G, k, m)
+            # clusters that actually contribute to each outcome
+            n_groups = (self.groups.sum(m.astype(float)) > 0).sum(axis=0)
+        else:
+            g_scores, n_groups = scores, m.sum(axis=0)
+        meat = np.einsum('gam,gbm->mab', g_scores, g_scores)
+        cov = bread @ meat @ bread
+
+        out = {}
+        for j, name in enumerate(names):
+            nj = int(m[:, j].sum())
+            gj = int(n_groups[j])
+            cov_j = cov[j] * gj / (gj - 1) * (nj - 1) / (nj - k)
+            yj = yv[m[:, j], j]
+            tss = ((yj - yj.mean()) ** 2).sum()
+            r2 = 1 - (resid[:, j] ** 2).sum() / tss
+            out[name] = _OutcomeResult(name, pd.Series(beta[:, j], index=self.columns), cov_j,
+                                       nj, r2, 1 - (1 - r2) * (nj - 1) / (nj - k))
+        return out
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+# Dense grid x year x variable container for the balanced panel.
+#
+# Every stage of the pipeline works on the same set of grid cells and the same
+# four analysis years, so instead of re-joining DataFrames on grid_id (and year)
+# we keep one contiguous array and address it by position:
+#   data[row, t, k]  <->  (grid_ids[row], years[t], variables[k])
+
+
+class GridLookup:
+    """O(1) grid_id -> row position. Unknown ids map to -1."""
+
+    def __init__(self, grid_ids):
+        self.grid_ids = np.asarray(grid_ids)
+        if len(np.unique(self.grid_ids)) != len(self.grid_ids):
+            raise ValueError("grid_id must be unique")
+        ids = self.grid_ids
+        # grid_id is a small dense integer in every file we produce: use a
+        # direct-address table. Fall back to a hash index for anything else.
+        if ids.dtype.kind in 'iu' and len(ids) and ids.min() >= 0 and ids.max() < 4 * len(ids) + 1024:
+            self._table = np.full(int(ids.max()) + 1, -1, dtype=np.int64)
+            self._table[ids] = np.arange(len(ids))
+            self._index = None
+        else:
+            self._table = None
+            self._index = pd.Index(ids)
+
+    def __len__(self):
+        return len(self.grid_ids)
+
+    def rows(self, grid_ids):
+        q = np.asarray(grid_ids)
+        if self._table is None:
+            return self._index.get_indexer(q)
+        if q.dtype.kind not in 'iu':
+            # e.g. ids that went through a float column after a left join
+            q = pd.Series(q).fillna(-1).to_numpy().astype(np.int64)
+        out = np.full(q.shape, -1, dtype=np.int64)
+        ok = (q >= 0) & (q < len(self._table))
+        out[ok] = self._table[q[ok]]
+        return out
+
+
+class GridPanel:
+    """
+    Balanced panel stored as one (n_grid, n_year, n_var) array.
+
+    grid()/year()/var() return views, not copies. New variables are appended
+    in place (the variable axis grows geometrically, like a list).
+    """
+
+    def __init__(self, grid_ids, years, variables=(), dtype='float64', fill=0):
+        self.lookup = grid_ids if isinstance(grid_ids, GridLookup) else GridLookup(grid_ids)
+        self.years = [int(y) for y in years]
+        self._year_pos = {y: t for t, y in enumerate(self.years)}
+        self.variables = []
+        self._var_pos = {}
+        self._fill = fill
+        self._buf = np.empty((len(self.lookup), len(self.years), 0), dtype=dtype)
+        self.add_variables(variables)
+
+    # --- shape / indexing ---
+    @property
+    def grid_ids(self):
+        return self.lookup.grid_ids
+
+    @property
+    def data(self):
+        return self._buf[:, :, :len(self.variables)]
+
+    @property
+    def dtype(self):
+        return self._buf.dtype
+
+    def __contains__(self, name):
+        return name in self._var_pos
+
+    def rows(self, grid_ids):
+        return self.lookup.rows(grid_ids)
+
+    def year_pos(self, years):
+        years = np.asarray(years)
+        lut = pd.Index(self.years)
+        pos = lut.get_indexer(years.ravel()).reshape(years.shape)
+        return pos
+
+    def var_pos(self, name):
+        return self._var_pos[name]
+
+    # --- views ---
+    def year(self, year):
+        """(n_grid, n_var) view of one year."""
+        return self.data[:, self._year_pos[int(year)], :]
+
+    def var(self, name):
+        """(n_grid, n_year) view of one variable."""
+        return self._buf[:, :, self._var_pos[name]]
+
+    def __getitem__(self, key):
+        """panel['X_Cluster'] -> (n_grid, n_year); panel['X_Cluster', 2015] -> (n_grid,)."""
+        if isinstance(key, tuple):
+            name, year = key
+            return self._buf[:, self._year_pos[int(year)], self._var_pos[name]]
+        return self.var(key)
+
+    def __setitem__(self, key, values):
+        name, year = key if isinstance(key, tuple) else (key, None)
+        if name not in self._var_pos:
+            self.add_variables([name])
+        if year is None:
+            self.var(name)[...] = values
+        else:
+            self[name, year][...] = values
+
+    # --- growth ---
+    def add_variables(self, names):
+        names = [n for n in names if n not in self._var_pos]
+        if not names:
+            return
+        need = len(self.variables) + len(names)
+        if need > self._buf.shape[2]:
+            cap = max(need, 2 * self._buf.shape[2], 4)
+            buf = np.empty(self._buf.shape[:2] + (cap,), dtype=self._buf.dtype)
+            buf[:, :, :len(self.variables)] = self.data
+            self._buf = buf
+        start = len(self.variables)
+        self._buf[:, :, start:need] = self._fill
+        for k, n in enumerate(names):
+            self._var_pos[n] = start + k
+            self.variables.append(n)
+
+    # --- long-format access (one value per grid_id/year row) ---
+    def take(self, name, grid_ids, years, fill=np.nan):
+        """Values of `name` for arbitrary (grid_id, year) pairs."""
+        r = self.rows(grid_ids)
+        t = self.year_pos(years)
+        out = np.full(r.shape, fill, dtype=np.result_type(self.dtype, np.asarray(fill).dtype))
+        ok = (r >= 0) & (t >= 0)
+        out[ok] = self._buf[r[ok], t[ok], self._var_pos[name]]
+        return out
+
+    def put(self, name, grid_ids, years, values):
+        """Direct index assignment of long-format values into the panel."""
+        if name not in self._var_pos:
+            self.add_variables([name])
+        r = self.rows(grid_ids)
+        t = self.year_pos(years)
+        values = np.broadcast_to(np.asarray(values), r.shape)
+        ok = (r >= 0) & (t >= 0)
+        self._buf[r[ok], t[ok], self._var_pos[name]] = values[ok]
+
+    # --- conversion ---
+    @classmethod
+    def from_long(cls, df, variables=None, id_col='grid_id', year_col='year', grid_ids=None, years=None, dtype='float64'):
+        """Build from a long DataFrame (one row per grid_id x year)."""
+        if variables is None:
+            variables = [c for c in df.columns if c not in (id_col, year_col)]
+        grid_ids = pd.unique(df[id_col].to_numpy()) if grid_ids is None else grid_ids
+        years = sorted(pd.unique(df[year_col].to_numpy())) if years is None else years
+        panel = cls(grid_ids, years, variables, dtype=dtype)
+        r = panel.rows(df[id_col].to_numpy())
+        t = panel.year_pos(df[year_col].to_numpy())
+        ok = (r >= 0) & (t >= 0)
+        for name in variables:
+            panel._buf[r[ok], t[ok], panel._var_pos[name]] = df[name].to_numpy()[ok]
+        return panel
+
+    def to_long(self, variables=None, id_col='grid_id', year_col='year'):
+        """Long DataFrame sorted by grid then year."""
+        variables = self.variables if variables is None else variables
+        n, T = len(self.lookup), len(self.years)
+        out = {id_col: np.repeat(self.grid_ids, T), year_col: np.tile(self.years, n)}
+        for name in variables:
+            out[name] = self.var(name).reshape(-1)
+        return pd.DataFrame(out)
+
+    def to_wide(self, variables=None, id_col='grid_id', name='{var}_{year}'):
+        """Wide DataFrame with one column per variable and year, grouped by year."""
+        variables = self.variables if variables is None else variables
+        out = {id_col: self.grid_ids}
+        for year in self.years:
+            for v in variables:
+                out[name.format(var=v, year=year)] = self[v, year]
+        return pd.DataFrame(out)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Binary, memory-mapped copy of the analysis panel.
+#
+# The CSV is parsed once, every column is cast to the compact dtype below and
+# written as its own .npy file inside '<csv name>.cache/'. Later runs open the
+# .npy files with mmap_mode='r', so only the columns a script touches are paged
+# in. The cache is rebuilt whenever the SHA-256 of the source CSV changes.
+
+CACHE_VERSION = 4
+
+# Explicit schema: (regex on column name, dtype). First match wins.
+# Columns that match nothing keep the dtype pandas inferred.
+PANEL_SCHEMA = [
+    (r'^grid_id$', 'int32'),
+    (r'^year$', 'int16'),
+    (r'^(x|y)_coord$', 'float64'),          # metres in LCC, float32 loses the cm
+    (r'^is_cluster(_\w+)?$', 'int8'),
+    (r'^count_\d{4}$', 'float32'),          # rama counts are dasymetrically allocated (fractional)
+    (r'^(count_\w+|cluster_n(_\w+)?)$', 'int16'),
+    (r'^(value_added|labor_total|wages_total|machinery|computers)_\w+$', 'float32'),
+    (r'^dist_\w+_km$', 'float32'),
+    (r'^nearest_\w+_id$', 'int16'),
+    (r'^(ma|mp)_\w+$', 'float32'),
+]
+
+
+def schema_dtype(col, default):
+    for pattern, dtype in PANEL_SCHEMA:
+        if re.match(pattern, col):
+            return np.dtype(dtype)
+    return np.dtype(default)
+
+
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_dir_for(csv_path):
+    root, _ = os.path.splitext(csv_path)
+    return root + '.cache'
+
+
+def _cast(series, dtype):
+    """Cast one column to its schema dtype, refusing silent overflow/truncation."""
+    values = series.to_numpy()
+    if dtype.kind in 'iu':
+        if series.isna().any():
+            raise ValueError(f"Column '{series.name}' has missing values, cannot store as {dtype}")
+        info = np.iinfo(dtype)
+        if len(values) and (values.min() < info.min or values.max() > info.max):
+            raise ValueError(f"Column '{series.name}' does not fit in {dtype} "
+                             f"(range {values.min()}..{values.max()})")
+        if values.dtype.kind == 'f' and not np.all(np.mod(values, 1) == 0):
+            raise ValueError(f"Column '{series.name}' has fractional values, cannot store as {dtype}")
+    return values.astype(dtype)
+
+
+def build_cache(csv_path, cache_dir=None):
+    """Parse the CSV once and write the typed columnar copy."""
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    digest = file_sha256(csv_path)
+    df = pd.read_csv(csv_path)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        dtype = schema_dtype(col, df[col].dtype)
+        fname = f'{i:04d}.npy'
+        np.save(os.path.join(cache_dir, fname), _cast(df[col], dtype))
+        columns.append({'name': col, 'dtype': dtype.str, 'file': fname})
+
+    meta = {'version': CACHE_VERSION, 'source': os.path.basename(csv_path),
+            'sha256': digest, 'nrows': len(df), 'columns': columns}
+    # Manifest is written last: a half-written cache is never considered valid.
+    with open(os.path.join(cache_dir, 'schema.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'schema.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_panel(csv_path, columns=None, cache_dir=None, rebuild=False):
+    """
+    Load the panel from its binary cache, (re)building the cache if needed.
+
+    columns: optional subset of columns to map; the rest are never read.
+    Returned columns are backed by read-only memory maps; assigning new columns
+    or overwriting existing ones works as usual.
+    """
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    meta = None if rebuild else _read_meta(cache_dir)
+    if meta is None or meta.get('version') != CACHE_VERSION or meta['sha256'] != file_sha256(csv_path):
+        print(f"Building binary cache for {os.path.basename(csv_path)}...")
+        meta = build_cache(csv_path, cache_dir)
+
+    by_name = {c['name']: c for c in meta['columns']}
+    wanted = list(by_name) if columns is None else list(columns)
+    missing = [c for c in wanted if c not in by_name]
+    if missing:
+        raise KeyError(f"Columns not in panel: {missing}")
+
+    data = {c: np.load(os.path.join(cache_dir, by_name[c]['file']), mmap_mode='r') for c in wanted}
+    return pd.DataFrame(data, copy=False)
@@ -0,0 +1,37 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+
+from grid_dbscan import point_coords
+
+# Reading the per-year DENUE GeoPackages.
+#
+# Only the geometry column is read, through pyogrio's Arrow reader: GDAL does
+# the I/O with the GIL released, so a background thread can fetch the next
+# year while the current one is being clustered in the main thread.
+
+
+def read_points(path):
+    """(n x 2) x/y coordinates of a point layer, reading the geometry column only."""
+    gdf = gpd.read_file(path, columns=[], engine='pyogrio', use_arrow=True)
+    return point_coords(gdf.geometry)
+
+
+def prefetch(items, load, ahead=1):
+    """
+    Yield (item, load(item)) in the order of `items`, with up to `ahead`
+    further items loading on worker threads while the caller works on the
+    current one. At most ahead + 1 results are held in memory.
+    """
+    items = list(items)
+    with ThreadPoolExecutor(max_workers=max(ahead, 1)) as pool:
+        pending = deque(pool.submit(load, item) for item in items[:ahead])
+        for k, item in enumerate(items):
+            if not pending:
+                pending.append(pool.submit(load, item))
+            result = pending.popleft().result()
+            # the current result plus `ahead` loads in flight
+            if ahead and k + ahead < len(items):
+                pending.append(pool.submit(load, items[k + ahead]))
+            yield item, result
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+from scipy.special import gammaln
+
+from cluster_cov import GroupOffsets, cluster_cov
+
+# Poisson pseudo-maximum likelihood with high-dimensional fixed effects.
+#
+# IRLS in which the fixed effects are never turned into dummy columns: at every
+# iteration the working variable and the regressors are demeaned by weighted
+# alternating projections on each FE dimension (grid_id, year, ...), and only
+# the slope coefficients are solved for. Same approach as ppmlhdfe (Correia,
+# Guimaraes & Zylkin 2020).
+
+
+def _codes(values):
+    codes, uniques = pd.factorize(pd.Series(values), sort=False)
+    return codes, len(uniques)
+
+
+def drop_separated(y, fe_codes, drop_singletons=True):
+    """
+    Mask of observations kept after removing FE groups whose outcome is zero
+    in every period (their FE goes to -inf, i.e. separation) and, optionally,
+    singleton groups. Repeated until no dimension drops anything.
+    """
+    keep = np.ones(len(y), dtype=bool)
+    while True:
+        before = keep.sum()
+        for codes, n_groups in fe_codes:
+            c = codes[keep]
+            y_sum = np.bincount(c, weights=y[keep], minlength=n_groups)
+            size = np.bincount(c, minlength=n_groups)
+            bad = y_sum <= 0
+            if drop_singletons:
+                bad |= size == 1
+            keep[keep] = ~bad[c]
+        if keep.sum() == before:
+            return keep
+
+
+def nonnested_fe_params(fe_codes, cluster_codes):
+    """
+    Absorbed FE parameters counted in the small-sample correction, as in
+    reghdfe / ppmlhdfe: dimensions nested within the clusters (e.g. grid FE
+    with grid clusters) are left out, the others count once per group less
+    the levels already spanned by another dimension. A GLM with explicit FE
+    dummies counts every dummy, so its clustered SEs come out larger.
+    """
+    nested = [np.all(pd.Series(cluster_codes).groupby(codes).nunique().to_numpy() == 1)
+              for codes, _ in fe_codes]
+    sizes = [g for (_, g), is_nested in zip(fe_codes, nested) if not is_nested]
+    if not sizes:
+        return 0
+    return max(sum(sizes) - len(sizes) + (0 if any(nested) else 1), 0)
+
+
+class _Projector:
+    """Weighted within-transformation over several FE dimensions."""
+
+    def __init__(self, fe_codes, tol=1e-10, maxiter=10_000):
+        n = len(fe_codes[0][0])
+        self.dummies = [sparse.csr_matrix((np.ones(n), (np.arange(n), c)), shape=(n, g))
+                        for c, g in fe_codes]
+        self.tol = tol
+        self.maxiter = maxiter
+
+    def __call__(self, m, w):
+        """Residuals of m (n x k) after projecting on all FE, weights w."""
+        m = np.array(m, dtype=float)
+        if len(self.dummies) == 1:
+            return m - self._means(self.dummies[0], m, w)
+        for _ in range(self.maxiter):
+            delta = 0.0
+            for d in self.dummies:
+                adj = self._means(d, m, w)
+                m -= adj
+                delta = max(delta, np.abs(adj).max())
+            if delta < self.tol:
+                break
+        return m
+
+    @staticmethod
+    def _means(d, m, w):
+        wsum = d.T @ w
+        gmean = (d.T @ (w[:, None] * m)) / np.where(wsum > 0, wsum, 1.0)[:, None]
+        return d @ gmean
+
+
+class PPMLResults:
+    """Fitted PPML; exposes the attributes extract_column() reads from statsmodels."""
+
+    def __init__(self, params, cov, y, mu, eta, n_fe_params, n_dropped, n_clusters, row_labels=None):
+        self.params = params
+        names = params.index
+        self._cov = pd.DataFrame(cov, index=names, columns=names)
+        self.bse = pd.Series(np.sqrt(np.diag(cov)), index=names)
+        self.tvalues = params / self.bse
+        self.pvalues = pd.Series(2 * stats.norm.sf(np.abs(self.tvalues)), index=names)
+        self.nobs = len(y)
+        self.n_dropped = n_dropped
+        self.n_clusters = n_clusters
+        self.fittedvalues = mu
+        self.resid_pearson = (y - mu) / np.sqrt(mu)
+        self.row_labels = row_labels       # index of the estimation rows in df
+        self.linear_predictor = eta
+        ll_const = -gammaln(y + 1)
+        self.llf = float(np.sum(y * eta - mu + ll_const))
+        ybar = y.mean()
+        self.llnull = float(np.sum(y * np.log(ybar) - ybar + ll_const))
+        self.prsquared = 1 - self.llf / self.llnull
+        self.df_model = len(params) + n_fe_params
+        self.aic = -2 * self.llf + 2 * self.df_model
+
+    def cov_params(self):
+        return self._cov
+
+    def conf_int(self, alpha=0.05):
+        q = stats.norm.ppf(1 - alpha / 2)
+        return pd.DataFrame({0: self.params - q * self.bse, 1: self.params + q * self.bse})
+
+
+def ppml_hdfe(df, depvar, regressors, absorb=('grid_id', 'year'), cluster='grid_id',
+              tol=1e-8, maxiter=200, drop_singletons=True):
+    """
+    Poisson regression of df[depvar] on df[regressors] with the columns in
+    `absorb` as fixed effects, clustered on df[cluster].
+
+    Rows with missing values are dropped first, then separated/singleton FE
+    groups. Returns a PPMLResults.
+    """
+    regressors = list(regressors)
+    absorb = list(absorb)
+    cols = list(dict.fromkeys([depvar] + regressors + absorb + ([cluster] if cluster else [])))
+    data = df[cols].dropna()
+
+    y = data[depvar].to_numpy(dtype=float)
+    if (y < 0).any():
+        raise ValueError(f"{depvar} has negative values")
+    fe_codes = [_codes(data[a].to_numpy()) for a in absorb]
+    keep = drop_separated(y, fe_codes, drop_singletons) if absorb else np.ones(len(y), dtype=bool)
+    n_dropped = int((~keep).sum())
+    if n_dropped:
+        print(f"  PPML: dropped {n_dropped} obs (separated or singleton FE groups)")
+
+    data = data[keep]
+    y = y[keep]
+    x = data[regressors].to_numpy(dtype=float)
+    fe_codes = [_codes(data[a].to_numpy()) for a in absorb]
+    if fe_codes:
+        project = _Projector(fe_codes)
+    else:
+        x = np.column_stack([np.ones(len(y)), x])
+        regressors = ['Intercept'] + regressors
+        project = lambda m, w: np.asarray(m, dtype=float)
+
+    # --- IRLS ---
+    mu = (y + y.mean()) / 2
+    eta = np.log(mu)
+    dev_old = np.inf
+    for it in range(maxiter):
+        z = eta + (y - mu) / mu
+        w = mu
+        zx = project(np.column_stack([z, x]), w)
+        zt, xt = zx[:, 0], zx[:, 1:]
+        xtw = xt.T * w
+        beta = np.linalg.solve(xtw @ xt, xtw @ zt)
+        # fitted index = z minus the weighted-LS residual (FE included implicitly)
+        eta = z - (zt - xt @ beta)
+        mu = np.exp(eta)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dev = 2 * np.sum(np.where(y > 0, y * np.log(y / mu), 0) - (y - mu))
+        if abs(dev - dev_old) / max(abs(dev), 0.1) < tol:
+            break
+        dev_old = dev
+    else:
+        print(f"  PPML: IRLS did not converge in {maxiter} iterations")
+
+    # --- Cluster-robust covariance (sandwich on the demeaned regressors) ---
+    bread = np.linalg.inv((xt.T * mu) @ xt)
+    scores = xt * (y - mu)[:, None]
+    if cluster:
+        groups = GroupOffsets(data[cluster].to_numpy())
+        n_clusters = groups.n_groups
+        k = len(regressors) + nonnested_fe_params(fe_codes, groups.codes)
+        cov = cluster_cov(scores, bread, groups, k=k)
+    else:
+        n_clusters = len(y)
+        cov = bread @ (scores.T @ scores) @ bread
+
+    n_fe_params = sum(g for _, g in fe_codes) - max(len(fe_codes) - 1, 0)
+    params = pd.Series(beta, index=regressors)
+    return PPMLResults(params, cov, y, mu, eta, n_fe_params, n_dropped, n_clusters, data.index)
@@ -0,0 +1,161 @@
+import os
+import re
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels.api as sm
+
+from cluster_cov import GroupOffsets, cluster
+
+# Stage 1 (Poisson) and Stage 2 (log K/L OLS) for every sector / rama column
+# found in the panel, spread over a process pool.
+#
+# The numeric panel is copied once into a shared-memory block; workers attach
+# to it by name instead of receiving a pickled DataFrame. Each code is fitted
+# inside its own try/except so one bad rama only produces an error row.
+
+RHS = "X_Cluster + X_USA_Trend + X_CDMX_Trend + X_Port_Trend + C(year)"
+REPORT_VARS = ['X_Cluster', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend']
+BASE_COLS = ['grid_id', 'year', 'X_USA_Trend', 'X_CDMX_Trend', 'X_Port_Trend', 'is_cluster']
+
+
+def sector_codes(columns):
+    """2-digit sectors and 4-digit ramas that have a count_{code} column."""
+    codes = [m.group(1) for c in columns for m in [re.match(r'^count_(\d{2}|\d{4})$', c)] if m]
+    return sorted(codes, key=lambda c: (len(c), c))
+
+
+def prepare_panel(df):
+    """Distance x trend interactions used by both stages (same as 06/08)."""
+    df = df.copy()
+    df['trend'] = df['year'] - 2010
+    for name, col in [('USA', 'dist_usa_km'), ('CDMX', 'dist_cdmx_km'), ('Port', 'dist_port_km')]:
+        df[f'X_{name}_Trend'] = df[col] / 100 * df['trend']
+    return df
+
+
+# --- shared memory ---
+
+class SharedPanel:
+    """A float64 (n_columns x n_rows) block in shared memory plus its column names."""
+
+    def __init__(self, df, columns):
+        self.columns = list(columns)
+        shape = (len(self.columns), len(df))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        arr = np.ndarray(shape, dtype=np.float64, buffer=self.shm.buf)
+        for j, c in enumerate(self.columns):
+            arr[j] = df[c].to_numpy(dtype=np.float64)
+        self.spec = (self.shm.name, shape, self.columns)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+_worker = {}
+
+
+def _attach(spec):
+    name, shape, columns = spec
+    shm = shared_memory.SharedMemory(name=name)
+    arr = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    df = pd.DataFrame({c: arr[j] for j, c in enumerate(columns)}, copy=False)
+    df['year'] = df['year'].astype(int)
+    # The right-hand side is identical for every code: build it once per worker.
+    x = patsy.dmatrix(RHS, df.assign(X_Cluster=df['is_cluster']), return_type='dataframe')
+    _worker.update(shm=shm, df=df, x=x, groups=GroupOffsets(df['grid_id'].to_numpy()))
+
+
+def _rows(code, stage, res, n_obs):
+    ci = res.conf_int()
+    return [{'Sector_Code': code, 'Level': f'{len(code)}-digit', 'Stage': stage, 'Variable': v,
+             'Coeff': res.params[v], 'Standard_Error': res.bse[v], 'P_Value': res.pvalues[v],
+             'Lower_CI': ci.loc[v, 0], 'Upper_CI': ci.loc[v, 1], 'N_Obs': n_obs, 'Status': 'ok'}
+            for v in REPORT_VARS]
+
+
+def _error_row(code, stage, err):
+    return {'Sector_Code': code, 'Level': f'{len(code)}-digit', 'Stage': stage, 'Status': f'error: {err}'}
+
+
+def _design_for(code):
+    df, x = _worker['df'], _worker['x']
+    flag = f'is_cluster_{code}'
+    if flag in df.columns:
+        x = x.copy()
+        x['X_Cluster'] = df[flag].to_numpy()
+    return x
+
+
+def fit_code(code):
+    """Both stages for one code; never raises."""
+    df = _worker['df']
+    out = []
+
+    # Stage 1: Poisson on establishment counts, clustered on grid_id
+    try:
+        y = df[f'count_{code}']
+        x = _design_for(code)
+        # allocated rama counts are NaN in cells without a municipality
+        mask = y.notna().to_numpy()
+        groups = _worker['groups'] if mask.all() else df['grid_id'].to_numpy()[mask]
+        res = cluster(sm.GLM(y[mask], x[mask], family=sm.families.Poisson()).fit(), groups)
+        out += _rows(code, 'Stage1_Poisson', res, int(mask.sum()))
+    except Exception as e:
+        out.append(_error_row(code, 'Stage1_Poisson', f'{type(e).__name__}: {e}'))
+
+    # Stage 2: log capital intensity on active cells
+    try:
+        labor, machinery = df[f'labor_total_{code}'], df[f'machinery_{code}']
+        ln_kl = np.log(machinery / labor.replace(0, np.nan) + 1)
+        mask = ((df[f'count_{code}'] > 0) & ln_kl.notna()).to_numpy()
+        if mask.sum() <= len(REPORT_VARS) + 4:
+            raise ValueError(f"only {mask.sum()} active cells")
+        x = _design_for(code)[mask]
+        res = sm.OLS(ln_kl[mask], x).fit()
+        res = cluster(res, df['grid_id'].to_numpy()[mask])
+        out += _rows(code, 'Stage2_ln_K_L', res, int(mask.sum()))
+    except KeyError as e:
+        out.append(_error_row(code, 'Stage2_ln_K_L', f'missing column {e}'))
+    except Exception as e:
+        out.append(_error_row(code, 'Stage2_ln_K_L', f'{type(e).__name__}: {e}'))
+    return out
+
+
+def run_sweep(df, codes=None, max_workers=None):
+    """
+    Fit every code and return one tidy coefficient table.
+
+    df: the exogenous-vars panel (one row per grid_id x year).
+    """
+    df = prepare_panel(df)
+    codes = sector_codes(df.columns) if codes is None else list(codes)
+    econ = [c for c in df.columns
+            if re.match(r'^(count|labor_total|machinery|is_cluster)_(\d{2}|\d{4})$', c)
+            and c.split('_')[-1] in codes]
+    shared = SharedPanel(df, BASE_COLS + econ)
+    rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                 initializer=_attach, initargs=(shared.spec,)) as pool:
+            futures = {pool.submit(fit_code, code): code for code in codes}
+            for fut in as_completed(futures):
+                code = futures[fut]
+                try:
+                    rows += fut.result()
+                except Exception:
+                    # worker died (e.g. out of memory): record it and move on
+                    rows.append(_error_row(code, 'all', traceback.format_exc(limit=1).strip()))
+                print(f"  [{len(rows):>5} rows] {code} done")
+    finally:
+        shared.close()
+
+    cols = ['Sector_Code', 'Level', 'Stage', 'Variable', 'Coeff', 'Standard_Error', 'P_Value',
+            'Lower_CI', 'Upper_CI', 'N_Obs', 'Status']
+    out = pd.DataFrame(rows).reindex(columns=cols)
+    return out.sort_values(['Level', 'Sector_Code', 'Stage']).reset_index(drop=True)
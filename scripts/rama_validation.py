@@ -0,0 +1,103 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Proxy validation of 4-digit ramas against their 2-digit sector total.
+#
+# Every rama is grouped under its 2-digit parent (3363 -> 33). For each census
+# year and sector the municipality x rama matrix X (value added) and the
+# sector total t = X.sum(axis=1) are standardised once; the correlation of
+# every rama with t and every rama's national share then come from weighted
+# moments, i.e. a few (weights x municipalities) @ (municipalities x ramas)
+# products. Point estimates use unit weights; the municipality bootstrap uses
+# one (replications x municipalities) matrix of multinomial resample counts,
+# so there is no Python loop over replications or ramas.
+
+VERDICTS = [(10, 'Dominant Driver'), (1, 'Niche/Emerging'), (-np.inf, 'Minor')]
+
+
+def rama_matrices(df, value='value_added'):
+    """
+    {(year, sector): municipalities x ramas DataFrame of `value`} from the long
+    census aggregate, one matrix per 2-digit parent of the ramas.
+    """
+    sector = pd.to_numeric(df['rama'].astype(str).str[:2]).rename('sector')
+    out = {}
+    for (year, sec), part in df.groupby(['year', sector]):
+        out[(int(year), int(sec))] = part.pivot_table(index='cve_mun', columns='rama', values=value,
+                                                      aggfunc='sum').fillna(0)
+    return out
+
+
+def bootstrap_weights(n, reps, rng):
+    """(reps x n) resample counts: each row is one bootstrap draw of the n municipalities."""
+    return rng.multinomial(n, np.full(n, 1.0 / n), size=reps).astype(float)
+
+
+def corr_share(X, W):
+    """
+    Correlation of every column of X with the row total, and each column's
+    share (%) of the total, under observation weights W (B x n).
+    Returns two (B x R) arrays.
+    """
+    X = np.asarray(X, dtype=float)
+    W = np.atleast_2d(np.asarray(W, dtype=float))
+    t = X.sum(axis=1)
+
+    # shares only need weighted sums of the raw values
+    share = (W @ X) / (W @ t)[:, None] * 100
+
+    # standardise (shift/scale invariant) so the raw-moment formulas stay accurate
+    sx = X.std(axis=0)
+    Z = (X - X.mean(axis=0)) / np.where(sx > 0, sx, 1.0)
+    st = t.std()
+    u = (t - t.mean()) / (st if st > 0 else 1.0)
+
+    sw = W.sum(axis=1)[:, None]
+    mz, mu = (W @ Z) / sw, (W @ u)[:, None] / sw
+    czu = (W @ (Z * u[:, None])) / sw - mz * mu
+    vz = (W @ (Z * Z)) / sw - mz * mz
+    vu = (W @ (u * u))[:, None] / sw - mu * mu
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = czu / np.sqrt(vz * vu)
+    corr[~((vz > 1e-12) & (vu > 1e-12))] = np.nan
+    return corr, share
+
+
+def verdict(share_pct):
+    """Verdict of a national share; 'Undefined' when the share is missing (sector total 0)."""
+    return next((label for cut, label in VERDICTS if share_pct > cut), 'Undefined')
+
+
+def validate_year(matrix, reps=1000, alpha=0.05, rng=None):
+    """Tidy table (one row per rama) of correlation / share with bootstrap percentile CIs."""
+    rng = np.random.default_rng(0) if rng is None else rng
+    X = matrix.to_numpy(dtype=float)
+    n = len(X)
+    corr, share = corr_share(X, np.ones((1, n)))
+    table = pd.DataFrame({'rama': matrix.columns.astype(str), 'n_municipalities': n,
+                          'corr': corr[0], 'share_pct': share[0]})
+    if reps:
+        corr_b, share_b = corr_share(X, bootstrap_weights(n, reps, rng))
+        q = [alpha / 2, 1 - alpha / 2]
+        with warnings.catch_warnings():
+            # ramas with no variance in every resample have no interval
+            warnings.simplefilter('ignore', RuntimeWarning)
+            table['corr_lo'], table['corr_hi'] = np.nanquantile(corr_b, q, axis=0)
+            table['share_lo'], table['share_hi'] = np.nanquantile(share_b, q, axis=0)
+    else:
+        for c in ('corr_lo', 'corr_hi', 'share_lo', 'share_hi'):
+            table[c] = np.nan
+    return table
+
+
+def validate_ramas(df, value='value_added', reps=1000, alpha=0.05, seed=0):
+    """
+    validate_year tables of every census year and 2-digit sector, stacked
+    with year and sector columns; each rama is compared with its own sector.
+    """
+    rng = np.random.default_rng(seed)
+    tables = [validate_year(m, reps, alpha, rng).assign(year=year, sector=sec)
+              for (year, sec), m in rama_matrices(df, value).items()]
+    return pd.concat(tables, ignore_index=True)
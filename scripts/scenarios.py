@@ -0,0 +1,353 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+
+# Counterfactual predictions of a fitted model for a batch of scenarios.
+#
+# A scenario perturbs model inputs (distances, the cluster flag, the trend);
+# every design column that is a product of inputs follows, e.g.
+# X_USA_Trend = dist_usa_100km x trend. For a chunk of S scenarios the design
+# becomes an (S x rows x k) stack and the linear predictor one broadcast
+# product with the coefficients, or with a (k x draws) matrix of coefficient
+# draws for simulation intervals. Municipality / state / national results are
+# one sparse (areas x rows) product per block, and spatial lags of perturbed
+# inputs (W_X_Cluster) move by W @ (change) for all scenarios and years in
+# one sparse product. Nothing is refitted; the Python loops run over memory
+# chunks, not over scenarios, cells or areas.
+#
+# A scenario is {input: {op: value}}, applied as
+#   min(scale * x + shift, min), then replaced by 'set' where given.
+# Values are scalars or one per row (array in row order, or a Series aligned
+# on the row labels); NaN entries of a per-row 'set' keep the value.
+# Scaling a distance by 2 doubles its term in the linear predictor, i.e. the
+# "border effect doubles" experiment is {'dist_usa_100km': {'scale': 2}}.
+
+SCENARIO_OPS = ('scale', 'shift', 'min', 'set')
+
+
+def area_matrix(keys, periods, how='sum'):
+    """
+    (groups x rows) CSR summing ('sum') or averaging ('mean') rows by area
+    key x year, and the (key, year) index of its rows. Rows without a key are
+    left out.
+    """
+    if how not in ('sum', 'mean'):
+        raise ValueError(f"Unknown aggregation '{how}' (use 'sum' or 'mean')")
+    frame = pd.DataFrame({'key': keys, 'year': periods})
+    grouped = frame.groupby(['key', 'year'], sort=True)
+    codes = grouped.ngroup().to_numpy()
+    size = grouped.size()
+    rows = np.flatnonzero(~np.isnan(codes))
+    codes = codes[rows].astype(np.int64)
+    data = np.ones(len(rows)) if how == 'sum' else 1.0 / size.to_numpy()[codes]
+    m = sparse.csr_matrix((data, (codes, rows)), shape=(len(size), len(frame)))
+    return m, size
+
+
+class ScenarioEngine:
+    """A fitted linear-index model prepared for repeated counterfactual prediction."""
+
+    def __init__(self, params, cov, design, inputs, terms, periods, link='log', offset=None,
+                 smear=1.0, shift=0.0, lags=None, w=None, w_rows=None):
+        """
+        params, cov: coefficients (Series) and their covariance.
+        design:  (rows x k) DataFrame with the columns of params, one row per cell x year.
+        inputs:  (rows x m) DataFrame of the inputs scenarios may perturb.
+        terms:   {design column: inputs whose product it is}; other columns
+                 (intercept, year effects) are held at their values.
+        periods: year of each row; aggregation and spatial lags are within year.
+        link:    'log' -> max(smear * exp(eta) + shift, 0) (Poisson counts;
+                 log(K/L + 1) with Duan smearing and shift=-1, where the floor
+                 keeps K/L non-negative), 'identity' -> eta + shift.
+        offset:  known part of the linear predictor (e.g. absorbed fixed effects).
+        lags:    {design column: input} for columns that are W @ input, with w
+                 the (grid x grid) weights and w_rows the W row of each row.
+        """
+        if link not in ('log', 'identity'):
+            raise ValueError(f"Unknown link '{link}' (use 'log' or 'identity')")
+        self.params = pd.Series(params, dtype=float)
+        names = self.params.index
+        self.beta = self.params.to_numpy()
+        self.cov = np.asarray(cov.loc[names, names] if isinstance(cov, pd.DataFrame) else cov, dtype=float)
+        missing = [c for c in names if c not in design.columns]
+        if missing:
+            raise ValueError(f"Design is missing columns {missing}")
+        self.x = np.array(design[list(names)], dtype=float)
+        self.row_labels = design.index
+        self.n = len(design)
+        self.inputs = {c: inputs[c].to_numpy(dtype=float) for c in inputs.columns}
+        self.link, self.smear, self.shift = link, float(smear), float(shift)
+        self.offset = np.zeros(self.n) if offset is None else np.asarray(offset, dtype=float)
+        self.period_codes, self.period_values = pd.factorize(np.asarray(periods), sort=True)
+
+        self.terms = {names.get_loc(col): tuple(parts) for col, parts in terms.items()}
+        self.lags = {names.get_loc(col): src for col, src in (lags or {}).items()}
+        used = {c for parts in self.terms.values() for c in parts} | set(self.lags.values())
+        unknown = sorted(used - set(self.inputs))
+        if unknown:
+            raise ValueError(f"Inputs {unknown} are not in the input table")
+        for j, parts in self.terms.items():
+            product = np.prod([self.inputs[c] for c in parts], axis=0)
+            if not np.allclose(product, self.x[:, j], equal_nan=True):
+                raise ValueError(f"{names[j]} is not {' x '.join(parts)} in the data")
+            # rebuilt in float64 (the panel cache is float32), exactly as the scenarios are
+            self.x[:, j] = product
+        if self.lags:
+            if w is None or w_rows is None:
+                raise ValueError("Spatial lag columns need w and w_rows")
+            self.w = sparse.csr_matrix(w)
+            self.w_rows = np.asarray(w_rows, dtype=np.int64)
+        self.eta0 = self.offset + self.x @ self.beta
+
+    @classmethod
+    def from_fit(cls, res, data, terms, period_col='year', **kwds):
+        """
+        Engine for the estimation rows of a statsmodels fit (also wrapped by
+        cluster()) or a PPMLResults, whose absorbed effects become the offset.
+        data: the estimation data (same row labels as the fit); w_rows, if
+              given, has one entry per row of data.
+        """
+        if hasattr(res, 'linear_predictor'):
+            labels = res.row_labels
+            design = data.loc[labels, list(res.params.index)].astype(float)
+            kwds.setdefault('offset', res.linear_predictor - design.to_numpy() @ res.params.to_numpy())
+        else:
+            labels = res.model.data.row_labels
+            design = pd.DataFrame(res.model.exog, index=labels, columns=res.model.exog_names)
+        if kwds.get('w_rows') is not None:
+            kwds['w_rows'] = pd.Series(np.asarray(kwds['w_rows']), index=data.index).loc[labels].to_numpy()
+        used = {c for parts in terms.values() for c in parts} | set(kwds.get('lags', {}).values())
+        inputs = data.loc[labels, sorted(used)]
+        return cls(res.params, res.cov_params(), design, inputs, terms,
+                   data.loc[labels, period_col].to_numpy(), **kwds)
+
+    # --- scenarios ---
+    def _row_values(self, v):
+        if isinstance(v, pd.Series):
+            return v.reindex(self.row_labels).to_numpy(dtype=float)
+        v = np.asarray(v, dtype=float)
+        if v.ndim and len(v) != self.n:
+            raise ValueError(f"Per-row scenario values have {len(v)} rows, the model has {self.n}")
+        return v
+
+    def compile(self, scenarios):
+        """{name: {input: {op: value}}} -> per-input arrays of scale/shift and per-scenario min/set."""
+        names = list(scenarios)
+        ops = {}
+        for i, name in enumerate(names):
+            for inp, spec in scenarios[name].items():
+                if inp not in self.inputs:
+                    raise ValueError(f"Scenario '{name}' perturbs '{inp}', which is not a model input")
+                bad = set(spec) - set(SCENARIO_OPS)
+                if bad:
+                    raise ValueError(f"Scenario '{name}': unknown operations {sorted(bad)} (use {SCENARIO_OPS})")
+                o = ops.setdefault(inp, {'scale': np.ones(len(names)), 'shift': np.zeros(len(names)),
+                                         'min': [None] * len(names), 'set': [None] * len(names)})
+                o['scale'][i] = spec.get('scale', 1.0)
+                o['shift'][i] = spec.get('shift', 0.0)
+                o['min'][i] = None if spec.get('min') is None else self._row_values(spec['min'])
+                o['set'][i] = None if spec.get('set') is None else self._row_values(spec['set'])
+        return names, ops
+
+    @staticmethod
+    def _stack(values, rows, fill):
+        """(scenarios x rows) array of per-scenario scalars / per-row arrays (None = fill)."""
+        out = np.full((len(values), rows.stop - rows.start), fill)
+        for i, v in enumerate(values):
+            if v is not None:
+                out[i] = v[rows] if v.ndim else v
+        return out
+
+    def _perturbed(self, inp, ops, sl, rows):
+        """Values of one input for the scenarios in slice sl and the rows in slice rows."""
+        base = self.inputs[inp][rows]
+        o = ops.get(inp)
+        if o is None:
+            return np.broadcast_to(base, (sl.stop - sl.start, len(base)))
+        out = o['scale'][sl, None] * base + o['shift'][sl, None]
+        if any(v is not None for v in o['min'][sl]):
+            out = np.minimum(out, self._stack(o['min'][sl], rows, np.inf))
+        if any(v is not None for v in o['set'][sl]):
+            new = self._stack(o['set'][sl], rows, np.nan)
+            out = np.where(np.isnan(new), out, new)
+        return out
+
+    def _lag_change(self, change):
+        """W @ change within each year for (scenarios x rows) changes, in one sparse product."""
+        s = change.shape[0]
+        cols = self.period_codes[:, None] * s + np.arange(s)
+        grid = np.zeros((self.w.shape[0], len(self.period_values) * s))
+        grid[self.w_rows[:, None], cols] = change.T
+        return (self.w @ grid)[self.w_rows[:, None], cols].T
+
+    def _design(self, ops, sl, rows, lag_cols):
+        s = sl.stop - sl.start
+        xs = np.broadcast_to(self.x[rows], (s,) + self.x[rows].shape).copy()
+        cache = {}
+        for j, parts in self.terms.items():
+            for c in parts:
+                if c not in cache:
+                    cache[c] = self._perturbed(c, ops, sl, rows)
+            xs[:, :, j] = np.prod([cache[c] for c in parts], axis=0)
+        for j, lagged in lag_cols.items():
+            xs[:, :, j] += lagged[:, rows]
+        return xs
+
+    def _response(self, eta):
+        """Prediction and its derivative with respect to eta."""
+        if self.link == 'log':
+            d = self.smear * np.exp(eta)
+            mu = d + self.shift
+            # counts and K/L are never negative; binds only for shift < 0
+            return np.maximum(mu, 0), np.where(mu > 0, d, 0)
+        return eta + self.shift, np.ones_like(eta)
+
+    def _bounds(self, v, se, q):
+        """Delta-method interval of a prediction v with standard error se."""
+        if self.link == 'log':
+            # log-delta: symmetric on log(v), so positive predictions keep positive bounds
+            r = np.exp(q * np.divide(se, v, out=np.zeros_like(se), where=v > 0))
+            return v / r, v * r
+        return v - q * se, v + q * se
+
+    # --- prediction ---
+    def predict(self, scenarios, by=None, how='sum', interval='delta', draws=1000, alpha=0.05,
+                seed=0, cells=False, memory_mb=512):
+        """
+        Predictions for every row x scenario, aggregated by area and year.
+
+        scenarios: {name: {input: {op: value}}} (see the module comment); the
+                   unperturbed model is the baseline of every 'change'.
+        by:        {level: area key of each row (or one key for all rows)},
+                   e.g. {'municipality': ..., 'state': ..., 'national': 'Mexico'}.
+        how:       'sum' (counts) or 'mean' (K/L) within area x year.
+        interval:  'delta' (delta method) or 'sim' (draws from N(beta, cov), percentile).
+                   For the log link, delta intervals of cells are built on eta
+                   and retransformed, those of areas on log(value); changes,
+                   which can take either sign, stay on the level scale.
+        cells:     also return one row per row x scenario under 'cells'.
+
+        Returns {level: DataFrame} with scenario, key, year, n_cells, value,
+        lo, hi, change, change_lo, change_hi (and se, change_se for 'delta').
+        """
+        if interval not in ('delta', 'sim'):
+            raise ValueError(f"Unknown interval '{interval}' (use 'delta' or 'sim')")
+        names, ops = self.compile(scenarios)
+        n_scen, n, k = len(names), self.n, len(self.beta)
+        periods = self.period_values[self.period_codes]
+        by = {} if by is None else by
+        mats = {lvl: area_matrix(np.broadcast_to(np.asarray(keys, dtype=object), n)
+                                 if np.ndim(keys) == 0 else np.asarray(keys), periods, how)
+                for lvl, keys in by.items()}
+        mats_csc = {lvl: m.tocsc() for lvl, (m, _) in mats.items()}
+        n_areas = sum(m.shape[0] for m, _ in mats.values())
+
+        sim = interval == 'sim'
+        width = draws if sim else k
+        elems = max(memory_mb * 2 ** 20 // 8, 1)
+        block = int(min(n, max(1, elems // (3 * width + 4))))
+        chunk = int(min(n_scen, max(1, elems // ((3 * width + 4) * block)),
+                        max(1, elems // max(n_areas * width, 1))))
+        blocks = [slice(s, min(s + block, n)) for s in range(0, n, block)]
+        q = stats.norm.ppf(1 - alpha / 2)
+        if sim:
+            rng = np.random.default_rng(seed)
+            b_draws = rng.multivariate_normal(self.beta, self.cov, size=draws, method='eigh').T
+        lag_sources = sorted(set(self.lags.values()))
+
+        # baseline, row by row and by area (same blocks as the scenarios, so
+        # an unperturbed scenario has a change of exactly 0)
+        mu0, d0 = self._response(self.eta0)
+        g0 = d0[:, None] * self.x
+        base = {lvl: np.zeros(m.shape[0]) for lvl, (m, _) in mats.items()}
+        base_acc = {lvl: np.zeros((m.shape[0], width)) for lvl, (m, _) in mats.items()}
+        for rows in blocks:
+            stack = self._response(self.offset[rows, None] + self.x[rows] @ b_draws)[0] if sim else g0[rows]
+            for lvl, m in mats_csc.items():
+                base[lvl] += m[:, rows] @ mu0[rows]
+                base_acc[lvl] += m[:, rows] @ stack
+
+        out = {lvl: [] for lvl in by}
+        cell_out = []
+        for start in range(0, n_scen, chunk):
+            sl = slice(start, min(start + chunk, n_scen))
+            s = sl.stop - sl.start
+            full = slice(0, n)
+            changes = {c: self._perturbed(c, ops, sl, full) - self.inputs[c] for c in lag_sources}
+            lag_cols = {j: self._lag_change(changes[src]) for j, src in self.lags.items()}
+            val = {lvl: np.zeros((m.shape[0], s)) for lvl, (m, _) in mats.items()}
+            acc = {lvl: np.zeros((m.shape[0], s, width)) for lvl, (m, _) in mats.items()}
+            cell_cols = {c: np.empty((s, n)) for c in ('value', 'lo', 'hi', 'change', 'change_lo', 'change_hi')} \
+                if cells else None
+
+            for rows in blocks:
+                xs = self._design(ops, sl, rows, lag_cols)
+                nb = xs.shape[1]
+                eta = self.offset[rows] + xs @ self.beta
+                mu, d = self._response(eta)
+                if sim:
+                    mu_d = self._response(self.offset[rows, None] + xs @ b_draws)[0]
+                    stack = mu_d.transpose(1, 0, 2).reshape(nb, s * width)
+                else:
+                    grad = d[:, :, None] * xs
+                    stack = grad.transpose(1, 0, 2).reshape(nb, s * width)
+                for lvl, m in mats_csc.items():
+                    mb = m[:, rows]
+                    val[lvl] += mb @ mu.T
+                    acc[lvl] += (mb @ stack).reshape(-1, s, width)
+                if cells:
+                    cell_cols['value'][:, rows] = mu
+                    cell_cols['change'][:, rows] = mu - mu0[rows]
+                    if sim:
+                        mu0_d = self._response(self.offset[rows, None] + self.x[rows] @ b_draws)[0]
+                        lo_hi = np.quantile(mu_d, [alpha / 2, 1 - alpha / 2], axis=-1)
+                        ch = np.quantile(mu_d - mu0_d, [alpha / 2, 1 - alpha / 2], axis=-1)
+                    else:
+                        if self.link == 'log':
+                            se_eta = np.sqrt(np.einsum('snk,kl,snl->sn', xs, self.cov, xs))
+                            lo_hi = (self._response(eta - q * se_eta)[0], self._response(eta + q * se_eta)[0])
+                        else:
+                            se = np.sqrt(np.einsum('snk,kl,snl->sn', grad, self.cov, grad))
+                            lo_hi = (mu - q * se, mu + q * se)
+                        dg = grad - g0[rows]
+                        se_ch = np.sqrt(np.einsum('snk,kl,snl->sn', dg, self.cov, dg))
+                        ch = (mu - mu0[rows] - q * se_ch, mu - mu0[rows] + q * se_ch)
+                    cell_cols['lo'][:, rows], cell_cols['hi'][:, rows] = lo_hi
+                    cell_cols['change_lo'][:, rows], cell_cols['change_hi'][:, rows] = ch
+
+            for lvl, (m, size) in mats.items():
+                v = val[lvl]
+                frame = {'scenario': np.repeat(names[sl], len(size)),
+                         lvl: np.tile(size.index.get_level_values('key'), s),
+                         'year': np.tile(size.index.get_level_values('year'), s),
+                         'n_cells': np.tile(size.to_numpy(), s),
+                         'value': v.T.ravel(), 'change': (v - base[lvl][:, None]).T.ravel()}
+                if sim:
+                    lo, hi = np.quantile(acc[lvl], [alpha / 2, 1 - alpha / 2], axis=-1)
+                    clo, chi = np.quantile(acc[lvl] - base_acc[lvl][:, None, :], [alpha / 2, 1 - alpha / 2], axis=-1)
+                    frame.update(lo=lo.T.ravel(), hi=hi.T.ravel(), change_lo=clo.T.ravel(), change_hi=chi.T.ravel())
+                else:
+                    dg = acc[lvl] - base_acc[lvl][:, None, :]
+                    se = np.sqrt(np.einsum('ask,kl,asl->as', acc[lvl], self.cov, acc[lvl]))
+                    se_ch = np.sqrt(np.einsum('ask,kl,asl->as', dg, self.cov, dg))
+                    lo, hi = self._bounds(v, se, q)
+                    frame.update(se=se.T.ravel(), lo=lo.T.ravel(), hi=hi.T.ravel(),
+                                 change_se=se_ch.T.ravel(),
+                                 change_lo=(v - base[lvl][:, None] - q * se_ch).T.ravel(),
+                                 change_hi=(v - base[lvl][:, None] + q * se_ch).T.ravel())
+                out[lvl].append(pd.DataFrame(frame))
+            if cells:
+                cell_out.append(pd.DataFrame({'scenario': np.repeat(names[sl], n),
+                                              'row': np.tile(self.row_labels, s),
+                                              'year': np.tile(periods, s),
+                                              **{c: a.ravel() for c, a in cell_cols.items()}}))
+
+        cols = ['scenario', None, 'year', 'n_cells', 'value', 'se', 'lo', 'hi',
+                'change', 'change_se', 'change_lo', 'change_hi']
+        result = {}
+        for lvl, parts in out.items():
+            table = pd.concat(parts, ignore_index=True)
+            result[lvl] = table[[c if c else lvl for c in cols if (c if c else lvl) in table.columns]]
+        if cells:
+            result['cells'] = pd.concat(cell_out, ignore_index=True)
+        return result
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+from matplotlib.colors import to_rgba
+from matplotlib.patches import Patch
+
+from spatial_weights import build_knn, row_standardize
+
+# Spatial autocorrelation of model residuals: global Moran's I and local
+# Moran (LISA) statistics with permutation inference, year by year.
+#
+# Permutations are processed in chunks as (cells x chunk) matrices, so one
+# sparse product W @ Z gives the spatial lag of every cell in every permuted
+# map of the chunk; the chunk size follows a memory budget. LISA uses
+# conditional randomisation (each cell keeps its own value): if a neighbour
+# of i drew z_i, it is swapped for the value drawn by i itself, which makes
+# the neighbours' values a uniform draw from the other n - 1 values.
+
+LISA_LABELS = ['Not significant', 'High-High', 'Low-High', 'Low-Low', 'High-Low']
+LISA_COLORS = ['#D9D9D9', '#D7191C', '#ABD9E9', '#2C7BB6', '#FDAE61']
+
+
+def pearson_residuals(res):
+    """Pearson residuals of a fit, indexed by the estimation data's row labels."""
+    resid = np.asarray(res.resid_pearson, dtype=float)
+    labels = getattr(res, 'row_labels', None)
+    if labels is None:
+        labels = res.model.data.row_labels
+    return pd.Series(resid, index=labels)
+
+
+def _padded(w):
+    """Neighbour columns and weights of each row as (n x max neighbours) arrays (-1 = none)."""
+    w = w.tocsr()
+    counts = np.diff(w.indptr)
+    width = max(int(counts.max()), 1) if len(counts) else 1
+    cols = np.full((w.shape[0], width), -1, dtype=np.int64)
+    wts = np.zeros((w.shape[0], width))
+    slot = np.arange(w.nnz) - np.repeat(w.indptr[:-1], counts)
+    rows = np.repeat(np.arange(w.shape[0]), counts)
+    cols[rows, slot] = w.indices
+    wts[rows, slot] = w.data
+    return cols, wts
+
+
+def _folded_p(larger, permutations):
+    """Two-sided pseudo p-value from the count of permuted statistics >= observed."""
+    larger = np.where(larger > permutations / 2, permutations - larger, larger)
+    return (larger + 1) / (permutations + 1)
+
+
+def moran(z, w, permutations=999, seed=0, memory_mb=256):
+    """
+    Global Moran's I and LISA of z under (row-standardised) CSR weights w.
+    Returns a dict with I, EI_sim, z_sim, p_sim and per-cell Is, lag, p_local
+    (cells without neighbours get p_local = 1).
+    """
+    z = np.asarray(z, dtype=float)
+    z = z - z.mean()
+    n = len(z)
+    zz = z @ z
+    m2 = zz / n
+    lag = w @ z
+    s0 = w.sum()
+    I = n / s0 * (z @ lag) / zz
+    Is = z * lag / m2
+
+    out = {'I': I, 'Is': Is, 'lag': lag}
+    if not permutations:
+        return out
+    rng = np.random.default_rng(seed)
+    cols, wts = _padded(w)
+    rows = np.arange(n)[:, None]
+    chunk = int(max(1, min(permutations, memory_mb * 2 ** 20 // (n * 8 * 8))))
+    I_perm, larger = [], np.zeros(n)
+    for start in range(0, permutations, chunk):
+        b = min(chunk, permutations - start)
+        # perm[j, c]: index of the value placed at cell j in permutation c
+        perm = rng.permuted(np.tile(np.arange(n), (b, 1)), axis=1).T
+        zp = z[perm]
+        lagp = w @ zp
+        I_perm.append(n / s0 * (zp * lagp).sum(axis=0) / zz)
+
+        # conditional randomisation: cell i's own value must not be a neighbour
+        inv = np.empty_like(perm)
+        inv[perm, np.arange(b)[None, :]] = rows
+        w_own = sum(np.where(cols[:, [m]] == inv, wts[:, [m]], 0.0) for m in range(cols.shape[1]))
+        lagp += w_own * (zp - z[:, None])
+        larger += (z[:, None] * lagp / m2 >= Is[:, None]).sum(axis=1)
+
+    I_perm = np.concatenate(I_perm)
+    p_local = _folded_p(larger, permutations)
+    p_local[np.diff(w.tocsr().indptr) == 0] = 1.0
+    out.update(EI_sim=I_perm.mean(), z_sim=(I - I_perm.mean()) / I_perm.std(),
+               p_sim=_folded_p((I_perm >= I).sum(), permutations), p_local=p_local)
+    return out
+
+
+def lisa_quadrant(z, lag):
+    """1 High-High, 2 Low-High, 3 Low-Low, 4 High-Low."""
+    high, high_lag = z > 0, lag > 0
+    return np.select([high & high_lag, ~high & high_lag, ~high & ~high_lag], [1, 2, 3], 4)
+
+
+def residual_diagnostics(res, data, w=None, w_ids=None, k=8, permutations=999, alpha=0.05, seed=0,
+                         memory_mb=256, id_col='grid_id', year_col='year', coord_cols=('x_coord', 'y_coord')):
+    """
+    Moran's I and LISA of a fitted model's Pearson residuals, year by year.
+
+    data:  estimation data (row labels as in the fit) with grid id, year and,
+           without w, the cell coordinates.
+    w:     binary weights over the whole grid (e.g. the cached KNN of
+           06_Stage1) with w_ids the grid ids of its rows; each year uses the
+           sub-matrix of that year's cells, row-standardised. Without w, k
+           nearest neighbours are found among each year's cells (e.g. the
+           active cells of Stage 2).
+
+    Returns (one row per year: n, I, EI_sim, z_sim, p_sim;
+             one row per residual: grid id, year, resid, Is, p_local, lisa).
+    """
+    resid = pearson_residuals(res)
+    cols = [id_col, year_col] + ([] if w is not None else list(coord_cols))
+    obs = data.loc[resid.index, cols].assign(resid=resid.to_numpy())
+    w_pos = None if w is None else pd.Index(w_ids)
+    w = None if w is None else w.tocsr()
+
+    globals_, locals_ = [], []
+    for year, part in obs.groupby(year_col, sort=True):
+        if w is None:
+            wy = build_knn(part[list(coord_cols)].to_numpy(), k=min(k, len(part) - 1))
+        else:
+            pos = w_pos.get_indexer(part[id_col].to_numpy())
+            if (pos < 0).any():
+                raise ValueError(f"{int((pos < 0).sum())} cells of {year} are not in the weights")
+            wy = w[pos][:, pos]
+        wy = row_standardize(wy).tocsr()
+        stat = moran(part['resid'].to_numpy(), wy, permutations, seed, memory_mb)
+        globals_.append({'year': year, 'n': len(part), 'I': stat['I'], 'EI': -1 / (len(part) - 1),
+                         'EI_sim': stat.get('EI_sim'), 'z_sim': stat.get('z_sim'), 'p_sim': stat.get('p_sim')})
+        quad = lisa_quadrant(part['resid'].to_numpy() - part['resid'].mean(), stat['lag'])
+        p_local = stat.get('p_local', np.ones(len(part)))
+        locals_.append(pd.DataFrame({id_col: part[id_col].to_numpy(), year_col: year,
+                                     'resid': part['resid'].to_numpy(), 'Is': stat['Is'],
+                                     'p_local': p_local, 'lisa': np.where(p_local <= alpha, quad, 0)}))
+    return pd.DataFrame(globals_), pd.concat(locals_, ignore_index=True)
+
+
+def draw_lisa(ax, index, lisa, id_col='grid_id', title=None):
+    """
+    LISA cluster map of one year on the grid lattice (one imshow, as in 07).
+    index: GridIndex of the grid; lisa: rows of residual_diagnostics() for one year.
+    """
+    base, outside = len(LISA_COLORS), len(LISA_COLORS) + 1
+    lut = np.array([to_rgba(c) for c in LISA_COLORS] + [to_rgba('#E0E0E0', 0.4), (0, 0, 0, 0)])
+    codes = np.full(len(index), base)
+    pos = pd.Index(index.grid_ids).get_indexer(lisa[id_col].to_numpy())
+    codes[pos[pos >= 0]] = lisa['lisa'].to_numpy()[pos >= 0]
+    ax.imshow(lut[index.raster(codes, fill=outside)], origin='lower', extent=index.extent,
+              interpolation='nearest')
+    ax.legend(handles=[Patch(color=c, label=l) for c, l in zip(LISA_COLORS, LISA_LABELS)],
+              loc='lower left', fontsize=9, frameon=False)
+    if title:
+        ax.set_title(title, fontsize=14, fontweight='bold')
+    ax.axis('off')
+    return ax
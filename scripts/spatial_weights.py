@@ -0,0 +1,107 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+# Sparse spatial weights and spatial lags on the grid panel.
+#
+# W is kept as a scipy CSR matrix in the row order of the coordinates it was
+# built from. Building it is the expensive part, so it is persisted as .npz
+# keyed on a hash of the coordinates and k; lagging is then a single
+# sparse x dense product for every year and variable at once.
+
+
+def weights_key(coords, k):
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    h = hashlib.sha256(coords.tobytes())
+    h.update(f'knn:{k}:{coords.shape}'.encode())
+    return h.hexdigest()[:20]
+
+
+def build_knn(coords, k=8):
+    """
+    Binary k-nearest-neighbour weights as CSR (same neighbours as
+    libpysal.weights.KNN.from_array with the default 'O' transform).
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    # leafsize=10 as in libpysal, so ties on the regular lattice break the same way
+    _, idx = cKDTree(coords, leafsize=10).query(coords, k=k + 1)
+    # Drop each site from its own neighbour list; with duplicate points the
+    # site may not be among the k+1, in which case the farthest one goes.
+    not_self = idx != np.arange(n)[:, None]
+    too_many = not_self.sum(axis=1) == k + 1
+    not_self[too_many, -1] = False
+    cols = idx[not_self].reshape(n, k)
+    indptr = np.arange(0, n * k + 1, k)
+    w = sparse.csr_matrix((np.ones(n * k), cols.ravel(), indptr), shape=(n, n))
+    w.sort_indices()
+    return w
+
+
+def knn_weights(coords, k=8, cache_dir=None):
+    """KNN weights, loaded from / saved to cache_dir when given."""
+    if cache_dir is None:
+        return build_knn(coords, k)
+    path = os.path.join(cache_dir, f'knn_k{k}_{weights_key(coords, k)}.npz')
+    if os.path.exists(path):
+        return sparse.load_npz(path).tocsr()
+    w = build_knn(coords, k)
+    os.makedirs(cache_dir, exist_ok=True)
+    sparse.save_npz(path, w)
+    return w
+
+
+def row_standardize(w):
+    rs = np.asarray(w.sum(axis=1)).ravel()
+    inv = np.divide(1.0, rs, out=np.zeros_like(rs, dtype=float), where=rs > 0)
+    return sparse.diags(inv) @ w
+
+
+def lag_panel(w, panel, variables, prefix='W_'):
+    """
+    Spatial lags of several GridPanel variables for all years in one product.
+
+    The panel's grid order must be the row order of w. Results are written
+    into the panel as '{prefix}{var}' and the panel is returned.
+    """
+    if w.shape[0] != len(panel.grid_ids):
+        raise ValueError(f"W is {w.shape[0]}x{w.shape[1]} but the panel has {len(panel.grid_ids)} cells")
+    variables = list(variables)
+    ks = [panel.var_pos(v) for v in variables]
+    x = panel.data[:, :, ks]                          # (n, T, m)
+    n, T, m = x.shape
+    lagged = (w @ x.reshape(n, T * m)).reshape(n, T, m)
+    names = [f'{prefix}{v}' for v in variables]
+    panel.add_variables(names)
+    panel.data[:, :, [panel.var_pos(nm) for nm in names]] = lagged
+    return panel
+
+
+def year_block_weights(years, coords, k=8):
+    """
+    Block-diagonal row-standardised KNN weights: each observation's neighbours
+    are the k nearest observations of the same year. Rows follow the input
+    order. Returns (W as CSR, list of row positions of each year block).
+    """
+    years = np.asarray(years)
+    coords = np.asarray(coords, dtype=np.float64)
+    rows, cols, vals, blocks = [], [], [], []
+    for t in pd.unique(years):
+        idx = np.flatnonzero(years == t)
+        blocks.append(idx)
+        if len(idx) < 2:
+            continue
+        wt = row_standardize(build_knn(coords[idx], k=min(k, len(idx) - 1))).tocoo()
+        rows.append(idx[wt.row])
+        cols.append(idx[wt.col])
+        vals.append(wt.data)
+    n = len(years)
+    if not rows:
+        return sparse.csr_matrix((n, n)), blocks
+    w = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(n, n))
+    w.sort_indices()
+    return w, blocks
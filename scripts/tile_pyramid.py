@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.colors import to_rgba
+from PIL import Image
+
+# XYZ PNG tile pyramid of per-cell panel variables, with an offline viewer.
+#
+# Tiles are in the grid's own projection: at the finest zoom (zmax) one pixel
+# is one lattice cell, and the lattice is placed at the top-left of a
+# 256 * 2**zmax square. Each layer is kept as additive channels per occupied
+# pixel (sum of values and number of valid cells for continuous variables,
+# counts per class for categorical ones, plus the number of grid cells), so a
+# coarser level is the 2 x 2 block sum of the finer one and is never
+# recomputed from the panel. Only occupied pixels are stored, so memory scales
+# with the number of cells, not with the size of the square.
+#
+# Every tile's pixels are hashed; tiles whose hash matches the manifest of the
+# last export are not re-encoded, so a rerun after a few cells change only
+# rewrites the tiles (at each zoom) that contain them.
+
+# Bump when tile rendering changes, to rewrite every tile
+PYRAMID_VERSION = 1
+
+TILE = 256
+BASE_COLOR = to_rgba('#E0E0E0', 0.4)      # grid cell without data
+
+
+def continuous_layer(title, cmap='Reds', vmin=None, vmax=None, label=None):
+    """Style of a numeric layer (cell value = mean of valid cells at coarser zooms)."""
+    return {'kind': 'continuous', 'title': title, 'cmap': cmap, 'vmin': vmin, 'vmax': vmax,
+            'label': label or title}
+
+
+def categorical_layer(title, colors, labels):
+    """Style of a class layer (cell value = most frequent class at coarser zooms)."""
+    return {'kind': 'categorical', 'title': title, 'colors': list(colors), 'labels': list(labels)}
+
+
+def zoom_levels(index):
+    """Finest zoom level for a GridIndex: one pixel per cell."""
+    return max(0, int(np.ceil(np.log2(max(index.shape) / TILE))))
+
+
+def _channels(values, style):
+    """(n x C) additive channels of one year's cell values (NaN / -1 = no data)."""
+    values = np.asarray(values)
+    if style['kind'] == 'continuous':
+        ok = ~np.isnan(values)
+        return np.column_stack([np.where(ok, values, 0), ok, np.ones(len(values))])
+    k = len(style['colors'])
+    onehot = (values[:, None] == np.arange(k)[None, :]).astype(float)
+    return np.column_stack([onehot, np.ones(len(values))])
+
+
+def _coarsen(r, c, data):
+    """Sum of the channels over 2 x 2 pixel blocks."""
+    r, c = r >> 1, c >> 1
+    key = r * (int(c.max()) + 1) + c
+    ukey, first, inv = np.unique(key, return_index=True, return_inverse=True)
+    out = np.column_stack([np.bincount(inv, weights=data[:, j], minlength=len(ukey))
+                           for j in range(data.shape[1])])
+    return r[first], c[first], out
+
+
+def _colors(data, style, norm):
+    """(n x 4) uint8 RGBA of aggregated pixels."""
+    if style['kind'] == 'continuous':
+        valid = data[:, 1] > 0
+        mean = np.divide(data[:, 0], data[:, 1], out=np.zeros(len(data)), where=valid)
+        vmin, vmax = norm
+        scaled = np.clip((mean - vmin) / (vmax - vmin if vmax > vmin else 1.0), 0, 1)
+        rgba = np.where(valid[:, None], colormaps[style['cmap']](scaled), BASE_COLOR)
+    else:
+        counts = data[:, :-1]
+        valid = counts.sum(axis=1) > 0
+        lut = np.array([to_rgba(c) for c in style['colors']])
+        rgba = np.where(valid[:, None], lut[counts.argmax(axis=1)], BASE_COLOR)
+    return np.round(rgba * 255).astype(np.uint8)
+
+
+def _tiles(r, c, rgba):
+    """(tile x, tile y, local rows, local cols, colours) for each occupied tile."""
+    tx, ty = c // TILE, r // TILE
+    key = ty * (int(tx.max()) + 1) + tx
+    order = np.argsort(key, kind='stable')
+    splits = np.flatnonzero(np.diff(key[order])) + 1
+    for idx in np.split(order, splits):
+        yield int(tx[idx[0]]), int(ty[idx[0]]), r[idx] % TILE, c[idx] % TILE, rgba[idx]
+
+
+def _write_tiles(base, r, c, rgba, zoom, manifest, seen):
+    """Write the changed tiles of one zoom level; returns the number written."""
+    written = 0
+    for x, y, lr, lc, col in _tiles(r, c, rgba):
+        tile_key = f'{zoom}/{x}/{y}'
+        h = hashlib.sha256(str(PYRAMID_VERSION).encode())
+        for a in (lr.astype(np.int32), lc.astype(np.int32), col):
+            h.update(np.ascontiguousarray(a).tobytes())
+        digest = h.hexdigest()
+        seen.add(tile_key)
+        path = os.path.join(base, str(zoom), str(x), f'{y}.png')
+        if manifest.get(tile_key) == digest and os.path.exists(path):
+            continue
+        img = np.zeros((TILE, TILE, 4), dtype=np.uint8)
+        img[lr, lc] = col
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.fromarray(img, 'RGBA').save(path)
+        manifest[tile_key] = digest
+        written += 1
+    return written
+
+
+def export_layer(index, values, style, out_dir, norm=None):
+    """
+    Tile pyramid of one layer-year into out_dir/{z}/{x}/{y}.png.
+    index:  GridIndex of the cells; values aligned with its positions.
+    norm:   (vmin, vmax) of continuous layers (shared across years).
+    Returns (tiles written, tiles unchanged).
+    """
+    zmax = zoom_levels(index)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # finest level: pixel row 0 is the northernmost lattice row
+    r = index.shape[0] - 1 - index.row
+    c = index.col.copy()
+    data = _channels(values, style)
+    written, seen = 0, set()
+    for zoom in range(zmax, -1, -1):
+        if zoom < zmax:
+            r, c, data = _coarsen(r, c, data)
+        written += _write_tiles(out_dir, r, c, _colors(data, style, norm), zoom, manifest, seen)
+
+    # tiles that are empty now
+    for tile_key in set(manifest) - seen:
+        path = os.path.join(out_dir, *tile_key.split('/')) + '.png'
+        if os.path.exists(path):
+            os.remove(path)
+        del manifest[tile_key]
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    return written, len(seen) - written
+
+
+def layer_norm(values_by_year, style, clip=(0.01, 0.99)):
+    """(vmin, vmax) of a continuous layer over all years, from its quantiles unless given."""
+    if style['kind'] != 'continuous':
+        return None
+    allv = np.concatenate([np.asarray(v, dtype=float) for v in values_by_year.values()])
+    allv = allv[~np.isnan(allv)]
+    if len(allv) == 0:
+        return (0.0, 1.0)
+    lo = style['vmin'] if style['vmin'] is not None else float(np.quantile(allv, clip[0]))
+    hi = style['vmax'] if style['vmax'] is not None else float(np.quantile(allv, clip[1]))
+    return (lo, hi)
+
+
+def legend(style, norm):
+    """Legend entries for the viewer."""
+    if style['kind'] == 'continuous':
+        stops = colormaps[style['cmap']](np.linspace(0, 1, 9))
+        return {'label': style['label'], 'vmin': norm[0], 'vmax': norm[1],
+                'stops': ['#%02x%02x%02x' % tuple(np.round(s[:3] * 255).astype(int)) for s in stops]}
+    return {'label': style['title'], 'colors': style['colors'], 'labels': style['labels']}
+
+
+def export_pyramid(index, layers, out_dir, crs=None):
+    """
+    layers: {name: (style, {year: values aligned with index positions})}.
+    Writes out_dir/{name}/{year}/{z}/{x}/{y}.png and out_dir/index.html.
+    Returns a list of {layer, year, written, unchanged}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    zmax = zoom_levels(index)
+    meta = {'zmax': zmax, 'tile': TILE, 'crs': crs, 'cell_size': index.size,
+            'x0': index.x0, 'y_top': index.y0 + index.shape[0] * index.size, 'layers': []}
+    rows = []
+    for name, (style, by_year) in layers.items():
+        norm = layer_norm(by_year, style)
+        for year, values in by_year.items():
+            written, unchanged = export_layer(index, values, style,
+                                              os.path.join(out_dir, name, str(year)), norm)
+            rows.append({'layer': name, 'year': year, 'written': written, 'unchanged': unchanged})
+        meta['layers'].append({'name': name, 'title': style['title'],
+                               'years': [str(y) for y in by_year], 'legend': legend(style, norm)})
+    with open(os.path.join(out_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(VIEWER_HTML.replace('__META__', json.dumps(meta)))
+    return rows
+
+
+# Self-contained viewer: no external scripts, metadata inlined so that it also
+# works when opened from disk (file://).
+VIEWER_HTML = r"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Volume vs Value - grid explorer</title>
+<style>
+  html, body { margin: 0; height: 100%; font-family: sans-serif; }
+  #map { position: absolute; inset: 0; overflow: hidden; background: #fff; cursor: grab; }
+  #map img { position: absolute; image-rendering: pixelated; user-select: none; pointer-events: none; }
+  #panel { position: absolute; top: 10px; left: 10px; background: rgba(255,255,255,0.92);
+           padding: 8px 10px; border: 1px solid #999; font-size: 13px; z-index: 2; }
+  #legend { margin-top: 6px; }
+  .sw { display: inline-block; width: 12px; height: 12px; margin-right: 4px; vertical-align: middle; }
+  #bar { height: 10px; width: 180px; }
+  #coords { position: absolute; bottom: 6px; left: 10px; font-size: 12px; z-index: 2;
+            background: rgba(255,255,255,0.8); padding: 2px 4px; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="panel">
+  <select id="layer"></select> <select id="year"></select>
+  <div id="legend"></div>
+</div>
+<div id="coords"></div>
+<script>
+const META = __META__;
+const map = document.getElementById('map');
+const layerSel = document.getElementById('layer'), yearSel = document.getElementById('year');
+// view: world pixels at zmax; screen px per world px = 2^(zoom - zmax)
+let cx = 0, cy = 0, zoom = 0, tiles = {};
+
+META.layers.forEach((l, i) => layerSel.add(new Option(l.title, i)));
+
+function currentLayer() { return META.layers[layerSel.value]; }
+
+function fillYears() {
+  const keep = yearSel.value;
+  yearSel.innerHTML = '';
+  currentLayer().years.forEach(y => yearSel.add(new Option(y, y)));
+  if (currentLayer().years.includes(keep)) yearSel.value = keep;
+  else yearSel.value = currentLayer().years[currentLayer().years.length - 1];
+}
+
+function drawLegend() {
+  const lg = currentLayer().legend, el = document.getElementById('legend');
+  if (lg.stops) {
+    el.innerHTML = '<div>' + lg.label + '</div><div id="bar" style="background: linear-gradient(to right,' +
+      lg.stops.join(',') + ')"></div><span>' + lg.vmin.toFixed(2) + '</span>' +
+      '<span style="float:right">' + lg.vmax.toFixed(2) + '</span>';
+  } else {
+    el.innerHTML = '<div>' + lg.label + '</div>' + lg.colors.map((c, i) =>
+      '<div><span class="sw" style="background:' + c + '"></span>' + lg.labels[i] + '</div>').join('');
+  }
+}
+
+function render() {
+  const w = map.clientWidth, h = map.clientHeight;
+  const z = Math.max(0, Math.min(META.zmax, Math.round(zoom)));
+  const scale = Math.pow(2, zoom - META.zmax);          // screen px per world px
+  const span = META.tile * Math.pow(2, META.zmax - z);  // world px per tile
+  const n = Math.pow(2, z);
+  const left = cx - w / 2 / scale, top = cy - h / 2 / scale;
+  const x0 = Math.max(0, Math.floor(left / span)), x1 = Math.min(n - 1, Math.floor((left + w / scale) / span));
+  const y0 = Math.max(0, Math.floor(top / span)), y1 = Math.min(n - 1, Math.floor((top + h / scale) / span));
+  const base = currentLayer().name + '/' + yearSel.value + '/' + z + '/';
+  const want = {};
+  for (let x = x0; x <= x1; x++) for (let y = y0; y <= y1; y++) {
+    const src = base + x + '/' + y + '.png';
+    want[src] = true;
+    let img = tiles[src];
+    if (!img) {
+      img = document.createElement('img');
+      img.onerror = () => { img.style.visibility = 'hidden'; };
+      img.src = src;
+      map.appendChild(img);
+      tiles[src] = img;
+    }
+    img.style.left = ((x * span - left) * scale) + 'px';
+    img.style.top = ((y * span - top) * scale) + 'px';
+    img.style.width = img.style.height = (span * scale) + 'px';
+  }
+  for (const src in tiles) if (!want[src]) { map.removeChild(tiles[src]); delete tiles[src]; }
+}
+
+function fit() {
+  const size = META.tile * Math.pow(2, META.zmax);
+  cx = cy = size / 2;
+  zoom = META.zmax + Math.log2(Math.min(map.clientWidth, map.clientHeight) / size);
+  render();
+}
+
+let drag = null;
+map.addEventListener('pointerdown', e => { drag = [e.clientX, e.clientY]; map.setPointerCapture(e.pointerId); });
+map.addEventListener('pointerup', () => { drag = null; });
+map.addEventListener('pointermove', e => {
+  const scale = Math.pow(2, zoom - META.zmax);
+  const wx = cx + (e.clientX - map.clientWidth / 2) / scale, wy = cy + (e.clientY - map.clientHeight / 2) / scale;
+  const x = META.x0 + wx * META.cell_size, y = META.y_top - wy * META.cell_size;
+  document.getElementById('coords').textContent = 'x ' + x.toFixed(0) + '  y ' + y.toFixed(0) + (META.crs ? '  (' + META.crs + ')' : '');
+  if (!drag) return;
+  cx -= (e.clientX - drag[0]) / scale; cy -= (e.clientY - drag[1]) / scale;
+  drag = [e.clientX, e.clientY];
+  render();
+});
+map.addEventListener('wheel', e => {
+  e.preventDefault();
+  const before = Math.pow(2, zoom - META.zmax);
+  const mx = e.clientX - map.clientWidth / 2, my = e.clientY - map.clientHeight / 2;
+  zoom = Math.max(-1, Math.min(META.zmax + 4, zoom - e.deltaY * 0.002));
+  const after = Math.pow(2, zoom - META.zmax);
+  // keep the point under the cursor fixed
+  cx += mx / before - mx / after; cy += my / before - my / after;
+  render();
+}, { passive: false });
+layerSel.onchange = () => { fillYears(); drawLegend(); render(); };
+yearSel.onchange = render;
+window.onresize = render;
+
+fillYears(); drawLegend(); fit();
+</script>
+</body>
+</html>
+"""